@@ -132,6 +132,7 @@ const analyze = async (req, res, next) => {
         files,
         cropHint,
         mode,
+        user: req.user,
       });
       predictions = generations.map(mapGenerationToPrediction);
     } else if (analyzeModel === "classifier") {
@@ -139,6 +140,7 @@ const analyze = async (req, res, next) => {
         files,
         cropHint,
         mode,
+        user: req.user,
       });
     } else {
       try {
@@ -146,6 +148,7 @@ const analyze = async (req, res, next) => {
           files,
           cropHint,
           mode,
+          user: req.user,
         });
       } catch (error) {
         if (!shouldFallbackToGenerate(error)) {
@@ -156,6 +159,7 @@ const analyze = async (req, res, next) => {
           files,
           cropHint,
           mode,
+          user: req.user,
         });
         predictions = generations.map(mapGenerationToPrediction);
       }
@@ -229,6 +233,7 @@ const analyzeGenerative = async (req, res, next) => {
       files,
       cropHint,
       mode,
+      user: req.user,
     });
 
     const responsePayload = generations.map((item) => {
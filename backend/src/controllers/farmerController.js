@@ -397,6 +397,7 @@ const scanQuality = async (req, res) => {
                 files,
                 cropHint: req.body.cropHint || null,
                 mode: "scanQuality",
+                user: req.user,
             });
 
             if (generated) {
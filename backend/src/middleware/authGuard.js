@@ -18,4 +18,20 @@ const authGuard = (req, res, next) => {
   }
 };
 
-module.exports = { authGuard };
+// For public routes that still want to know the caller when a valid token is sent.
+const optionalAuthGuard = (req, res, next) => {
+  const authHeader = req.headers.authorization || "";
+  const token = authHeader.startsWith("Bearer ") ? authHeader.slice(7) : null;
+
+  if (token) {
+    try {
+      const payload = verifyAccessToken(token);
+      req.user = { id: payload.sub, role: payload.role };
+    } catch (error) {
+      // Anonymous access is allowed, so an unusable token is ignored rather than rejected.
+    }
+  }
+  return next();
+};
+
+module.exports = { authGuard, optionalAuthGuard };
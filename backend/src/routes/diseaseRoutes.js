@@ -1,5 +1,6 @@
 const express = require("express");
 const { analyze, analyzeGenerative, recommendations } = require("../controllers/diseaseController");
+const { optionalAuthGuard } = require("../middleware/authGuard");
 const { parseDiseaseImages } = require("../middleware/diseaseUpload");
 const { createRateLimiter } = require("../middleware/rateLimit");
 
@@ -8,6 +9,7 @@ const router = express.Router();
 router.post(
   "/analyze",
   createRateLimiter({ key: "disease-analyze", windowMs: 60_000, maxRequests: 20 }),
+  optionalAuthGuard,
   parseDiseaseImages,
   analyze,
 );
@@ -15,6 +17,7 @@ router.post(
 router.post(
   "/generate",
   createRateLimiter({ key: "disease-generate", windowMs: 60_000, maxRequests: 20 }),
+  optionalAuthGuard,
   parseDiseaseImages,
   analyzeGenerative,
 );
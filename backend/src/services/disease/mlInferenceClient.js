@@ -146,6 +146,16 @@ const buildInferenceMultipartBody = ({ files, cropHint, mode }) => {
   };
 };
 
+// The ML service queues requests fairly per user, so it needs to know who is asking.
+const buildIdentityHeaders = (user) => {
+  const headers = {};
+  const userId = sanitizeHeaderToken(user?.id);
+  const role = sanitizeHeaderToken(user?.role);
+  if (userId) headers["X-User-Id"] = userId;
+  if (role) headers["X-User-Role"] = role;
+  return headers;
+};
+
 const createRequestPayloadFactory = ({ files, cropHint, mode }) => {
   if (supportsFetchMultipart()) {
     return () => ({
@@ -161,7 +171,7 @@ const createRequestPayloadFactory = ({ files, cropHint, mode }) => {
   });
 };
 
-const requestWithNodeHttp = ({ baseUrl, endpoint, multipart, timeoutMs }) =>
+const requestWithNodeHttp = ({ baseUrl, endpoint, multipart, headers, timeoutMs }) =>
   new Promise((resolve, reject) => {
     let target;
     try {
@@ -178,6 +188,7 @@ const requestWithNodeHttp = ({ baseUrl, endpoint, multipart, timeoutMs }) =>
       port: target.port || undefined,
       path: `${target.pathname}${target.search}`,
       headers: {
+        ...headers,
         "Content-Type": multipart.contentType,
         "Content-Length": multipart.body.length,
       },
@@ -269,7 +280,7 @@ const isTimeoutError = (error) => {
   );
 };
 
-const callMlService = async ({ endpoint, payloadFactory, timeoutMs }) => {
+const callMlService = async ({ endpoint, payloadFactory, headers = {}, timeoutMs }) => {
   const serviceCandidates = buildServiceCandidates();
 
   try {
@@ -284,6 +295,7 @@ const callMlService = async ({ endpoint, payloadFactory, timeoutMs }) => {
           try {
             response = await fetch(`${baseUrl}${endpoint}`, {
               method: "POST",
+              headers,
               body: payload.formData,
               signal: controller.signal,
             });
@@ -295,6 +307,7 @@ const callMlService = async ({ endpoint, payloadFactory, timeoutMs }) => {
             baseUrl,
             endpoint,
             multipart: payload.multipart,
+            headers,
             timeoutMs,
           });
         }
@@ -373,14 +386,19 @@ const callMlService = async ({ endpoint, payloadFactory, timeoutMs }) => {
   }
 };
 
-const predictDiseaseBatch = async ({ files, cropHint, mode }) => {
+const predictDiseaseBatch = async ({ files, cropHint, mode, user }) => {
   const timeoutMs = Number(process.env.ML_SERVICE_TIMEOUT_MS || DEFAULT_TIMEOUT_MS);
   const payloadFactory = createRequestPayloadFactory({ files, cropHint, mode });
-  const payload = await callMlService({ endpoint: "/predict", payloadFactory, timeoutMs });
+  const payload = await callMlService({
+    endpoint: "/predict",
+    payloadFactory,
+    headers: buildIdentityHeaders(user),
+    timeoutMs,
+  });
   return payload.map(normalizeMlPrediction);
 };
 
-const generateDiseaseBatch = async ({ files, cropHint, mode }) => {
+const generateDiseaseBatch = async ({ files, cropHint, mode, user }) => {
   const configuredGenerateTimeout = Number(process.env.ML_SERVICE_GENERATE_TIMEOUT_MS || 0);
   const baseTimeout = Number(process.env.ML_SERVICE_TIMEOUT_MS || DEFAULT_TIMEOUT_MS);
   const timeoutMs =
@@ -388,7 +406,12 @@ const generateDiseaseBatch = async ({ files, cropHint, mode }) => {
       ? configuredGenerateTimeout
       : Math.max(baseTimeout, DEFAULT_GENERATE_TIMEOUT_MS);
   const payloadFactory = createRequestPayloadFactory({ files, cropHint, mode });
-  const payload = await callMlService({ endpoint: "/generate", payloadFactory, timeoutMs });
+  const payload = await callMlService({
+    endpoint: "/generate",
+    payloadFactory,
+    headers: buildIdentityHeaders(user),
+    timeoutMs,
+  });
   return payload.map(normalizeMlGeneration);
 };
 
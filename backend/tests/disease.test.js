@@ -9,6 +9,7 @@ process.env.LLM_MODEL = "test-model";
 
 const request = require("supertest");
 const { app } = require("../src/app");
+const { signAccessToken } = require("../src/utils/token");
 
 describe("Disease API", () => {
   const originalFetch = global.fetch;
@@ -69,6 +70,26 @@ describe("Disease API", () => {
     expect(String(global.fetch.mock.calls[0][0])).toContain("/predict");
   });
 
+  test("POST /api/disease/analyze forwards the signed-in user to the ML service", async () => {
+    const fakeJpeg = Buffer.from([0xff, 0xd8, 0xff, 0xdb, 0x00, 0x43, 0x00, 0xff, 0xd9]);
+    const token = signAccessToken({ id: "farmer-42", role: "FARMER" });
+
+    const res = await request(app)
+      .post("/api/disease/analyze")
+      .set("Authorization", `Bearer ${token}`)
+      .field("cropHint", "auto")
+      .attach("images", fakeJpeg, {
+        filename: "leaf.jpg",
+        contentType: "image/jpeg",
+      });
+
+    expect(res.status).toBe(200);
+    expect(global.fetch.mock.calls[0][1].headers).toEqual({
+      "X-User-Id": "farmer-42",
+      "X-User-Role": "FARMER",
+    });
+  });
+
   test("POST /api/disease/generate returns diagnosis and recommendation", async () => {
     global.fetch = jest.fn().mockResolvedValueOnce({
       ok: true,
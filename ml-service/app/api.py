@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from typing import Annotated
 import os
 
@@ -10,16 +11,36 @@ try:
 except ImportError:
     pass  # python-dotenv not installed; rely on shell environment
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+import numpy as np
+from fastapi import FastAPI, File, Form, Header, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
 try:
-    from .inference import create_inference_service, create_paligemma_generation_service
+    from .inference import (
+        FrameSizeError, _coerce_float, _coerce_int, create_inference_service, create_paligemma_generation_service)
+    from .jobs import JOB_KINDS, BulkJobRunner, ProcessorUnavailable, create_job_store, iter_archive_images, job_db_path
+    from .scheduler import LANES, QueueFull, client_identity, create_scheduler
 except ImportError:  # pragma: no cover - allows `uvicorn api:app` from ./app
-    from inference import create_inference_service, create_paligemma_generation_service
+    from inference import (
+        FrameSizeError, _coerce_float, _coerce_int, create_inference_service, create_paligemma_generation_service)
+    from jobs import JOB_KINDS, BulkJobRunner, ProcessorUnavailable, create_job_store, iter_archive_images, job_db_path
+    from scheduler import LANES, QueueFull, client_identity, create_scheduler
 
 
-app = FastAPI(title="Crop Disease Inference Service", version="1.0.0")
+@asynccontextmanager
+async def lifespan(_app):
+    # Jobs persisted by a previous process resume as soon as the service is up.
+    if os.path.exists(job_db_path()):
+        get_job_runner()
+    yield
+    if job_runner is not None:
+        job_runner.stop()
+    for scheduler in schedulers.values():
+        scheduler.stop()
+
+
+app = FastAPI(title="Crop Disease Inference Service", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,13 +55,23 @@ app.add_middleware(
 _model_path = os.getenv("MODEL_PATH", "").strip()
 inference_service = create_inference_service() if _model_path else None
 paligemma_generation_service = None
+job_runner = None
+# Interactive requests run before queued bulk work and are served fairly across clients.
+# Predict keeps bulk batches on their own low-priority worker so scans stay fast while jobs
+# drain. PaliGemma has a single shared worker at normal priority, so bulk generation goes
+# one image per task instead.
+schedulers = {
+    "predict": create_scheduler("predict", workers=1, reserved_interactive=1, bulk_workers=1),
+    "generate": create_scheduler("generate", workers=1, reserved_interactive=0, bulk_task_size=1),
+}
 
 
 def get_paligemma_generation_service():
     global paligemma_generation_service
     if paligemma_generation_service is None:
         try:
-            paligemma_generation_service = create_paligemma_generation_service()
+            paligemma_generation_service = create_paligemma_generation_service(
+                embedder=inference_service)
         except (MemoryError, RuntimeError) as exc:
             # OOM or CUDA out-of-memory: surface as 503 so the caller can degrade
             # gracefully instead of crashing the worker process.
@@ -51,6 +82,70 @@ def get_paligemma_generation_service():
     return paligemma_generation_service
 
 
+def _run_predict_job(files, *, crop_hint="auto"):
+    if inference_service is None:
+        raise ProcessorUnavailable("Torch classifier model is not configured (missing MODEL_PATH).")
+    return inference_service.predict_many(files, crop_hint=crop_hint)
+
+
+def _run_generate_job(files, *, crop_hint="auto"):
+    try:
+        service = get_paligemma_generation_service()
+    except HTTPException as exc:
+        raise ProcessorUnavailable(exc.detail) from exc
+    return service.generate_many(files, crop_hint=crop_hint)
+
+
+def get_job_runner() -> BulkJobRunner:
+    global job_runner
+    if job_runner is None:
+        job_runner = BulkJobRunner(
+            create_job_store(),
+            {"predict": _run_predict_job, "generate": _run_generate_job},
+            batch_size=_coerce_int(os.getenv("BULK_JOB_BATCH_SIZE"), 32),
+            pause_seconds=_coerce_float(os.getenv("BULK_JOB_PAUSE_SECONDS"), 0.05),
+            schedulers=schedulers,
+        )
+        job_runner.start()
+    return job_runner
+
+
+def require_admin(token: str | None) -> None:
+    expected = os.getenv("ML_ADMIN_TOKEN", "").strip()
+    if not expected:
+        raise HTTPException(
+            status_code=403, detail="Admin endpoints are disabled (set ML_ADMIN_TOKEN to enable them)")
+    if token != expected:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def request_lane(priority: str | None, image_count: int) -> str:
+    """Callers can only lower their priority; requests over `INTERACTIVE_MAX_IMAGES` always run as bulk."""
+    requested = (priority or "interactive").strip().lower()
+    if requested not in LANES:
+        raise HTTPException(status_code=400, detail=f"X-Request-Priority must be one of {', '.join(LANES)}")
+    if requested == "bulk" or image_count > _coerce_int(os.getenv("INTERACTIVE_MAX_IMAGES"), 5):
+        return "bulk"
+    return "interactive"
+
+
+async def run_scheduled(kind: str, fn, *, lane: str, user_id: str | None, role: str | None, cost: int):
+    try:
+        return await schedulers[kind].run(
+            fn, lane=lane, client=client_identity(user_id, role), role=role, cost=cost)
+    except QueueFull as exc:
+        raise HTTPException(status_code=429, detail=str(exc)) from exc
+
+
+def get_model_registry():
+    if inference_service is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Torch classifier model is not configured (missing MODEL_PATH).",
+        )
+    return inference_service.registry
+
+
 @app.get("/")
 def read_root():
     return {
@@ -64,11 +159,28 @@ def health():
     return {"status": "ok"}
 
 
+def selection_options(selection: str | None, top_k: int | None) -> dict:
+    normalized = (selection or "all").strip().lower()
+    if normalized not in {"all", "best"}:
+        raise HTTPException(
+            status_code=400, detail="selection must be 'all' or 'best'")
+    if normalized == "all":
+        return {}
+    if top_k is not None and top_k < 1:
+        raise HTTPException(status_code=400, detail="topK must be at least 1")
+    return {"selection": "best", "top_k": top_k or 1}
+
+
 @app.post("/predict")
 async def predict(
     images: Annotated[list[UploadFile], File(...)],
     cropHint: Annotated[str | None, Form()] = "auto",
     mode: Annotated[str | None, Form()] = None,
+    selection: Annotated[str | None, Form()] = None,
+    topK: Annotated[int | None, Form()] = None,
+    x_user_id: Annotated[str | None, Header()] = None,
+    x_user_role: Annotated[str | None, Header()] = None,
+    x_request_priority: Annotated[str | None, Header()] = None,
 ):
     if inference_service is None:
         raise HTTPException(
@@ -82,6 +194,8 @@ async def predict(
     if len(images) > 5:
         raise HTTPException(
             status_code=400, detail="Maximum 5 images are allowed")
+    frame_selection = selection_options(selection, topK)
+    lane = request_lane(x_request_priority, len(images))
 
     collected_files: list[tuple[str, bytes]] = []
     for image in images:
@@ -95,23 +209,127 @@ async def predict(
         collected_files.append((image.filename or "upload.jpg", content))
 
     try:
-        results = inference_service.predict_many(
-            collected_files, crop_hint=cropHint or "auto")
+        results = await run_scheduled(
+            "predict",
+            lambda: inference_service.predict_many(collected_files, crop_hint=cropHint or "auto", **frame_selection),
+            lane=lane,
+            user_id=x_user_id,
+            role=x_user_role,
+            cost=len(collected_files),
+        )
         for result in results:
             result.pop("fileName", None)
             if mode:
                 result["mode"] = mode
         return results
+    except HTTPException:
+        raise
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(
             status_code=500, detail=f"Inference failed: {str(exc)}") from exc
 
 
+def parse_tensor_shape(
+    dtype: str | None, shape: str | None, frame_size: tuple[int, int] | None = None
+) -> tuple[int, int, int, int]:
+    """Frame layout from `X-Tensor-Dtype` and `X-Tensor-Shape` (`N,H,W,3` or `H,W,3`), checked before any body is read.
+
+    `frame_size` is the model's `(width, height)`; frames of any other size are rejected.
+    """
+    if (dtype or "").strip().lower() != "uint8":
+        raise HTTPException(status_code=400, detail="X-Tensor-Dtype must be uint8")
+    try:
+        dims = tuple(int(dim) for dim in (shape or "").replace("x", ",").split(","))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="X-Tensor-Shape must be comma-separated integers") from exc
+    if len(dims) == 3:
+        dims = (1, *dims)
+    if len(dims) != 4 or dims[3] != 3 or min(dims) < 1:
+        raise HTTPException(status_code=400, detail="X-Tensor-Shape must be N,H,W,3 or H,W,3")
+    max_images = _coerce_int(os.getenv("RAW_PREDICT_MAX_IMAGES"), 64)
+    if dims[0] > max_images:
+        raise HTTPException(status_code=400, detail=f"Maximum {max_images} frames are allowed")
+    if int(np.prod(dims)) > max_images * 224 * 224 * 3:
+        raise HTTPException(status_code=413, detail="X-Tensor-Shape exceeds the raw body size limit")
+    if frame_size is not None and (dims[2], dims[1]) != tuple(frame_size):
+        width, height = frame_size
+        raise HTTPException(status_code=400, detail=f"X-Tensor-Shape frames must be {height},{width},3 for this model")
+    return dims
+
+
+async def read_raw_pixels(request: Request, dims: tuple[int, int, int, int]) -> np.ndarray:
+    expected = int(np.prod(dims))
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.strip() != str(expected):
+        raise HTTPException(
+            status_code=400, detail=f"Content-Length is {declared} but X-Tensor-Shape needs {expected} bytes")
+    # Chunked bodies carry no length, so stop reading as soon as one runs past the declared shape.
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > expected:
+            raise HTTPException(status_code=400, detail=f"Body is larger than the {expected} bytes X-Tensor-Shape needs")
+    if len(body) != expected:
+        raise HTTPException(
+            status_code=400, detail=f"Body has {len(body)} bytes but X-Tensor-Shape needs {expected}")
+    return np.frombuffer(bytes(body), dtype=np.uint8).reshape(dims)
+
+
+@app.post("/predict/raw")
+async def predict_raw(
+    request: Request,
+    cropHint: str = "auto",
+    mode: str | None = None,
+    quality: bool = True,
+    x_tensor_dtype: Annotated[str | None, Header()] = None,
+    x_tensor_shape: Annotated[str | None, Header()] = None,
+    x_user_id: Annotated[str | None, Header()] = None,
+    x_user_role: Annotated[str | None, Header()] = None,
+    x_request_priority: Annotated[str | None, Header()] = None,
+):
+    if inference_service is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Torch classifier model is not configured (missing MODEL_PATH). Only /generate is available.",
+        )
+    dims = parse_tensor_shape(x_tensor_dtype, x_tensor_shape, inference_service.frame_size)
+    lane = request_lane(x_request_priority, dims[0])
+    pixels = await read_raw_pixels(request, dims)
+
+    try:
+        results = await run_scheduled(
+            "predict",
+            lambda: inference_service.predict_pixels(pixels, crop_hint=cropHint or "auto", quality_check=quality),
+            lane=lane,
+            user_id=x_user_id,
+            role=x_user_role,
+            cost=len(pixels),
+        )
+    except HTTPException:
+        raise
+    except FrameSizeError as exc:
+        # A pooled specialist whose input size differs from the primary's.
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    except Exception as exc:  # noqa: BLE001
+        raise HTTPException(
+            status_code=500, detail=f"Inference failed: {str(exc)}") from exc
+    for result in results:
+        result.pop("fileName", None)
+        if mode:
+            result["mode"] = mode
+    return results
+
+
 @app.post("/generate")
 async def generate(
     images: Annotated[list[UploadFile], File(...)],
     cropHint: Annotated[str | None, Form()] = "auto",
     mode: Annotated[str | None, Form()] = None,
+    selection: Annotated[str | None, Form()] = None,
+    topK: Annotated[int | None, Form()] = None,
+    x_user_id: Annotated[str | None, Header()] = None,
+    x_user_role: Annotated[str | None, Header()] = None,
+    x_request_priority: Annotated[str | None, Header()] = None,
 ):
     if len(images) == 0:
         raise HTTPException(
@@ -119,6 +337,8 @@ async def generate(
     if len(images) > 5:
         raise HTTPException(
             status_code=400, detail="Maximum 5 images are allowed")
+    frame_selection = selection_options(selection, topK)
+    lane = request_lane(x_request_priority, len(images))
 
     collected_files: list[tuple[str, bytes]] = []
     for image in images:
@@ -133,18 +353,167 @@ async def generate(
 
     try:
         service = get_paligemma_generation_service()
-        results = service.generate_many(
-            collected_files, crop_hint=cropHint or "auto")
+        results = await run_scheduled(
+            "generate",
+            lambda: service.generate_many(collected_files, crop_hint=cropHint or "auto", **frame_selection),
+            lane=lane,
+            user_id=x_user_id,
+            role=x_user_role,
+            cost=len(collected_files),
+        )
         for result in results:
             result.pop("fileName", None)
             if mode:
                 result["mode"] = mode
         return results
+    except HTTPException:
+        raise
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(
             status_code=500, detail=f"Generation failed: {str(exc)}") from exc
 
 
+@app.post("/jobs", status_code=202)
+async def create_job(
+    images: Annotated[list[UploadFile] | None, File()] = None,
+    archive: Annotated[UploadFile | None, File()] = None,
+    kind: Annotated[str, Form()] = "predict",
+    cropHint: Annotated[str | None, Form()] = "auto",
+    x_user_id: Annotated[str | None, Header()] = None,
+    x_user_role: Annotated[str | None, Header()] = None,
+):
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(JOB_KINDS)}")
+    if kind == "predict" and inference_service is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Torch classifier model is not configured (missing MODEL_PATH). Only generate jobs are available.",
+        )
+    if not images and archive is None:
+        raise HTTPException(status_code=400, detail="Provide images or an archive")
+
+    collected_files: list[tuple[str, bytes]] = []
+    for image in images or []:
+        if not image.content_type or not image.content_type.startswith("image/"):
+            raise HTTPException(
+                status_code=400, detail=f"File '{image.filename}' must be an image")
+        content = await image.read()
+        if len(content) == 0:
+            raise HTTPException(
+                status_code=400, detail=f"File '{image.filename}' is empty")
+        collected_files.append((image.filename or "upload.jpg", content))
+
+    def job_files():
+        yield from collected_files
+        if archive is not None:
+            yield from iter_archive_images(archive.file)
+
+    runner = get_job_runner()
+    try:
+        # Extracting and writing thousands of images would otherwise block the event loop.
+        job = await run_in_threadpool(
+            runner.store.create_job,
+            kind,
+            job_files(),
+            crop_hint=cropHint or "auto",
+            max_images=_coerce_int(os.getenv("BULK_JOB_MAX_IMAGES"), 10000),
+            client_id=client_identity(x_user_id, x_user_role),
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    runner.notify()
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = get_job_runner().store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/results")
+def get_job_results(job_id: str, offset: int = 0, limit: int = 100):
+    store = get_job_runner().store
+    job = store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if offset < 0 or not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit between 1 and 500")
+    items = store.list_results(job_id, offset=offset, limit=limit)
+    next_offset = offset + len(items)
+    return {
+        "jobId": job_id,
+        "status": job["status"],
+        "total": job["total"],
+        "offset": offset,
+        "items": items,
+        "nextOffset": next_offset if next_offset < job["total"] else None,
+    }
+
+
+@app.get("/admin/models")
+def admin_models(x_admin_token: Annotated[str | None, Header()] = None):
+    require_admin(x_admin_token)
+    status = get_model_registry().status()
+    model_pool = inference_service.model_pool
+    status["pool"] = model_pool.status() if model_pool is not None else None
+    return status
+
+
+@app.get("/admin/scheduler")
+def admin_scheduler(x_admin_token: Annotated[str | None, Header()] = None):
+    require_admin(x_admin_token)
+    return {kind: scheduler.status() for kind, scheduler in schedulers.items()}
+
+
+@app.post("/admin/models/reload", status_code=202)
+def admin_reload_model(
+    x_admin_token: Annotated[str | None, Header()] = None,
+    modelPath: Annotated[str | None, Form()] = None,
+    canaryWeight: Annotated[float | None, Form()] = None,
+):
+    require_admin(x_admin_token)
+    registry = get_model_registry()
+    model_path = (modelPath or "").strip() or None
+    if model_path is None and registry.primary is not None:
+        model_path = registry.primary.source_path
+    if canaryWeight is not None and not 0.0 <= canaryWeight <= 1.0:
+        raise HTTPException(status_code=400, detail="canaryWeight must be between 0 and 1")
+
+    if not registry.reload_async(model_path, canary_weight=canaryWeight):
+        raise HTTPException(status_code=409, detail="A model reload is already in progress")
+    return registry.status()
+
+
+@app.post("/admin/models/split")
+def admin_model_split(
+    canaryWeight: Annotated[float, Form()],
+    x_admin_token: Annotated[str | None, Header()] = None,
+):
+    require_admin(x_admin_token)
+    registry = get_model_registry()
+    if not 0.0 <= canaryWeight <= 1.0:
+        raise HTTPException(status_code=400, detail="canaryWeight must be between 0 and 1")
+    try:
+        registry.set_canary_weight(canaryWeight)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    return registry.status()
+
+
+@app.post("/admin/models/promote")
+def admin_promote_model(x_admin_token: Annotated[str | None, Header()] = None):
+    require_admin(x_admin_token)
+    registry = get_model_registry()
+    try:
+        registry.promote_canary()
+    except RuntimeError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    return registry.status()
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,299 @@
+import argparse
+import csv
+import glob
+import itertools
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+try:
+    from .inference import ImageQualityChecker, TorchDiseaseModel, _normalize_crop_hint, _resize_pixels
+except ImportError:  # pragma: no cover - allows `python bulk_inference.py` from ./app
+    from inference import ImageQualityChecker, TorchDiseaseModel, _normalize_crop_hint, _resize_pixels
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+OUTPUT_FORMATS = ("csv", "jsonl")
+CSV_FIELDS = (
+    "path",
+    "label",
+    "cropType",
+    "disease",
+    "candidateDisease",
+    "confidence",
+    "margin",
+    "isUncertain",
+    "thresholdApplied",
+    "topPredictions",
+    "warnings",
+    "modelVersion",
+    "error",
+)
+_RESUME_CHUNK_BYTES = 1 << 20
+
+
+@dataclass
+class ImageSource:
+    """Re-iterable, deterministically ordered image paths from a directory, a glob or a CSV manifest."""
+
+    input_dir: str | None = None
+    pattern: str | None = None
+    manifest_path: str | None = None
+    images_root: str | None = None
+
+    def _iter_dir(self) -> Iterator[str]:
+        for root, dirs, files in os.walk(self.input_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    yield os.path.join(root, name)
+
+    def _iter_manifest(self) -> Iterator[str]:
+        manifest_dir = os.path.dirname(os.path.abspath(self.manifest_path))
+        with open(self.manifest_path, "r", encoding="utf-8-sig", newline="") as handle:
+            for row in csv.DictReader(handle):
+                image_ref = str(row.get("image_path") or row.get("path") or row.get("image") or "").strip()
+                if os.path.isabs(image_ref):
+                    yield image_ref
+                    continue
+                candidate = os.path.join(self.images_root, image_ref) if self.images_root else None
+                yield candidate if candidate and os.path.exists(candidate) else os.path.join(manifest_dir, image_ref)
+
+    def __iter__(self) -> Iterator[str]:
+        if self.manifest_path:
+            return self._iter_manifest()
+        if self.pattern:
+            return iter(sorted(glob.glob(self.pattern, recursive=True)))
+        if self.input_dir:
+            return self._iter_dir()
+        raise ValueError("Provide an input directory, a glob pattern or a manifest path")
+
+
+class DecodedBatches(IterableDataset):
+    """Batches of resized uint8 pixels decoded in DataLoader workers.
+
+    Batch b is decoded by worker b % num_workers, which is the order the
+    DataLoader collects worker output in, so batches come back in source
+    order. Each item is a dict of paths, pixels (N, H, W, 3), per-image errors
+    and quality warnings; undecodable images keep their slot with an error.
+    """
+
+    def __init__(
+        self,
+        source: ImageSource,
+        *,
+        batch_size: int,
+        image_size: tuple[int, int],
+        resample: int,
+        start: int = 0,
+        quality_check: bool = True,
+    ):
+        self.source = source
+        self.batch_size = max(1, int(batch_size))
+        self.image_size = image_size
+        self.resample = resample
+        self.start = max(0, int(start))
+        self.quality_checker = ImageQualityChecker() if quality_check else None
+
+    def _decode(self, paths: list[str]) -> dict[str, Any]:
+        width, height = self.image_size
+        pixels = np.zeros((len(paths), height, width, 3), dtype=np.uint8)
+        errors: list[str | None] = [None] * len(paths)
+        warnings: list[list[str]] = [[] for _ in paths]
+        for slot, path in enumerate(paths):
+            try:
+                with Image.open(path) as image:
+                    image = image.convert("RGB")
+                if self.quality_checker is not None:
+                    warnings[slot] = self.quality_checker.assess(image).warnings
+                pixels[slot] = _resize_pixels(image, self.image_size, self.resample)
+            except Exception as exc:  # noqa: BLE001
+                errors[slot] = f"{type(exc).__name__}: {exc}"
+        return {"paths": paths, "pixels": pixels, "errors": errors, "warnings": warnings}
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        paths = itertools.islice(iter(self.source), self.start, None)
+        for batch_index in itertools.count():
+            batch = list(itertools.islice(paths, self.batch_size))
+            if not batch:
+                return
+            if batch_index % num_workers == worker_id:
+                yield self._decode(batch)
+
+
+def _completed_records(output_path: str, output_format: str) -> int:
+    """Records already in `output_path`, after dropping a partially written last line."""
+    if not os.path.exists(output_path):
+        return 0
+    # Back-fill outputs can run to gigabytes, so both passes read fixed-size chunks.
+    with open(output_path, "rb+") as handle:
+        size = handle.seek(0, os.SEEK_END)
+        complete = size
+        while complete > 0:
+            start = max(0, complete - _RESUME_CHUNK_BYTES)
+            handle.seek(start)
+            newline = handle.read(complete - start).rfind(b"\n")
+            if newline >= 0:
+                complete = start + newline + 1
+                break
+            complete = start
+        if complete != size:
+            handle.truncate(complete)
+        handle.seek(0)
+        lines = sum(chunk.count(b"\n") for chunk in iter(lambda: handle.read(_RESUME_CHUNK_BYTES), b""))
+    if output_format == "csv":
+        return max(0, lines - 1)
+    return lines
+
+
+def _output_record(path: str, prediction: dict[str, Any] | None, *, warnings: list[str], error: str | None,
+                   model_version: str, top_k: int) -> dict[str, Any]:
+    prediction = prediction or {}
+    top_predictions = prediction.get("topPredictions", [])[:top_k]
+    return {
+        "path": path,
+        "label": top_predictions[0]["label"] if top_predictions else None,
+        "cropType": prediction.get("cropType"),
+        "disease": prediction.get("disease"),
+        "candidateDisease": prediction.get("candidateDisease"),
+        "confidence": prediction.get("confidence"),
+        "margin": prediction.get("margin"),
+        "isUncertain": prediction.get("isUncertain"),
+        "thresholdApplied": prediction.get("thresholdApplied"),
+        "topPredictions": top_predictions,
+        "warnings": warnings,
+        "modelVersion": model_version,
+        "error": error,
+    }
+
+
+def run_bulk_inference(
+    model: TorchDiseaseModel,
+    source: ImageSource,
+    output_path: str,
+    *,
+    output_format: str = "jsonl",
+    batch_size: int = 256,
+    num_workers: int = 0,
+    crop_hint: str = "auto",
+    top_k: int = 3,
+    quality_check: bool = True,
+    log_every: int = 20,
+) -> dict[str, Any]:
+    """Score every image of `source` with `model` and append one record per image to `output_path`.
+
+    Records are written in source order and flushed per batch, so an
+    interrupted run resumes from the last complete record.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}, got {output_format!r}")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    start = _completed_records(output_path, output_format)
+    if start:
+        print(f"Resuming after {start} records already in {output_path}")
+
+    dataset = DecodedBatches(
+        source,
+        batch_size=batch_size,
+        image_size=model.image_size,
+        resample=model._resample,
+        start=start,
+        quality_check=quality_check,
+    )
+    loader = DataLoader(dataset, batch_size=None, num_workers=num_workers)
+    crop_hint = _normalize_crop_hint(crop_hint)
+
+    written = failed = 0
+    started = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8", newline="") as handle:
+        writer = None
+        if output_format == "csv":
+            writer = csv.DictWriter(handle, fieldnames=CSV_FIELDS)
+            if start == 0:
+                writer.writeheader()
+
+        for batch_number, batch in enumerate(loader, start=1):
+            decoded = [slot for slot, error in enumerate(batch["errors"]) if error is None]
+            predictions: list[dict[str, Any] | None] = [None] * len(batch["paths"])
+            if decoded:
+                pixels = np.ascontiguousarray(np.asarray(batch["pixels"])[decoded])
+                for slot, prediction in zip(decoded, model.predict_pixels(pixels, crop_hint=crop_hint)):
+                    predictions[slot] = prediction
+
+            for path, prediction, warnings, error in zip(
+                    batch["paths"], predictions, batch["warnings"], batch["errors"]):
+                record = _output_record(
+                    path, prediction, warnings=warnings, error=error, model_version=model.model_version, top_k=top_k)
+                if writer is not None:
+                    record["topPredictions"] = json.dumps(record["topPredictions"])
+                    record["warnings"] = "; ".join(record["warnings"])
+                    writer.writerow(record)
+                else:
+                    handle.write(json.dumps(record) + "\n")
+            handle.flush()
+            written += len(batch["paths"])
+            failed += len(batch["paths"]) - len(decoded)
+
+            if log_every and batch_number % log_every == 0:
+                elapsed = time.perf_counter() - started
+                print(f"{start + written} images scored ({written / max(elapsed, 1e-9):.1f} images/sec)")
+
+    elapsed = time.perf_counter() - started
+    return {
+        "output": output_path,
+        "resumed_from": start,
+        "written": written,
+        "failed": failed,
+        "total": start + written,
+        "seconds": round(elapsed, 2),
+        "images_per_sec": round(written / max(elapsed, 1e-9), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a directory, glob or manifest of images offline in large batches")
+    parser.add_argument("--input_dir", type=str, default=None, help="Directory scanned recursively for images")
+    parser.add_argument("--glob", type=str, default=None, help="Glob pattern (recursive ** allowed), e.g. 'scans/2025-*/*.jpg'")
+    parser.add_argument("--manifest_path", type=str, default=None, help="CSV manifest with an image_path/path/image column")
+    parser.add_argument("--manifest_images_root", type=str, default=None, help="Optional manifest images root")
+    parser.add_argument("--output", type=str, required=True, help="Output file; an existing file is resumed")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=None, help="Output format (default from the extension)")
+    parser.add_argument("--model_path", type=str, default=None, help="Classifier checkpoint (default MODEL_PATH)")
+    parser.add_argument("--batch_size", type=int, default=256, help="Images per forward pass")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count() or 1, help="Decode workers")
+    parser.add_argument("--crop_hint", type=str, default="auto", help="auto, beans or maize")
+    parser.add_argument("--top_k", type=int, default=3, help="Top predictions kept per image (at most 3)")
+    parser.add_argument("--no_quality", action="store_true", help="Skip the blur/brightness quality check")
+
+    args = parser.parse_args()
+    if sum(bool(value) for value in (args.input_dir, args.glob, args.manifest_path)) != 1:
+        parser.error("Provide exactly one of --input_dir, --glob or --manifest_path")
+
+    model = TorchDiseaseModel(model_path=args.model_path)
+    model.max_batch_size = max(1, args.batch_size)
+    model.load_model()
+    summary = run_bulk_inference(
+        model,
+        ImageSource(
+            input_dir=args.input_dir,
+            pattern=args.glob,
+            manifest_path=args.manifest_path,
+            images_root=args.manifest_images_root,
+        ),
+        args.output,
+        output_format=args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl"),
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        crop_hint=args.crop_hint,
+        top_k=args.top_k,
+        quality_check=not args.no_quality,
+    )
+    print(json.dumps(summary, indent=2))
@@ -1,16 +1,34 @@
 import io
 import json
+import logging
 import os
 import re
+import threading
 import time
 import uuid
 from abc import ABC, abstractmethod
+from contextlib import ExitStack, contextmanager
 from dataclasses import dataclass
 from typing import Any, Iterable
 
 import numpy as np
 from PIL import Image
 
+try:
+    from .model_pool import ModelPool
+    from .registry import ModelRegistry
+    from .similarity_cache import GenerationSimilarityCache
+except ImportError:  # pragma: no cover - allows `uvicorn api:app` from ./app
+    from model_pool import ModelPool
+    from registry import ModelRegistry
+    from similarity_cache import GenerationSimilarityCache
+
+
+logger = logging.getLogger(__name__)
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
 
 def _coerce_float(value, default):
     try:
@@ -19,6 +37,13 @@ def _coerce_float(value, default):
         return float(default)
 
 
+def _coerce_int(value, default):
+    try:
+        return int(value)
+    except Exception:
+        return int(default)
+
+
 def _normalize_crop_name(value: str | None) -> str:
     normalized = str(value or "").strip().lower()
     if normalized in {"bean", "beans"}:
@@ -44,14 +69,76 @@ def _normalize_crop_hint(crop_hint: str | None) -> str:
     return "auto"
 
 
-def _normalize_array(image: Image.Image, size: tuple[int, int] = (224, 224)) -> np.ndarray:
-    resized = image.resize(size)
-    array = np.asarray(resized, dtype=np.float32) / 255.0
-    if array.ndim == 2:
-        array = np.stack([array, array, array], axis=-1)
-    if array.shape[-1] == 4:
-        array = array[..., :3]
-    return array
+class FrameSizeError(ValueError):
+    """Raised when raw frames are not the model's input size."""
+
+
+def _resize_pixels(image: Image.Image, size: tuple[int, int], resample: int) -> np.ndarray:
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image.resize(size, resample=resample), dtype=np.uint8)
+
+
+@dataclass
+class InputBuffers:
+    staging: Any
+    staging_array: np.ndarray
+    batch: Any
+
+
+class InputBufferPool:
+    """Reusable uint8 staging and float32 batch tensors sized to the max batch.
+
+    Each worker process owns one pool through its model instance, so decoded
+    pixels are written straight into preallocated slots instead of allocating
+    new arrays and tensors per image.
+    """
+
+    def __init__(
+        self,
+        torch_module,
+        *,
+        max_batch: int,
+        image_size: tuple[int, int] = (224, 224),
+        capacity: int = 2,
+        device: str = "cpu",
+    ):
+        self._torch = torch_module
+        self.max_batch = max(1, int(max_batch))
+        self.image_size = image_size
+        self.capacity = max(1, int(capacity))
+        self.device = device
+        self.allocations = 0
+        self._free: list[InputBuffers] = []
+        self._lock = threading.Lock()
+
+    def _allocate(self) -> InputBuffers:
+        height, width = self.image_size
+        staging = self._torch.empty(
+            (self.max_batch, height, width, 3), dtype=self._torch.uint8)
+        batch = self._torch.empty(
+            (self.max_batch, 3, height, width), dtype=self._torch.float32, device=self.device)
+        self.allocations += 1
+        return InputBuffers(staging=staging, staging_array=staging.numpy(), batch=batch)
+
+    def acquire(self) -> InputBuffers:
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return self._allocate()
+
+    def release(self, buffers: InputBuffers) -> None:
+        with self._lock:
+            if len(self._free) < self.capacity:
+                self._free.append(buffers)
+
+    @contextmanager
+    def lease(self):
+        buffers = self.acquire()
+        try:
+            yield buffers
+        finally:
+            self.release(buffers)
 
 
 class BaseDiseaseModel(ABC):
@@ -75,20 +162,53 @@ class BaseDiseaseModel(ABC):
     ) -> dict[str, Any]:
         raise NotImplementedError
 
+    def predict_images(
+        self,
+        images: list[Image.Image],
+        *,
+        crop_hint: str = "auto",
+        return_embeddings: bool = False,
+    ) -> list[dict[str, Any]]:
+        # Models without an embedding head simply omit the "embedding" key.
+        return [self.predict(self.preprocess(image), crop_hint=crop_hint) for image in images]
+
+    def predict_pixels(self, pixels: np.ndarray, *, crop_hint: str = "auto") -> list[dict[str, Any]]:
+        # Models without a staged-pixel path go through PIL.
+        return self.predict_images([Image.fromarray(frame) for frame in pixels], crop_hint=crop_hint)
+
+    def warmup(self) -> None:
+        return None
+
 
 class TorchDiseaseModel(BaseDiseaseModel):
-    def __init__(self, model_path: str | None = None, labels: list[str] | None = None):
+    def __init__(
+        self,
+        model_path: str | None = None,
+        labels: list[str] | None = None,
+        *,
+        use_env_overrides: bool = True,
+    ):
+        # Pooled specialists pass use_env_overrides=False so the primary model's
+        # MODEL_LABELS / MODEL_VERSION never leak onto a different checkpoint.
+        env_labels = os.getenv("MODEL_LABELS", "") if use_env_overrides else ""
         self.model_path = model_path or os.getenv("MODEL_PATH")
-        self.labels = labels or [label.strip() for label in os.getenv(
-            "MODEL_LABELS", "").split(",") if label.strip()]
+        self.labels = labels or [label.strip() for label in env_labels.split(",") if label.strip()]
         self.device = os.getenv("MODEL_DEVICE", "cpu")
         self.model_format = (os.getenv("MODEL_FORMAT") or "").strip().lower()
         self._torch = None
         self._model = None
-        self._inference_transform = None
         self._model_backend = "torchscript"
+        self._buffer_pool: InputBufferPool | None = None
+        self._norm_scale = None
+        self._norm_shift = None
+        self._resample = Image.BICUBIC
+        self.image_size = (224, 224)
+        self.max_batch_size = max(1, _coerce_int(
+            os.getenv("MODEL_MAX_BATCH_SIZE"), 16))
+        self.buffer_pool_size = max(1, _coerce_int(
+            os.getenv("MODEL_BUFFER_POOL_SIZE"), 2))
         self._available_crops: set[str] = set()
-        self.model_version = os.getenv("MODEL_VERSION", "torch-generic-v1")
+        self.model_version = (os.getenv("MODEL_VERSION") if use_env_overrides else None) or "torch-generic-v1"
         self._confidence_threshold_by_label: dict[str, float] = {}
         self._confidence_threshold_by_crop: dict[str, float] = {}
         self._default_confidence_threshold = _coerce_float(
@@ -237,11 +357,6 @@ class TorchDiseaseModel(BaseDiseaseModel):
     def _load_state_dict(self) -> None:
         from model.model import get_model  # type: ignore
 
-        try:
-            from model.dataset import get_transforms  # type: ignore
-        except Exception:
-            get_transforms = None
-
         state = self._torch.load(self.model_path, map_location=self.device)
         if isinstance(state, dict) and "state_dict" in state and isinstance(state["state_dict"], dict):
             state = state["state_dict"]
@@ -261,8 +376,30 @@ class TorchDiseaseModel(BaseDiseaseModel):
 
         self._model = model
         self._model_backend = "state_dict"
-        if get_transforms is not None:
-            self._inference_transform = get_transforms(is_train=False)
+
+    def _configure_input_pipeline(self) -> None:
+        torch = self._torch
+        if self._model_backend == "state_dict":
+            # Matches get_transforms(is_train=False): bilinear Resize, ToTensor, ImageNet Normalize.
+            mean, std = IMAGENET_MEAN, IMAGENET_STD
+            self._resample = Image.BILINEAR
+        else:
+            # TorchScript exports receive plain [0, 1] scaled pixels.
+            mean, std = (0.0, 0.0, 0.0), (1.0, 1.0, 1.0)
+            self._resample = Image.BICUBIC
+
+        mean_tensor = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+        std_tensor = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+        # (x / 255 - mean) / std folded into a single multiply-add: x * scale + shift.
+        self._norm_scale = (1.0 / (255.0 * std_tensor)).to(self.device)
+        self._norm_shift = (-mean_tensor / std_tensor).to(self.device)
+        self._buffer_pool = InputBufferPool(
+            torch,
+            max_batch=self.max_batch_size,
+            image_size=self.image_size,
+            capacity=self.buffer_pool_size,
+            device=self.device,
+        )
 
     def load_model(self) -> None:
         if not self.model_path:
@@ -285,23 +422,135 @@ class TorchDiseaseModel(BaseDiseaseModel):
             self._load_state_dict()
             if self.model_version == "torch-generic-v1":
                 self.model_version = "torch-state-dict-v1"
-            return
+        else:
+            self._load_torchscript()
+        self._configure_input_pipeline()
 
-        self._load_torchscript()
+    def _stage_image(self, buffers: InputBuffers, slot: int, image: Image.Image) -> None:
+        pixels = _resize_pixels(image, self.image_size, self._resample)
+        np.copyto(buffers.staging_array[slot], pixels)
+
+    def _normalize_staged(self, buffers: InputBuffers, count: int):
+        batch = buffers.batch[:count]
+        batch.copy_(buffers.staging[:count].permute(0, 3, 1, 2))
+        return self._torch.addcmul(self._norm_shift, batch, self._norm_scale, out=batch)
 
     def preprocess(self, image: Image.Image):
-        if self._torch is None:
+        if self._torch is None or self._buffer_pool is None:
             # load_model() should have been called, but keep a safe failure mode.
             raise RuntimeError("Torch model is not initialized")
 
-        if self._model_backend == "state_dict" and self._inference_transform is not None:
-            return self._inference_transform(image).unsqueeze(0)
+        with self._buffer_pool.lease() as buffers:
+            self._stage_image(buffers, 0, image)
+            # The pooled batch is reused, so hand the caller its own copy.
+            return self._normalize_staged(buffers, 1).clone()
+
+    def _forward(self, image_tensor):
+        logits = self._model(image_tensor)
+        if isinstance(logits, (tuple, list)):
+            logits = logits[0]
+        return logits
+
+    def _forward_with_embeddings(self, image_tensor):
+        module = self._model
+        if self._model_backend != "state_dict" or not hasattr(module, "features") or not hasattr(module, "classifier"):
+            return self._forward(image_tensor), None
+        # MobileNetV2.forward split open to keep the pooled 1280-d vector fed to classifier[1].
+        features = module.features(image_tensor)
+        pooled = self._torch.nn.functional.adaptive_avg_pool2d(features, (1, 1)).flatten(1)
+        return module.classifier(pooled), pooled
+
+    def _allowed_indices(self, crop_hint: str) -> list[int] | None:
+        normalized_hint = _normalize_crop_hint(crop_hint)
+        if normalized_hint not in {"beans", "maize"} or not self.labels:
+            return None
+
+        normalized_crop = "bean" if normalized_hint == "beans" else normalized_hint
+        matching_indices = []
+        for idx, raw_label in enumerate(self.labels):
+            if ":" not in raw_label:
+                continue
+            label_crop, _ = raw_label.split(":", 1)
+            if label_crop in {"bean", "beans"}:
+                label_crop = "bean"
+            if label_crop == normalized_crop:
+                matching_indices.append(idx)
+        return matching_indices or None
+
+    def _predictions_from_logits(self, logits, *, crop_hint: str) -> list[dict[str, Any]]:
+        allowed_indices = self._allowed_indices(crop_hint)
+        if allowed_indices:
+            logits = logits[:, allowed_indices]
+        probabilities = self._torch.softmax(logits.float(), dim=-1)
+        top_k = min(3, probabilities.shape[-1])
+        top_values, top_indices = self._torch.topk(probabilities, k=top_k, dim=-1)
+
+        predictions = []
+        for row_values, row_indices in zip(top_values.tolist(), top_indices.tolist()):
+            if allowed_indices:
+                row_indices = [allowed_indices[index] for index in row_indices]
+            top_predictions = [
+                self._prediction_entry(label_index=index, probability=probability)
+                for index, probability in zip(row_indices, row_values)
+            ]
+            predictions.append(self._apply_uncertainty_gates(top_predictions))
+        return predictions
+
+    def predict_images(
+        self,
+        images: list[Image.Image],
+        *,
+        crop_hint: str = "auto",
+        return_embeddings: bool = False,
+    ) -> list[dict[str, Any]]:
+        if self._model is None or self._torch is None or self._buffer_pool is None:
+            raise RuntimeError("Torch model is not initialized")
+
+        images = list(images)
+        max_batch = self._buffer_pool.max_batch
+        predictions: list[dict[str, Any]] = []
+        with self._buffer_pool.lease() as buffers, self._torch.no_grad():
+            for start in range(0, len(images), max_batch):
+                chunk = images[start:start + max_batch]
+                for slot, image in enumerate(chunk):
+                    self._stage_image(buffers, slot, image)
+                batch = self._normalize_staged(buffers, len(chunk))
+                if not return_embeddings:
+                    predictions.extend(self._predictions_from_logits(
+                        self._forward(batch), crop_hint=crop_hint))
+                    continue
+
+                logits, embeddings = self._forward_with_embeddings(batch)
+                chunk_predictions = self._predictions_from_logits(logits, crop_hint=crop_hint)
+                if embeddings is not None:
+                    for prediction, embedding in zip(chunk_predictions, embeddings.float().cpu().numpy()):
+                        prediction["embedding"] = embedding
+                predictions.extend(chunk_predictions)
+        return predictions
+
+    def predict_pixels(self, pixels: np.ndarray, *, crop_hint: str = "auto") -> list[dict[str, Any]]:
+        """Batched predictions for uint8 (N, H, W, 3) pixels already resized to `image_size`."""
+        if self._model is None or self._torch is None or self._buffer_pool is None:
+            raise RuntimeError("Torch model is not initialized")
 
-        array = _normalize_array(image)
-        chw = np.transpose(array, (2, 0, 1))
-        tensor = self._torch.tensor(
-            chw, dtype=self._torch.float32).unsqueeze(0)
-        return tensor
+        width, height = self.image_size
+        if pixels.dtype != np.uint8 or pixels.ndim != 4 or pixels.shape[1:] != (height, width, 3):
+            raise FrameSizeError(
+                f"Expected uint8 pixels of shape (N, {height}, {width}, 3), got {pixels.dtype} {pixels.shape}")
+
+        max_batch = self._buffer_pool.max_batch
+        predictions: list[dict[str, Any]] = []
+        with self._buffer_pool.lease() as buffers, self._torch.no_grad():
+            for start in range(0, len(pixels), max_batch):
+                chunk = pixels[start:start + max_batch]
+                np.copyto(buffers.staging_array[:len(chunk)], chunk)
+                batch = self._normalize_staged(buffers, len(chunk))
+                predictions.extend(self._predictions_from_logits(self._forward(batch), crop_hint=crop_hint))
+        return predictions
+
+    def warmup(self) -> None:
+        # One forward pass so the first real request does not pay for lazy init.
+        self.predict_images([Image.new("RGB", self.image_size)])
 
     def predict(
         self,
@@ -317,50 +566,10 @@ class TorchDiseaseModel(BaseDiseaseModel):
             image_tensor = image_tensor.to(self.device)
 
         with self._torch.no_grad():
-            logits = self._model(image_tensor)
-            if isinstance(logits, (tuple, list)):
-                logits = logits[0]
-            logits_row = logits[0]
-            normalized_hint = _normalize_crop_hint(crop_hint)
-            allowed_indices = None
-
-            if normalized_hint in {"beans", "maize"} and self.labels:
-                normalized_crop = "bean" if normalized_hint == "beans" else normalized_hint
-                matching_indices = []
-                for idx, raw_label in enumerate(self.labels):
-                    if ":" not in raw_label:
-                        continue
-                    label_crop, _ = raw_label.split(":", 1)
-                    if label_crop in {"bean", "beans"}:
-                        label_crop = "bean"
-                    if label_crop == normalized_crop:
-                        matching_indices.append(idx)
-
-                if matching_indices:
-                    allowed_indices = matching_indices
-
-            if allowed_indices:
-                cropped_logits = logits_row[allowed_indices]
-                probabilities = self._torch.softmax(cropped_logits, dim=-1)
-                top_k = min(3, probabilities.shape[0])
-                top_values, local_top_indices = self._torch.topk(
-                    probabilities, k=top_k)
-                prediction_indices = [
-                    allowed_indices[int(local_idx.item())] for local_idx in local_top_indices]
-            else:
-                probabilities = self._torch.softmax(logits_row, dim=-1)
-                top_k = min(3, probabilities.shape[0])
-                top_values, top_indices = self._torch.topk(
-                    probabilities, k=top_k)
-                prediction_indices = [int(index.item())
-                                      for index in top_indices]
-
-        top_predictions = [
-            self._prediction_entry(
-                label_index=index, probability=float(probability.item()))
-            for index, probability in zip(prediction_indices, top_values)
-        ]
+            logits = self._forward(image_tensor)
+            return self._predictions_from_logits(logits[:1], crop_hint=crop_hint)[0]
 
+    def _apply_uncertainty_gates(self, top_predictions: list[dict[str, Any]]) -> dict[str, Any]:
         if not top_predictions:
             return {
                 "cropType": "unknown",
@@ -424,8 +633,16 @@ class ImageQualityChecker:
         self.brightness_threshold = brightness_threshold
         self.blur_threshold = blur_threshold
 
-    def assess(self, image: Image.Image) -> ImageQualityReport:
-        rgb = np.asarray(image.convert("RGB"), dtype=np.float32)
+    def assess(self, image: Image.Image, *, max_side: int | None = None) -> ImageQualityReport:
+        if max_side and max(image.size) > max_side:
+            # Cheap ranking pass: blur/brightness on a downscaled plane.
+            image = image.copy()
+            image.thumbnail((max_side, max_side), Image.BILINEAR)
+        return self.assess_pixels(np.asarray(image.convert("RGB")))
+
+    def assess_pixels(self, pixels: np.ndarray) -> ImageQualityReport:
+        """Same report as `assess` for an (H, W, 3) RGB array, without a PIL round trip."""
+        rgb = np.asarray(pixels, dtype=np.float32)
         gray = (0.299 * rgb[..., 0]) + \
             (0.587 * rgb[..., 1]) + (0.114 * rgb[..., 2])
         brightness_mean = float(gray.mean())
@@ -444,25 +661,105 @@ class ImageQualityChecker:
 
         return ImageQualityReport(warnings=warnings, brightness_mean=brightness_mean, blur_score=blur_score)
 
+    def score(self, report: ImageQualityReport) -> float:
+        # Sharper frames rank higher; frames darker than the warning threshold are scaled down.
+        exposure = min(1.0, report.brightness_mean / max(self.brightness_threshold, 1e-6))
+        return float(np.log1p(max(report.blur_score, 0.0)) * exposure)
+
+
+@dataclass
+class FrameSelection:
+    selected: list[int]
+    reports: list[ImageQualityReport]
+    scores: list[float]
+
+
+def select_best_frames(
+    images: list[Image.Image],
+    checker: ImageQualityChecker,
+    *,
+    top_k: int = 1,
+    max_side: int = 256,
+) -> FrameSelection:
+    reports = [checker.assess(image, max_side=max_side) for image in images]
+    scores = [checker.score(report) for report in reports]
+    ranked = sorted(range(len(images)), key=lambda idx: scores[idx], reverse=True)
+    return FrameSelection(selected=sorted(ranked[:max(1, top_k)]), reports=reports, scores=scores)
+
+
+def _mark_frame_selection(
+    results: list[dict[str, Any] | None],
+    files: list[tuple[str, bytes]],
+    frames: FrameSelection,
+) -> None:
+    # Frames skipped by selection=best keep their quality scores but get no prediction.
+    for idx, (filename, _) in enumerate(files):
+        report, score = frames.reports[idx], round(frames.scores[idx], 4)
+        if results[idx] is not None:
+            results[idx]["selected"] = True
+            results[idx]["qualityScore"] = score
+            continue
+        results[idx] = {
+            "imageId": str(uuid.uuid4()),
+            "selected": False,
+            "qualityScore": score,
+            "blurScore": round(report.blur_score, 4),
+            "brightnessMean": round(report.brightness_mean, 4),
+            "warnings": report.warnings,
+            "fileName": filename,
+        }
+
 
 class DiseaseInferenceService:
-    def __init__(self, model: BaseDiseaseModel | None = None):
-        self.model = model or TorchDiseaseModel()
+    def __init__(
+        self,
+        model: BaseDiseaseModel | None = None,
+        registry: ModelRegistry | None = None,
+        model_pool: ModelPool | None = None,
+    ):
+        self.registry = registry or ModelRegistry(
+            model_factory=lambda model_path: TorchDiseaseModel(model_path=model_path))
+        self.model_pool = model_pool
         self.quality_checker = ImageQualityChecker()
-        self.model.load_model()
+        if self.registry.primary is None:
+            model = model or TorchDiseaseModel()
+            self.registry.install(model, source_path=getattr(model, "model_path", None))
+
+    @property
+    def model(self) -> BaseDiseaseModel:
+        return self.registry.primary.model
+
+    @property
+    def frame_size(self) -> tuple[int, int] | None:
+        """(width, height) that `predict_pixels` frames must have, or None when any size is resized."""
+        return getattr(self.model, "image_size", None)
+
+    @contextmanager
+    def _model_for(self, crop_hint: str):
+        # Crop specialists win when the pool has one; otherwise use the registry's
+        # primary/canary. Either way the model is fixed for the whole call.
+        with ExitStack() as stack:
+            specialist = None
+            if self.model_pool is not None:
+                try:
+                    specialist = stack.enter_context(self.model_pool.lease(crop_hint))
+                except Exception:  # noqa: BLE001
+                    # The pool backs off from this specialist; the primary can still answer.
+                    logger.exception("Crop specialist for %r failed to load; using the primary model", crop_hint)
+            yield specialist if specialist is not None else self.registry.choose()
 
     def _open_image(self, raw_bytes: bytes) -> Image.Image:
         return Image.open(io.BytesIO(raw_bytes)).convert("RGB")
 
-    def predict_bytes(self, raw_bytes: bytes, *, filename: str, crop_hint: str = "auto") -> dict[str, Any]:
-        started = time.perf_counter()
-        image = self._open_image(raw_bytes)
-        quality = self.quality_checker.assess(image)
-        image_tensor = self.model.preprocess(image)
-        prediction = self.model.predict(
-            image_tensor, crop_hint=crop_hint, raw_bytes=raw_bytes)
-        latency_ms = round((time.perf_counter() - started) * 1000, 2)
-
+    def _format_prediction(
+        self,
+        prediction: dict[str, Any],
+        *,
+        quality: ImageQualityReport | None,
+        filename: str,
+        latency_ms: float,
+        model_version: str,
+    ) -> dict[str, Any]:
         return {
             "imageId": str(uuid.uuid4()),
             "cropType": prediction.get("cropType", "unknown"),
@@ -475,23 +772,141 @@ class DiseaseInferenceService:
             "margin": float(prediction.get("margin", 0.0)),
             "marginThreshold": float(prediction.get("marginThreshold", 0.0)),
             "topPredictions": prediction.get("topPredictions", []),
-            "modelVersion": self.model.model_version,
+            "modelVersion": model_version,
             "latencyMs": latency_ms,
-            "warnings": quality.warnings,
+            "warnings": quality.warnings if quality is not None else [],
             "fileName": filename,
         }
 
-    def predict_many(self, files: Iterable[tuple[str, bytes]], *, crop_hint: str = "auto") -> list[dict[str, Any]]:
+    def predict_bytes(self, raw_bytes: bytes, *, filename: str, crop_hint: str = "auto") -> dict[str, Any]:
+        started = time.perf_counter()
+        image = self._open_image(raw_bytes)
+        quality = self.quality_checker.assess(image)
+        with self._model_for(crop_hint) as model:
+            image_tensor = model.preprocess(image)
+            prediction = model.predict(
+                image_tensor, crop_hint=crop_hint, raw_bytes=raw_bytes)
+        latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        return self._format_prediction(
+            prediction, quality=quality, filename=filename, latency_ms=latency_ms, model_version=model.model_version)
+
+    def predict_many(
+        self,
+        files: Iterable[tuple[str, bytes]],
+        *,
+        crop_hint: str = "auto",
+        selection: str | None = None,
+        top_k: int = 1,
+    ) -> list[dict[str, Any]]:
+        normalized_crop_hint = _normalize_crop_hint(crop_hint)
+        files = list(files)
+        if not files:
+            return []
+
+        started = time.perf_counter()
+        images = [self._open_image(raw_bytes) for _, raw_bytes in files]
+        frames = select_best_frames(images, self.quality_checker, top_k=top_k) if selection == "best" else None
+        selected = frames.selected if frames is not None else list(range(len(images)))
+        qualities = [self.quality_checker.assess(images[idx]) for idx in selected]
+        # Pick the model once so a whole upload is served by the same version,
+        # even if a reload swaps the registry while this request is running.
+        with self._model_for(normalized_crop_hint) as model:
+            predictions = model.predict_images([images[idx] for idx in selected], crop_hint=normalized_crop_hint)
+        # The whole upload runs as one batch, so report the amortized per-image latency.
+        latency_ms = round((time.perf_counter() - started) * 1000 / len(selected), 2)
+
+        results: list[dict[str, Any] | None] = [None] * len(files)
+        for idx, quality, prediction in zip(selected, qualities, predictions):
+            results[idx] = self._format_prediction(
+                prediction,
+                quality=quality,
+                filename=files[idx][0],
+                latency_ms=latency_ms,
+                model_version=model.model_version,
+            )
+        if frames is not None:
+            _mark_frame_selection(results, files, frames)
+        return results
+
+    def predict_pixels(
+        self,
+        pixels: np.ndarray,
+        *,
+        crop_hint: str = "auto",
+        quality_check: bool = True,
+    ) -> list[dict[str, Any]]:
+        """Predictions for uint8 (N, H, W, 3) frames already resized to the model input size.
+
+        Skips JPEG decode and resize entirely; `quality_check=False` also skips
+        the blur/brightness pass and leaves `warnings` empty.
+        """
         normalized_crop_hint = _normalize_crop_hint(crop_hint)
+        if len(pixels) == 0:
+            return []
+
+        started = time.perf_counter()
+        qualities = [self.quality_checker.assess_pixels(frame) if quality_check else None for frame in pixels]
+        with self._model_for(normalized_crop_hint) as model:
+            predictions = model.predict_pixels(pixels, crop_hint=normalized_crop_hint)
+        latency_ms = round((time.perf_counter() - started) * 1000 / len(pixels), 2)
         return [
-            self.predict_bytes(raw_bytes, filename=filename,
-                               crop_hint=normalized_crop_hint)
-            for filename, raw_bytes in files
+            self._format_prediction(
+                prediction,
+                quality=quality,
+                filename=f"frame-{idx}",
+                latency_ms=latency_ms,
+                model_version=model.model_version,
+            )
+            for idx, (quality, prediction) in enumerate(zip(qualities, predictions))
         ]
 
+    def embed_images(self, images: list[Image.Image], *, crop_hint: str = "auto") -> list[dict[str, Any] | None]:
+        """Classifier label plus penultimate embedding per image, None when unavailable."""
+        normalized_crop_hint = _normalize_crop_hint(crop_hint)
+        with self._model_for(normalized_crop_hint) as model:
+            predictions = model.predict_images(
+                images, crop_hint=normalized_crop_hint, return_embeddings=True)
+            model_version = model.model_version
+
+        probes: list[dict[str, Any] | None] = []
+        for prediction in predictions:
+            embedding = prediction.get("embedding")
+            if embedding is None:
+                probes.append(None)
+                continue
+            probes.append({
+                "embedding": embedding,
+                "cropType": prediction.get("cropType", "unknown"),
+                "label": prediction.get("candidateDisease", "unknown"),
+                "isUncertain": bool(prediction.get("isUncertain", False)),
+                "modelVersion": model_version,
+            })
+        return probes
+
+
+def create_model_pool(exclude_paths: set[str] | None = None) -> ModelPool | None:
+    pool_dir = (os.getenv("MODEL_POOL_DIR") or "").strip()
+    if not pool_dir:
+        return None
+    budget_mb = _coerce_float(os.getenv("MODEL_POOL_MEMORY_MB"), 512.0)
+    return ModelPool.from_directory(
+        pool_dir,
+        lambda model_path: TorchDiseaseModel(model_path=model_path, use_env_overrides=False),
+        memory_budget_bytes=int(budget_mb * 1024 * 1024),
+        exclude_paths=exclude_paths,
+        failure_backoff_seconds=_coerce_float(os.getenv("MODEL_POOL_FAILURE_BACKOFF_SECONDS"), 300.0),
+    )
+
 
 def create_inference_service() -> DiseaseInferenceService:
-    return DiseaseInferenceService()
+    service = DiseaseInferenceService()
+    primary_path = service.registry.primary.source_path
+    service.model_pool = create_model_pool({primary_path} if primary_path else None)
+    watch_dir = (os.getenv("MODEL_WATCH_DIR") or "").strip()
+    if watch_dir:
+        service.registry.watch(
+            watch_dir, interval=_coerce_float(os.getenv("MODEL_WATCH_INTERVAL"), 15.0))
+    return service
 
 
 def _env_flag(name: str, default: bool = False) -> bool:
@@ -686,23 +1101,48 @@ class PaliGemmaGenerationModel:
         }
 
 
+_GENERATION_CACHE_FIELDS = (
+    "cropType",
+    "disease",
+    "candidateDisease",
+    "diagnosis",
+    "recommendation",
+    "generatedText",
+    "source",
+    "isUncertain",
+    "uncertaintyReasons",
+    "modelVersion",
+)
+
+
 class PaliGemmaGenerationService:
-    def __init__(self, model: PaliGemmaGenerationModel | None = None):
+    def __init__(
+        self,
+        model: PaliGemmaGenerationModel | None = None,
+        *,
+        embedder: DiseaseInferenceService | None = None,
+        similarity_cache: GenerationSimilarityCache | None = None,
+    ):
         self.model = model or PaliGemmaGenerationModel()
         self.quality_checker = ImageQualityChecker()
+        self.embedder = embedder
+        self.similarity_cache = similarity_cache
         self.model.load_model()
 
     def _open_image(self, raw_bytes: bytes) -> Image.Image:
         return Image.open(io.BytesIO(raw_bytes)).convert("RGB")
 
-    def generate_bytes(self, raw_bytes: bytes, *, filename: str, crop_hint: str = "auto") -> dict[str, Any]:
-        started = time.perf_counter()
-        image = self._open_image(raw_bytes)
-        quality = self.quality_checker.assess(image)
-        result = self.model.generate(image, crop_hint=crop_hint)
-        latency_ms = round((time.perf_counter() - started) * 1000, 2)
-
-        return {
+    def _format_generation(
+        self,
+        result: dict[str, Any],
+        *,
+        quality: ImageQualityReport,
+        filename: str,
+        latency_ms: float,
+        served_by: str = "model",
+        similarity: float | None = None,
+    ) -> dict[str, Any]:
+        payload = {
             "imageId": str(uuid.uuid4()),
             "cropType": result.get("cropType", "unknown"),
             "disease": result.get("disease", "unknown"),
@@ -715,20 +1155,100 @@ class PaliGemmaGenerationService:
             "isUncertain": bool(result.get("isUncertain", False)),
             "uncertaintyReasons": result.get("uncertaintyReasons", []),
             "topPredictions": result.get("topPredictions", []),
-            "modelVersion": self.model.model_version,
+            "modelVersion": result.get("modelVersion", self.model.model_version),
             "latencyMs": latency_ms,
             "warnings": quality.warnings,
             "fileName": filename,
+            "servedBy": served_by,
         }
+        if similarity is not None:
+            payload["similarity"] = round(similarity, 4)
+        return payload
+
+    def generate_bytes(self, raw_bytes: bytes, *, filename: str, crop_hint: str = "auto") -> dict[str, Any]:
+        started = time.perf_counter()
+        image = self._open_image(raw_bytes)
+        quality = self.quality_checker.assess(image)
+        result = self.model.generate(image, crop_hint=crop_hint)
+        latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        return self._format_generation(result, quality=quality, filename=filename, latency_ms=latency_ms)
+
+    def _similarity_probes(self, images: list[Image.Image], crop_hint: str) -> list[dict[str, Any] | None]:
+        if self.similarity_cache is None or self.embedder is None:
+            return [None] * len(images)
+        try:
+            return self.embedder.embed_images(images, crop_hint=crop_hint)
+        except Exception:  # noqa: BLE001
+            # The cache is an optimization; a classifier failure must not block generation.
+            return [None] * len(images)
 
-    def generate_many(self, files: Iterable[tuple[str, bytes]], *, crop_hint: str = "auto") -> list[dict[str, Any]]:
+    def generate_many(
+        self,
+        files: Iterable[tuple[str, bytes]],
+        *,
+        crop_hint: str = "auto",
+        selection: str | None = None,
+        top_k: int = 1,
+    ) -> list[dict[str, Any]]:
         normalized_crop_hint = _normalize_crop_hint(crop_hint)
-        return [
-            self.generate_bytes(raw_bytes, filename=filename,
-                                crop_hint=normalized_crop_hint)
-            for filename, raw_bytes in files
-        ]
+        files = list(files)
+        if not files:
+            return []
 
+        probe_started = time.perf_counter()
+        images = [self._open_image(raw_bytes) for _, raw_bytes in files]
+        frames = select_best_frames(images, self.quality_checker, top_k=top_k) if selection == "best" else None
+        selected = frames.selected if frames is not None else list(range(len(images)))
+        selected_images = [images[idx] for idx in selected]
+        probes = self._similarity_probes(selected_images, normalized_crop_hint)
+        matches = self.similarity_cache.lookup(probes) if self.similarity_cache is not None else [None] * len(selected)
+        probe_ms = (time.perf_counter() - probe_started) * 1000 / len(selected)
+
+        results: list[dict[str, Any] | None] = [None] * len(files)
+        for idx, image, probe, match in zip(selected, selected_images, probes, matches):
+            filename = files[idx][0]
+            started = time.perf_counter()
+            quality = self.quality_checker.assess(image)
+            if match is not None and match[0].get("modelVersion") == self.model.model_version:
+                stored, score = match
+                latency_ms = round((time.perf_counter() - started) * 1000 + probe_ms, 2)
+                results[idx] = self._format_generation(
+                    stored,
+                    quality=quality,
+                    filename=filename,
+                    latency_ms=latency_ms,
+                    served_by="similarity",
+                    similarity=score,
+                )
+                continue
 
-def create_paligemma_generation_service() -> PaliGemmaGenerationService:
-    return PaliGemmaGenerationService()
+            result = self.model.generate(image, crop_hint=normalized_crop_hint)
+            latency_ms = round((time.perf_counter() - started) * 1000 + probe_ms, 2)
+            payload = self._format_generation(result, quality=quality, filename=filename, latency_ms=latency_ms)
+            if self.similarity_cache is not None:
+                self.similarity_cache.remember(probe, {key: payload.get(key) for key in _GENERATION_CACHE_FIELDS})
+            results[idx] = payload
+
+        if frames is not None:
+            _mark_frame_selection(results, files, frames)
+        return results
+
+
+def create_generation_similarity_cache() -> GenerationSimilarityCache | None:
+    if not _env_flag("GENERATE_SIMILARITY_CACHE", False):
+        return None
+    return GenerationSimilarityCache(
+        threshold=_coerce_float(os.getenv("GENERATE_SIMILARITY_THRESHOLD"), 0.97),
+        max_entries=_coerce_int(os.getenv("GENERATE_SIMILARITY_MAX_ENTRIES"), 50000),
+        persist_path=(os.getenv("GENERATE_SIMILARITY_CACHE_PATH") or "").strip() or None,
+        persist_every=_coerce_int(os.getenv("GENERATE_SIMILARITY_PERSIST_EVERY"), 20),
+    )
+
+
+def create_paligemma_generation_service(
+    embedder: DiseaseInferenceService | None = None,
+) -> PaliGemmaGenerationService:
+    return PaliGemmaGenerationService(
+        embedder=embedder,
+        similarity_cache=create_generation_similarity_cache() if embedder is not None else None,
+    )
@@ -0,0 +1,390 @@
+import json
+import os
+import shutil
+import sqlite3
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from typing import Any, BinaryIO, Callable, Iterable, Iterator
+
+try:
+    from .scheduler import QueueFull
+except ImportError:  # pragma: no cover - allows `uvicorn api:app` from ./app
+    from scheduler import QueueFull
+
+JOB_KINDS = ("predict", "generate")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+
+class ProcessorUnavailable(RuntimeError):
+    """Raised by a job processor when its service cannot run at all, failing the whole job."""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    crop_hint TEXT NOT NULL,
+    client_id TEXT NOT NULL DEFAULT 'anonymous',
+    total INTEGER NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    file_name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, position)
+);
+CREATE INDEX IF NOT EXISTS job_items_pending ON job_items (job_id, status, position);
+"""
+
+
+def iter_archive_images(fileobj: BinaryIO) -> Iterator[tuple[str, bytes]]:
+    """(file name, bytes) of every image in a zip or tar archive, in archive order."""
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or name.startswith(".") or "__MACOSX" in info.filename:
+                    continue
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    yield name, archive.read(info)
+        return
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError as exc:
+        raise ValueError("Archive must be a zip or tar file") from exc
+    with archive:
+        for member in archive:
+            name = os.path.basename(member.name)
+            if not member.isfile() or name.startswith("."):
+                continue
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                yield name, archive.extractfile(member).read()
+
+
+class JobStore:
+    """SQLite-backed job and per-image result state; uploaded images are kept on disk until the job ends."""
+
+    def __init__(self, db_path: str, files_dir: str):
+        self.db_path = db_path
+        self.files_dir = files_dir
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        os.makedirs(files_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+            columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+            if "client_id" not in columns:
+                self._connection.execute("ALTER TABLE jobs ADD COLUMN client_id TEXT NOT NULL DEFAULT 'anonymous'")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _job_payload(self, row: sqlite3.Row) -> dict[str, Any]:
+        total = int(row["total"])
+        return {
+            "jobId": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "cropHint": row["crop_hint"],
+            "clientId": row["client_id"],
+            "total": total,
+            "processed": int(row["processed"]),
+            "failed": int(row["failed"]),
+            "progress": round(int(row["processed"]) / total, 4) if total else 1.0,
+            "error": row["error"],
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"],
+        }
+
+    def create_job(self, kind: str, files: Iterable[tuple[str, bytes]], *, crop_hint: str = "auto",
+                   max_images: int | None = None, client_id: str = "anonymous") -> dict[str, Any]:
+        """Write each image to disk as it arrives, then register the job as queued."""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"kind must be one of {JOB_KINDS}")
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.files_dir, job_id)
+        os.makedirs(job_dir)
+        items = []
+        try:
+            for position, (file_name, content) in enumerate(files):
+                if max_images is not None and position >= max_images:
+                    raise ValueError(f"A job accepts at most {max_images} images")
+                path = os.path.join(job_dir, f"{position:07d}{os.path.splitext(file_name)[1].lower()}")
+                with open(path, "wb") as handle:
+                    handle.write(content)
+                items.append((job_id, position, file_name, path))
+            if not items:
+                raise ValueError("The job contains no images")
+        except Exception:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO jobs (id, kind, status, crop_hint, client_id, total, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, kind, crop_hint, client_id, len(items), now, now),
+            )
+            self._connection.executemany(
+                "INSERT INTO job_items (job_id, position, file_name, path) VALUES (?, ?, ?, ?)", items)
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job_payload(row) if row is not None else None
+
+    def list_results(self, job_id: str, *, offset: int = 0, limit: int = 100) -> list[dict[str, Any]]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT position, file_name, status, result, error FROM job_items "
+                "WHERE job_id = ? ORDER BY position LIMIT ? OFFSET ?",
+                (job_id, int(limit), int(offset)),
+            ).fetchall()
+        return [
+            {
+                "position": int(row["position"]),
+                "fileName": row["file_name"],
+                "status": row["status"],
+                "result": json.loads(row["result"]) if row["result"] else None,
+                "error": row["error"],
+            }
+            for row in rows
+        ]
+
+    def next_job(self, previous_client: str | None = None) -> dict[str, Any] | None:
+        """Oldest unfinished job of the client after `previous_client`, so clients take turns.
+
+        A job left running by a restart is picked up again.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at").fetchall()
+        oldest_by_client = {}
+        for row in rows:
+            oldest_by_client.setdefault(row["client_id"], row)
+        if not oldest_by_client:
+            return None
+        clients = sorted(oldest_by_client)
+        following = [client for client in clients if previous_client is not None and client > previous_client]
+        return self._job_payload(oldest_by_client[(following or clients)[0]])
+
+    def pending_items(self, job_id: str, limit: int) -> list[tuple[int, str, str]]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT position, file_name, path FROM job_items WHERE job_id = ? AND status = 'pending' "
+                "ORDER BY position LIMIT ?",
+                (job_id, int(limit)),
+            ).fetchall()
+        return [(int(row["position"]), row["file_name"], row["path"]) for row in rows]
+
+    def record_results(self, job_id: str, outcomes: list[tuple[int, dict[str, Any] | None, str | None]]) -> None:
+        """Store (position, result, error) outcomes and advance the job counters in one transaction."""
+        failed = sum(1 for _, _, error in outcomes if error is not None)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE job_items SET status = ?, result = ?, error = ? WHERE job_id = ? AND position = ?",
+                [
+                    ("failed" if error is not None else "done", json.dumps(result) if result is not None else None,
+                     error, job_id, position)
+                    for position, result, error in outcomes
+                ],
+            )
+            self._connection.execute(
+                "UPDATE jobs SET status = 'running', processed = processed + ?, failed = failed + ?, updated_at = ? "
+                "WHERE id = ?",
+                (len(outcomes), failed, time.time(), job_id),
+            )
+
+    def finish_job(self, job_id: str, status: str, error: str | None = None) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+        shutil.rmtree(os.path.join(self.files_dir, job_id), ignore_errors=True)
+
+
+class BulkJobRunner:
+    """Background thread that drains queued jobs one batch at a time at low OS priority.
+
+    `processors` maps a job kind to a callable taking `(files, crop_hint=...)`
+    and returning one result dict per file, e.g. `predict_many`. A batch that
+    raises is retried image by image so one bad file only fails itself;
+    `ProcessorUnavailable` fails the job instead. Clients with unfinished jobs
+    take turns batch by batch; with `schedulers` (job kind to
+    `InferenceScheduler`) each batch runs in that scheduler's bulk lane.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        processors: dict[str, Callable[..., list[dict[str, Any]]]],
+        *,
+        batch_size: int = 32,
+        pause_seconds: float = 0.05,
+        poll_seconds: float = 2.0,
+        niceness: int = 10,
+        schedulers: dict[str, Any] | None = None,
+    ):
+        self.store = store
+        self.processors = processors
+        self.schedulers = dict(schedulers or {})
+        self.batch_size = max(1, int(batch_size))
+        self.pause_seconds = max(0.0, float(pause_seconds))
+        self.poll_seconds = max(0.1, float(poll_seconds))
+        self.niceness = niceness
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._last_client: str | None = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="bulk-job-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        try:
+            # Linux applies niceness per thread, so only this runner yields CPU to request handlers;
+            # scheduled batches run on the scheduler's bulk workers, which lower their own priority.
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.niceness)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.is_set():
+            if self.run_once():
+                self._stop.wait(self.pause_seconds)
+                continue
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def _scheduled(self, scheduler, processor, client_id: str):
+        def submit(files, crop_hint):
+            while True:
+                try:
+                    return scheduler.submit(
+                        lambda: processor(files, crop_hint=crop_hint), lane="bulk", client=client_id, cost=len(files))
+                except QueueFull:
+                    # Bulk API requests filled the lane; wait for room rather than failing the batch.
+                    self._stop.wait(self.pause_seconds or 0.05)
+
+        def run(files, *, crop_hint):
+            # Chunks are submitted one after another so interactive work can run between them.
+            step = scheduler.bulk_task_size or len(files)
+            results = []
+            for start in range(0, len(files), step):
+                results.extend(submit(files[start:start + step], crop_hint).result())
+            return results
+
+        return run
+
+    def _process(self, processor, files: list[tuple[str, bytes]], crop_hint: str) -> list[tuple[Any, str | None]]:
+        if not files:
+            return []
+        try:
+            return [(result, None) for result in processor(files, crop_hint=crop_hint)]
+        except ProcessorUnavailable:
+            raise
+        except Exception as exc:  # noqa: BLE001
+            if len(files) == 1:
+                return [(None, f"{type(exc).__name__}: {exc}")]
+        outcomes = []
+        for file in files:
+            try:
+                outcomes.append((processor([file], crop_hint=crop_hint)[0], None))
+            except ProcessorUnavailable:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                outcomes.append((None, f"{type(exc).__name__}: {exc}"))
+        return outcomes
+
+    def run_once(self) -> bool:
+        """Process one batch of the next client's oldest unfinished job; False when there is nothing to do."""
+        job = self.store.next_job(self._last_client)
+        if job is None:
+            return False
+        self._last_client = job["clientId"]
+
+        job_id = job["jobId"]
+        items = self.store.pending_items(job_id, self.batch_size)
+        if not items:
+            self.store.finish_job(job_id, "completed")
+            return True
+
+        try:
+            processor = self.processors[job["kind"]]
+        except KeyError:
+            self.store.finish_job(job_id, "failed", f"No processor for job kind {job['kind']!r}")
+            return True
+        scheduler = self.schedulers.get(job["kind"])
+        if scheduler is not None:
+            processor = self._scheduled(scheduler, processor, job["clientId"])
+
+        files = []
+        read_errors = {}
+        for position, file_name, path in items:
+            try:
+                with open(path, "rb") as handle:
+                    files.append((position, file_name, handle.read()))
+            except OSError as exc:
+                read_errors[position] = f"{type(exc).__name__}: {exc}"
+
+        try:
+            processed = self._process(processor, [(name, content) for _, name, content in files], job["cropHint"])
+        except ProcessorUnavailable as exc:
+            self.store.finish_job(job_id, "failed", str(exc))
+            return True
+
+        outcomes = [(position, None, error) for position, error in read_errors.items()]
+        outcomes.extend(
+            (position, result, error) for (position, _, _), (result, error) in zip(files, processed))
+        self.store.record_results(job_id, outcomes)
+        return True
+
+
+def default_job_dir() -> str:
+    configured = (os.getenv("BULK_JOB_DIR") or "").strip()
+    if configured:
+        return configured
+    return os.path.join(os.path.expanduser("~"), ".cache", "d2p-agri", "jobs")
+
+
+def job_db_path() -> str:
+    return os.path.join(default_job_dir(), "jobs.sqlite3")
+
+
+def create_job_store() -> JobStore:
+    return JobStore(job_db_path(), os.path.join(default_job_dir(), "files"))
+
@@ -0,0 +1,266 @@
+import glob
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+
+def _normalize_crop(value: str | None) -> str:
+    normalized = str(value or "").strip().lower()
+    if normalized in {"bean", "beans"}:
+        return "bean"
+    if normalized in {"maize", "corn"}:
+        return "maize"
+    return normalized
+
+
+def _read_sidecar(model_path: str) -> dict[str, Any]:
+    root, _ = os.path.splitext(model_path)
+    for candidate in (f"{root}.labels.json", f"{model_path}.labels.json"):
+        if not os.path.exists(candidate):
+            continue
+        try:
+            with open(candidate, "r", encoding="utf-8") as handle:
+                metadata = json.load(handle)
+        except Exception:
+            continue
+        if isinstance(metadata, dict):
+            return metadata
+    return {}
+
+
+def _sidecar_crops(metadata: dict[str, Any]) -> frozenset[str]:
+    labels = metadata.get("labels")
+    if isinstance(labels, list):
+        crops = {_normalize_crop(str(label).split(":", 1)[0]) for label in labels if ":" in str(label)}
+        if crops:
+            return frozenset(crops)
+    crop_type = _normalize_crop(metadata.get("crop_type"))
+    if crop_type in {"bean", "maize"}:
+        return frozenset({crop_type})
+    return frozenset()
+
+
+@dataclass
+class ModelSpec:
+    name: str
+    model_path: str
+    crops: frozenset[str]
+    accuracy: float = 0.0
+    estimated_bytes: int = 0
+
+
+@dataclass
+class _Resident:
+    model: Any
+    resident_bytes: int
+    in_use: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+
+
+def model_memory_bytes(model: Any) -> int:
+    """Parameter, buffer and pooled input memory held by a loaded TorchDiseaseModel."""
+    total = 0
+    module = getattr(model, "_model", None)
+    if module is not None:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    pool = getattr(model, "_buffer_pool", None)
+    if pool is not None:
+        height, width = pool.image_size
+        per_buffer = pool.max_batch * height * width * 3 * (1 + 4)
+        total += per_buffer * pool.capacity
+    return total
+
+
+class ModelPool:
+    """Crop-specialist classifiers loaded on demand under a memory budget.
+
+    Requests with a bean or maize crop hint are routed to the most accurate
+    specialist covering exactly that crop. Specialists are loaded the first time
+    they are needed and the least recently used idle ones are evicted when the
+    resident total would exceed `memory_budget_bytes`. A specialist that fails
+    to load is skipped for `failure_backoff_seconds` instead of being reloaded
+    on every request.
+    """
+
+    def __init__(
+        self,
+        specs: list[ModelSpec],
+        model_factory: Callable[[str], Any],
+        *,
+        memory_budget_bytes: int,
+        failure_backoff_seconds: float = 300.0,
+    ):
+        self.specs = {spec.name: spec for spec in specs}
+        self.model_factory = model_factory
+        self.memory_budget_bytes = max(0, int(memory_budget_bytes))
+        self._resident: OrderedDict[str, _Resident] = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self.specs}
+        self.failure_backoff_seconds = max(0.0, float(failure_backoff_seconds))
+        # Spec name -> (monotonic time it may be retried, load error).
+        self._failures: dict[str, tuple[float, str]] = {}
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "loads": 0,
+            "loadFailures": 0,
+            "evictions": 0,
+            "overBudgetLoads": 0,
+        }
+
+    @classmethod
+    def from_directory(
+        cls,
+        directory: str,
+        model_factory: Callable[[str], Any],
+        *,
+        memory_budget_bytes: int,
+        exclude_paths: set[str] | None = None,
+        failure_backoff_seconds: float = 300.0,
+    ) -> "ModelPool":
+        excluded = {os.path.abspath(path) for path in (exclude_paths or set()) if path}
+        specs = []
+        for model_path in sorted(glob.glob(os.path.join(directory, "*.pth"))):
+            if os.path.abspath(model_path) in excluded:
+                continue
+            metadata = _read_sidecar(model_path)
+            crops = _sidecar_crops(metadata)
+            if not crops:
+                continue
+            specs.append(
+                ModelSpec(
+                    name=os.path.splitext(os.path.basename(model_path))[0],
+                    model_path=model_path,
+                    crops=crops,
+                    accuracy=float(metadata.get("best_val_accuracy") or 0.0),
+                    estimated_bytes=os.path.getsize(model_path),
+                )
+            )
+        return cls(specs, model_factory, memory_budget_bytes=memory_budget_bytes,
+                   failure_backoff_seconds=failure_backoff_seconds)
+
+    def route(self, crop_hint: str) -> ModelSpec | None:
+        crop = _normalize_crop(crop_hint)
+        if crop not in {"bean", "maize"}:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            backing_off = {name for name, (retry_at, _) in self._failures.items() if retry_at > now}
+        candidates = [
+            spec for spec in self.specs.values() if spec.crops == frozenset({crop}) and spec.name not in backing_off]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda spec: (spec.accuracy, -spec.estimated_bytes))
+
+    def _resident_bytes(self) -> int:
+        return sum(entry.resident_bytes for entry in self._resident.values())
+
+    def _evict_for(self, incoming_bytes: int) -> None:
+        # Caller holds self._lock. Models still serving a request are never evicted.
+        for name in list(self._resident.keys()):
+            if self._resident_bytes() + incoming_bytes <= self.memory_budget_bytes:
+                return
+            if self._resident[name].in_use > 0:
+                continue
+            del self._resident[name]
+            self.counters["evictions"] += 1
+        if self._resident_bytes() + incoming_bytes > self.memory_budget_bytes:
+            self.counters["overBudgetLoads"] += 1
+
+    def _load(self, spec: ModelSpec) -> _Resident:
+        """Load `spec` if needed and return it with one lease already taken.
+
+        The lease is taken under the same lock as the insert, so no eviction can
+        drop the model between loading it and using it.
+        """
+        with self._load_locks[spec.name]:
+            with self._lock:
+                resident = self._resident.get(spec.name)
+                if resident is not None:
+                    resident.in_use += 1
+                    return resident
+                self._evict_for(spec.estimated_bytes)
+
+            try:
+                model = self.model_factory(spec.model_path)
+                model.load_model()
+                warmup = getattr(model, "warmup", None)
+                if callable(warmup):
+                    warmup()
+            except Exception as exc:
+                with self._lock:
+                    self.counters["loadFailures"] += 1
+                    self._failures[spec.name] = (
+                        time.monotonic() + self.failure_backoff_seconds, f"{type(exc).__name__}: {exc}")
+                raise
+
+            resident_bytes = model_memory_bytes(model) or spec.estimated_bytes
+            with self._lock:
+                self._evict_for(resident_bytes)
+                resident = _Resident(model=model, resident_bytes=resident_bytes)
+                resident.in_use = 1
+                self._resident[spec.name] = resident
+                self._failures.pop(spec.name, None)
+                self.counters["loads"] += 1
+            return resident
+
+    @contextmanager
+    def lease(self, crop_hint: str):
+        """Yield the specialist for `crop_hint`, or None when no specialist applies."""
+        spec = self.route(crop_hint)
+        if spec is None:
+            yield None
+            return
+
+        with self._lock:
+            resident = self._resident.get(spec.name)
+            if resident is not None:
+                self.counters["hits"] += 1
+                resident.in_use += 1
+        if resident is None:
+            with self._lock:
+                self.counters["misses"] += 1
+            resident = self._load(spec)
+
+        with self._lock:
+            resident.last_used = time.monotonic()
+            if spec.name in self._resident:
+                self._resident.move_to_end(spec.name)
+        try:
+            yield resident.model
+        finally:
+            with self._lock:
+                resident.in_use -= 1
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "memoryBudgetBytes": self.memory_budget_bytes,
+                "residentBytes": self._resident_bytes(),
+                "resident": [
+                    {
+                        "name": name,
+                        "modelVersion": getattr(entry.model, "model_version", "unknown"),
+                        "residentBytes": entry.resident_bytes,
+                        "inUse": entry.in_use,
+                    }
+                    for name, entry in self._resident.items()
+                ],
+                "specialists": [
+                    {
+                        "name": spec.name,
+                        "modelPath": spec.model_path,
+                        "crops": sorted(spec.crops),
+                        "accuracy": spec.accuracy,
+                        "loadError": self._failures.get(spec.name, (0.0, None))[1],
+                    }
+                    for spec in self.specs.values()
+                ],
+                "counters": dict(self.counters),
+            }
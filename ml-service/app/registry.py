@@ -0,0 +1,251 @@
+import glob
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+
+@dataclass
+class ModelEntry:
+    version: str
+    model: Any
+    source_path: str | None
+    loaded_at: float
+
+
+def _file_signature(path: str) -> tuple | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def model_signature(model_path: str) -> tuple | None:
+    """Change-detection key for a checkpoint and its `.labels.json` sidecar."""
+    weights = _file_signature(model_path)
+    if weights is None:
+        return None
+    root, _ = os.path.splitext(model_path)
+    sidecars = tuple(_file_signature(candidate)
+                     for candidate in (f"{root}.labels.json", f"{model_path}.labels.json"))
+    return (os.path.abspath(model_path), weights, sidecars)
+
+
+def newest_model_path(directory: str, pattern: str = "*.pth") -> str | None:
+    candidates = [path for path in glob.glob(os.path.join(directory, pattern)) if os.path.isfile(path)]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda path: os.path.getmtime(path))
+
+
+class ModelRegistry:
+    """Holds the serving model versions and swaps them without dropping requests.
+
+    Routing state is one immutable tuple replaced under a lock, so a request
+    that already picked a model keeps using it until it finishes even if a
+    reload swaps in a new version meanwhile. At most two versions are live:
+    the primary and an optional canary that receives `canary_weight` of traffic.
+    """
+
+    def __init__(self, model_factory: Callable[[str | None], Any], *, rng: random.Random | None = None):
+        self.model_factory = model_factory
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._routes: tuple[tuple[ModelEntry, ...], tuple[float, ...]] = ((), ())
+        self._primary: ModelEntry | None = None
+        self._canary: ModelEntry | None = None
+        self._canary_weight = 0.0
+        self._reload_thread: threading.Thread | None = None
+        self._watch_thread: threading.Thread | None = None
+        self._watch_stop = threading.Event()
+        self._last_reload: dict[str, Any] = {"state": "idle"}
+        self._watch_failure: dict[str, Any] | None = None
+
+    @property
+    def primary(self) -> ModelEntry | None:
+        return self._primary
+
+    @property
+    def canary(self) -> ModelEntry | None:
+        return self._canary
+
+    def _publish(self) -> None:
+        entries: list[ModelEntry] = []
+        weights: list[float] = []
+        if self._primary is not None:
+            entries.append(self._primary)
+            weights.append(1.0 - self._canary_weight if self._canary is not None else 1.0)
+        if self._canary is not None and self._canary_weight > 0:
+            entries.append(self._canary)
+            weights.append(self._canary_weight)
+        self._routes = (tuple(entries), tuple(weights))
+
+    def _unique_version(self, model: Any, source_path: str | None) -> str:
+        version = str(getattr(model, "model_version", "unknown"))
+        live_versions = {entry.version for entry in (self._primary, self._canary) if entry is not None}
+        if version in live_versions:
+            # Same sidecar version for different weights; keep responses distinguishable.
+            suffix = int(os.path.getmtime(source_path)) if source_path and os.path.exists(source_path) else int(time.time())
+            version = f"{version}+{suffix}"
+            model.model_version = version
+        return version
+
+    def install(self, model: Any, *, source_path: str | None = None, canary_weight: float | None = None) -> ModelEntry:
+        """Load and warm `model`, then swap it in as primary or as the canary."""
+        model.load_model()
+        warmup = getattr(model, "warmup", None)
+        if callable(warmup):
+            warmup()
+
+        with self._lock:
+            entry = ModelEntry(
+                version=self._unique_version(model, source_path),
+                model=model,
+                source_path=source_path,
+                loaded_at=time.time(),
+            )
+            if canary_weight is None or self._primary is None:
+                self._primary = entry
+                self._canary = None
+                self._canary_weight = 0.0
+            else:
+                self._canary = entry
+                self._canary_weight = min(1.0, max(0.0, float(canary_weight)))
+            self._publish()
+        return entry
+
+    def choose(self) -> Any:
+        entries, weights = self._routes
+        if not entries:
+            raise RuntimeError("No disease model is loaded")
+        if len(entries) == 1:
+            return entries[0].model
+        return self._rng.choices(entries, weights=weights, k=1)[0].model
+
+    def set_canary_weight(self, weight: float) -> None:
+        with self._lock:
+            if self._canary is None:
+                raise RuntimeError("No canary model is loaded")
+            self._canary_weight = min(1.0, max(0.0, float(weight)))
+            self._publish()
+
+    def promote_canary(self) -> ModelEntry:
+        with self._lock:
+            if self._canary is None:
+                raise RuntimeError("No canary model is loaded")
+            self._primary = self._canary
+            self._canary = None
+            self._canary_weight = 0.0
+            self._publish()
+            return self._primary
+
+    def drop_canary(self) -> None:
+        with self._lock:
+            self._canary = None
+            self._canary_weight = 0.0
+            self._publish()
+
+    def _run_reload(self, model_path: str | None, canary_weight: float | None) -> None:
+        started = time.time()
+        try:
+            entry = self.install(self.model_factory(model_path), source_path=model_path, canary_weight=canary_weight)
+            self._last_reload = {
+                "state": "ready",
+                "modelPath": model_path,
+                "modelVersion": entry.version,
+                "startedAt": started,
+                "finishedAt": time.time(),
+            }
+        except Exception as exc:  # noqa: BLE001
+            # A failed reload leaves the current versions serving.
+            self._last_reload = {
+                "state": "failed",
+                "modelPath": model_path,
+                "error": str(exc),
+                "startedAt": started,
+                "finishedAt": time.time(),
+            }
+
+    def reload_async(self, model_path: str | None, *, canary_weight: float | None = None) -> bool:
+        """Start a background load; returns False when a reload is already running."""
+        with self._lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return False
+            self._last_reload = {"state": "loading", "modelPath": model_path, "startedAt": time.time()}
+            self._reload_thread = threading.Thread(
+                target=self._run_reload,
+                args=(model_path, canary_weight),
+                name="model-reload",
+                daemon=True,
+            )
+            self._reload_thread.start()
+        return True
+
+    def wait_for_reload(self, timeout: float | None = None) -> dict[str, Any]:
+        thread = self._reload_thread
+        if thread is not None:
+            thread.join(timeout)
+        return dict(self._last_reload)
+
+    def watch(self, directory: str, *, interval: float = 15.0, pattern: str = "*.pth") -> None:
+        """Poll `directory` and hot-swap the newest checkpoint once its files stop changing."""
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+
+        def _loop():
+            newest = newest_model_path(directory, pattern)
+            served = model_signature(newest) if newest else None
+            pending = None
+            failed = None
+            while not self._watch_stop.wait(interval):
+                newest = newest_model_path(directory, pattern)
+                signature = model_signature(newest) if newest else None
+                if signature is None or signature in (served, failed):
+                    pending = None
+                    continue
+                if signature != pending:
+                    # Wait one more poll so half-copied checkpoints are never loaded.
+                    pending = signature
+                    continue
+                pending = None
+                if not self.reload_async(newest):
+                    continue  # A manual reload is running; try again on the next polls.
+                result = self.wait_for_reload()
+                if result["state"] == "ready":
+                    served = signature
+                    self._watch_failure = None
+                else:
+                    # Skip this checkpoint until its files change, e.g. once it is fixed in place.
+                    failed = signature
+                    self._watch_failure = {
+                        "modelPath": newest, "error": result.get("error"), "failedAt": result.get("finishedAt")}
+
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(target=_loop, name="model-watch", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self) -> None:
+        self._watch_stop.set()
+
+    def status(self) -> dict[str, Any]:
+        def _describe(entry: ModelEntry | None, weight: float) -> dict[str, Any] | None:
+            if entry is None:
+                return None
+            return {
+                "modelVersion": entry.version,
+                "modelPath": entry.source_path,
+                "loadedAt": entry.loaded_at,
+                "trafficWeight": round(weight, 4),
+            }
+
+        canary_weight = self._canary_weight if self._canary is not None else 0.0
+        return {
+            "primary": _describe(self._primary, 1.0 - canary_weight),
+            "canary": _describe(self._canary, canary_weight),
+            "reload": dict(self._last_reload),
+            "watching": bool(self._watch_thread is not None and self._watch_thread.is_alive()),
+            "watchFailure": dict(self._watch_failure) if self._watch_failure else None,
+        }
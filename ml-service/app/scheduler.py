@@ -0,0 +1,272 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+import numpy as np
+
+LANES = ("interactive", "bulk")
+_LATENCY_WINDOW = 1024
+
+
+class QueueFull(RuntimeError):
+    """Raised when a lane already holds its maximum number of queued tasks."""
+
+
+def _parse_role_weights(raw_value: str | None) -> dict[str, float]:
+    weights = {}
+    for item in str(raw_value or "").split(","):
+        role, _, weight = item.partition("=")
+        try:
+            if role.strip():
+                weights[role.strip().lower()] = max(1e-3, float(weight))
+        except ValueError:
+            continue
+    return weights
+
+
+def client_identity(user_id: str | None, role: str | None) -> str:
+    """Fair-queuing key: the user id when the backend sends one, else the role."""
+    if user_id and user_id.strip():
+        return f"user:{user_id.strip()}"
+    if role and role.strip():
+        return f"role:{role.strip().lower()}"
+    return "anonymous"
+
+
+@dataclass(order=True)
+class _Task:
+    finish: float
+    sequence: int
+    fn: Callable[[], Any] = field(compare=False)
+    future: Future = field(compare=False)
+    client: str = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class _Lane:
+    """One priority class: a bounded queue ordered by self-clocked fair-queuing finish tags.
+
+    A task costing `cost` from a client with weight `w` finishes at
+    `max(virtual_time, client's last finish) + cost / w`; the lane serves the
+    smallest finish tag and advances virtual time to it, so a client with a
+    deep backlog only delays others by its fair share.
+    """
+
+    def __init__(self, name: str, max_depth: int):
+        self.name = name
+        self.max_depth = max(1, int(max_depth))
+        self.heap: list[_Task] = []
+        self.virtual_time = 0.0
+        self.last_finish: dict[str, float] = {}
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_ms: deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self.service_ms: deque[float] = deque(maxlen=_LATENCY_WINDOW)
+
+    def push(self, task: _Task, *, cost: float, weight: float) -> None:
+        if len(self.heap) >= self.max_depth:
+            self.rejected += 1
+            raise QueueFull(f"The {self.name} queue is full ({self.max_depth} tasks); retry later")
+        start = max(self.virtual_time, self.last_finish.get(task.client, 0.0))
+        task.finish = start + max(cost, 1e-6) / weight
+        self.last_finish[task.client] = task.finish
+        heapq.heappush(self.heap, task)
+        self.submitted += 1
+
+    def pop(self) -> _Task:
+        task = heapq.heappop(self.heap)
+        self.virtual_time = max(self.virtual_time, task.finish)
+        if len(self.last_finish) > 4 * _LATENCY_WINDOW:
+            # Tags at or behind virtual time behave exactly like a client seen for the first time.
+            self.last_finish = {
+                client: finish for client, finish in self.last_finish.items() if finish > self.virtual_time}
+        return task
+
+    def record(self, *, wait_ms: float, service_ms: float, ok: bool) -> None:
+        self.wait_ms.append(wait_ms)
+        self.service_ms.append(service_ms)
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+    def status(self) -> dict[str, Any]:
+        def percentiles(values):
+            if not values:
+                return {"p50": None, "p95": None}
+            p50, p95 = np.percentile(np.fromiter(values, dtype=np.float64), [50, 95])
+            return {"p50": round(float(p50), 2), "p95": round(float(p95), 2)}
+
+        return {
+            "depth": len(self.heap),
+            "maxDepth": self.max_depth,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "waitMs": percentiles(self.wait_ms),
+            "serviceMs": percentiles(self.service_ms),
+        }
+
+
+class InferenceScheduler:
+    """Runs inference calls on worker threads by lane priority, then per-client fair share.
+
+    Interactive tasks always go before queued bulk tasks, and the first
+    `reserved_interactive` workers never take bulk work, so a bulk task that
+    is already running cannot delay interactive requests on those workers.
+    The `bulk_workers` extra workers only ever take bulk work and run at
+    `bulk_niceness`, so bulk batches yield CPU to interactive requests; every
+    worker that can serve interactive work stays at normal priority, since a
+    thread cannot raise its priority back without CAP_SYS_NICE.
+    `bulk_task_size` caps the images per bulk task for callers that split
+    their batches, which bounds how long an interactive task waits for a
+    shared worker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        workers: int = 2,
+        reserved_interactive: int = 1,
+        bulk_workers: int = 0,
+        max_depth: dict[str, int] | None = None,
+        role_weights: dict[str, float] | None = None,
+        bulk_niceness: int = 0,
+        bulk_task_size: int | None = None,
+    ):
+        self.name = name
+        self.bulk_niceness = int(bulk_niceness)
+        self.bulk_task_size = max(1, int(bulk_task_size)) if bulk_task_size else None
+        self.workers = max(1, int(workers))
+        self.bulk_workers = max(0, int(bulk_workers))
+        # At least one worker must be allowed to take bulk work.
+        self.reserved_interactive = min(
+            max(0, int(reserved_interactive)), self.workers if self.bulk_workers else self.workers - 1)
+        depths = {"interactive": 64, "bulk": 256, **(max_depth or {})}
+        self.lanes = {lane: _Lane(lane, depths[lane]) for lane in LANES}
+        self.role_weights = dict(role_weights or {})
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._stopped = False
+        worker_lanes = [("interactive",) if index < self.reserved_interactive else LANES
+                        for index in range(self.workers)]
+        worker_lanes += [("bulk",)] * self.bulk_workers
+        self._threads = [
+            threading.Thread(target=self._work, args=(lanes,), name=f"{name}-scheduler-{index}", daemon=True)
+            for index, lanes in enumerate(worker_lanes)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(
+        self,
+        fn: Callable[[], Any],
+        *,
+        lane: str = "interactive",
+        client: str = "anonymous",
+        role: str | None = None,
+        cost: float = 1.0,
+    ) -> Future:
+        if lane not in self.lanes:
+            raise ValueError(f"lane must be one of {LANES}, got {lane!r}")
+        weight = self.role_weights.get(str(role or "").strip().lower(), 1.0)
+        future: Future = Future()
+        task = _Task(0.0, next(self._sequence), fn, future, client, time.perf_counter())
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError(f"{self.name} scheduler is stopped")
+            self.lanes[lane].push(task, cost=float(cost), weight=weight)
+            self._condition.notify_all()
+        return future
+
+    async def run(self, fn: Callable[[], Any], **options) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, **options))
+
+    def _next_task(self, lanes: tuple[str, ...]) -> tuple[_Lane, _Task] | None:
+        with self._condition:
+            while not self._stopped:
+                for name in lanes:
+                    lane = self.lanes[name]
+                    if lane.heap:
+                        return lane, lane.pop()
+                self._condition.wait()
+        return None
+
+    def _work(self, lanes: tuple[str, ...]) -> None:
+        if lanes == ("bulk",) and self.bulk_niceness:
+            try:
+                # Linux applies niceness per thread, so only bulk-only workers are lowered.
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.bulk_niceness)
+            except (AttributeError, OSError):
+                pass
+        while True:
+            picked = self._next_task(lanes)
+            if picked is None:
+                return
+            lane, task = picked
+            if not task.future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            ok = True
+            try:
+                task.future.set_result(task.fn())
+            except BaseException as exc:  # noqa: BLE001
+                ok = False
+                task.future.set_exception(exc)
+            finished = time.perf_counter()
+            with self._condition:
+                lane.record(
+                    wait_ms=(started - task.enqueued_at) * 1000, service_ms=(finished - started) * 1000, ok=ok)
+
+    def status(self) -> dict[str, Any]:
+        with self._condition:
+            return {
+                "workers": self.workers,
+                "reservedInteractive": self.reserved_interactive,
+                "bulkWorkers": self.bulk_workers,
+                "lanes": {name: lane.status() for name, lane in self.lanes.items()},
+            }
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def create_scheduler(name: str, *, workers: int, reserved_interactive: int, bulk_workers: int = 0,
+                     bulk_niceness: int = 10, bulk_task_size: int = 0) -> InferenceScheduler:
+    """Scheduler configured from `<NAME>_SCHEDULER_*` variables plus the shared `SCHEDULER_ROLE_WEIGHTS`."""
+    prefix = f"{name.upper()}_SCHEDULER"
+    return InferenceScheduler(
+        name,
+        workers=_env_int(f"{prefix}_WORKERS", workers),
+        reserved_interactive=_env_int(f"{prefix}_RESERVED_INTERACTIVE", reserved_interactive),
+        bulk_workers=_env_int(f"{prefix}_BULK_WORKERS", bulk_workers),
+        max_depth={
+            "interactive": _env_int(f"{prefix}_INTERACTIVE_DEPTH", 64),
+            "bulk": _env_int(f"{prefix}_BULK_DEPTH", 256),
+        },
+        role_weights=_parse_role_weights(os.getenv("SCHEDULER_ROLE_WEIGHTS")),
+        bulk_niceness=_env_int(f"{prefix}_BULK_NICENESS", bulk_niceness),
+        bulk_task_size=_env_int(f"{prefix}_BULK_TASK_SIZE", bulk_task_size),
+    )
@@ -0,0 +1,257 @@
+import json
+import os
+import threading
+from typing import Any
+
+import numpy as np
+
+
+class EmbeddingIndex:
+    """Cosine top-k index over L2-normalized embeddings with per-row partition keys.
+
+    Persisted rows live in a `.npy` file plus an append-only `.rows` file of
+    raw float32 rows, both memory-mapped, so a large index costs page cache
+    rather than heap. `save` only appends the rows added since the last save;
+    `load` folds the appended rows back into the `.npy` file.
+    Rows added since the last save are kept in a growable in-memory block.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = int(dim)
+        self._base = np.zeros((0, self.dim), dtype=np.float32)
+        self._appended = np.zeros((0, self.dim), dtype=np.float32)
+        self._saved_keys = np.zeros((0,), dtype=np.int32)
+        self._extra = np.zeros((64, self.dim), dtype=np.float32)
+        self._extra_keys = np.zeros((64,), dtype=np.int32)
+        self._extra_count = 0
+        self._key_codes: dict[str, int] = {}
+        self.records: list[dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self._saved_keys) + self._extra_count
+
+    def _key_code(self, key: str) -> int:
+        code = self._key_codes.get(key)
+        if code is None:
+            code = len(self._key_codes)
+            self._key_codes[key] = code
+        return code
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def add(self, embeddings: np.ndarray, keys: list[str], records: list[dict[str, Any]]) -> None:
+        vectors = self._normalize(embeddings)
+        needed = self._extra_count + len(vectors)
+        if needed > len(self._extra):
+            capacity = max(needed, len(self._extra) * 2)
+            extra = np.zeros((capacity, self.dim), dtype=np.float32)
+            extra[: self._extra_count] = self._extra[: self._extra_count]
+            extra_keys = np.zeros((capacity,), dtype=np.int32)
+            extra_keys[: self._extra_count] = self._extra_keys[: self._extra_count]
+            self._extra, self._extra_keys = extra, extra_keys
+
+        start = self._extra_count
+        self._extra[start:needed] = vectors
+        self._extra_keys[start:needed] = [self._key_code(key) for key in keys]
+        self._extra_count = needed
+        self.records.extend(records)
+
+    def search(self, queries: np.ndarray, keys: list[str], k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """Batched cosine top-k restricted to rows sharing each query's key.
+
+        Returns `(scores, indices)` of shape `(len(queries), k)`; slots without
+        a match hold score `-inf` and index `-1`.
+        """
+        queries = self._normalize(queries)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(self) == 0 or len(queries) == 0:
+            return scores, indices
+
+        query_keys = np.array([self._key_codes.get(key, -1) for key in keys], dtype=np.int32)
+        base_count, saved_count = len(self._base), len(self._saved_keys)
+        # Score the mmap'd rows and the unsaved rows separately so a lookup never copies the base.
+        parts = [
+            self._top_k(queries, query_keys, matrix, row_keys, k, offset)
+            for matrix, row_keys, offset in (
+                (self._base, self._saved_keys[:base_count], 0),
+                (self._appended, self._saved_keys[base_count:], base_count),
+                (self._extra[: self._extra_count], self._extra_keys[: self._extra_count], saved_count),
+            )
+            if len(matrix)
+        ]
+        candidate_scores = np.concatenate([part[0] for part in parts], axis=1)
+        candidates = np.concatenate([part[1] for part in parts], axis=1)
+        top = min(k, candidate_scores.shape[1])
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")[:, :top]
+        scores[:, :top] = np.take_along_axis(candidate_scores, order, axis=1)
+        indices[:, :top] = np.take_along_axis(candidates, order, axis=1)
+        indices[~np.isfinite(scores)] = -1
+        return scores, indices
+
+    @staticmethod
+    def _top_k(queries, query_keys, matrix, row_keys, k, offset):
+        similarity = queries @ matrix.T
+        similarity[row_keys[None, :] != query_keys[:, None]] = -np.inf
+        top = min(k, similarity.shape[1])
+        candidate = np.argpartition(-similarity, top - 1, axis=1)[:, :top]
+        return np.take_along_axis(similarity, candidate, axis=1), candidate + offset
+
+    def _map_appended(self, path: str, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(f"{path}.rows", dtype=np.float32, mode="r", shape=(count, self.dim))
+
+    def save(self, path: str) -> None:
+        """Append the unsaved rows to the files at `path`, which must be where this index was loaded from."""
+        count = self._extra_count
+        if count == 0:
+            return
+        saved = len(self._saved_keys)
+        code_to_key = {code: key for key, code in self._key_codes.items()}
+        # Rows go first: a crash before the records are written leaves rows that `load` ignores.
+        with open(f"{path}.rows", "ab") as handle:
+            handle.write(self._extra[:count].tobytes())
+        with open(f"{path}.jsonl", "a", encoding="utf-8") as handle:
+            for record, code in zip(self.records[saved:saved + count], self._extra_keys[:count].tolist()):
+                handle.write(json.dumps({"key": code_to_key[code], "record": record}) + "\n")
+
+        self._saved_keys = np.concatenate([self._saved_keys, self._extra_keys[:count]])
+        self._appended = self._map_appended(path, len(self._saved_keys) - len(self._base))
+        self._extra_count = 0
+
+    def _compact(self, path: str) -> None:
+        """Rewrite the saved rows as one `.npy` file and one clean `.jsonl` file."""
+        code_to_key = {code: key for key, code in self._key_codes.items()}
+        tmp_matrix = f"{path}.npy.tmp"
+        with open(tmp_matrix, "wb") as handle:
+            np.save(handle, np.concatenate([self._base, self._appended]))
+        tmp_records = f"{path}.jsonl.tmp"
+        with open(tmp_records, "w", encoding="utf-8") as handle:
+            for record, code in zip(self.records, self._saved_keys.tolist()):
+                handle.write(json.dumps({"key": code_to_key[code], "record": record}) + "\n")
+        os.replace(tmp_matrix, f"{path}.npy")
+        os.replace(tmp_records, f"{path}.jsonl")
+        # A crash here leaves rows that are already in the .npy; `load` ignores them as surplus.
+        if os.path.exists(f"{path}.rows"):
+            os.remove(f"{path}.rows")
+        self._base = np.load(f"{path}.npy", mmap_mode="r")
+        self._appended = self._map_appended(path, 0)
+
+    @staticmethod
+    def _discard(path: str) -> None:
+        for suffix in (".npy", ".jsonl", ".rows"):
+            if os.path.exists(f"{path}{suffix}"):
+                os.remove(f"{path}{suffix}")
+
+    @classmethod
+    def load(cls, path: str, dim: int) -> "EmbeddingIndex":
+        index = cls(dim)
+        if not os.path.exists(f"{path}.jsonl"):
+            cls._discard(path)
+            return index
+
+        keys: list[int] = []
+        truncated = False
+        with open(f"{path}.jsonl", "r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A write cut short by a crash; compaction drops it and everything after it.
+                    truncated = True
+                    break
+                keys.append(index._key_code(entry["key"]))
+                index.records.append(entry["record"])
+        base = np.load(f"{path}.npy", mmap_mode="r") if os.path.exists(f"{path}.npy") else index._base
+        row_bytes = 4 * index.dim
+        appended = os.path.getsize(f"{path}.rows") // row_bytes if os.path.exists(f"{path}.rows") else 0
+        if base.ndim != 2 or base.shape[1] != index.dim or not len(base) <= len(keys) <= len(base) + appended:
+            # Stale or foreign files: start empty rather than serve mismatched rows, and drop them
+            # so later appends do not land behind rows that are not ours.
+            cls._discard(path)
+            return cls(dim)
+        index._base = base
+        index._appended = index._map_appended(path, len(keys) - len(base))
+        index._saved_keys = np.asarray(keys, dtype=np.int32)
+        if truncated or os.path.exists(f"{path}.rows"):
+            index._compact(path)
+        return index
+
+
+class GenerationSimilarityCache:
+    """Reuses past PaliGemma answers for near-duplicate uploads.
+
+    An upload matches when its classifier embedding is within `threshold`
+    cosine similarity of a stored one that has the same classifier version,
+    crop and label. Uncertain classifier outputs are never looked up or stored.
+    """
+
+    def __init__(
+        self,
+        *,
+        threshold: float = 0.97,
+        dim: int = 1280,
+        max_entries: int = 50000,
+        persist_path: str | None = None,
+        persist_every: int = 20,
+    ):
+        self.threshold = float(threshold)
+        self.max_entries = int(max_entries)
+        self.persist_path = persist_path
+        self.persist_every = max(1, int(persist_every))
+        self.index = EmbeddingIndex.load(persist_path, dim) if persist_path else EmbeddingIndex(dim)
+        self.hits = 0
+        self.misses = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(probe: dict[str, Any]) -> str:
+        return f"{probe['modelVersion']}|{probe['cropType']}|{probe['label']}"
+
+    def lookup(self, probes: list[dict[str, Any] | None]) -> list[tuple[dict[str, Any], float] | None]:
+        usable = [idx for idx, probe in enumerate(probes) if probe is not None and not probe["isUncertain"]]
+        matches: list[tuple[dict[str, Any], float] | None] = [None] * len(probes)
+        if usable:
+            with self._lock:
+                scores, indices = self.index.search(
+                    np.stack([probes[idx]["embedding"] for idx in usable]),
+                    [self._key(probes[idx]) for idx in usable],
+                    k=1,
+                )
+                for row, idx in enumerate(usable):
+                    if indices[row, 0] >= 0 and scores[row, 0] >= self.threshold:
+                        matches[idx] = (self.index.records[int(indices[row, 0])], float(scores[row, 0]))
+
+        with self._lock:
+            hit_count = sum(1 for match in matches if match is not None)
+            self.hits += hit_count
+            self.misses += len(probes) - hit_count
+        return matches
+
+    def remember(self, probe: dict[str, Any] | None, result: dict[str, Any]) -> None:
+        if probe is None or probe["isUncertain"]:
+            return
+        with self._lock:
+            if len(self.index) >= self.max_entries:
+                return
+            self.index.add(probe["embedding"], [self._key(probe)], [result])
+            self._unsaved += 1
+            if self.persist_path and self._unsaved >= self.persist_every:
+                self.index.save(self.persist_path)
+                self._unsaved = 0
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "entries": len(self.index),
+            "hits": self.hits,
+            "misses": self.misses,
+            "threshold": self.threshold,
+        }
@@ -0,0 +1,77 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+AUGMENT_MODES = ("pil", "batch")
+
+
+class BatchAugmenter:
+    """Training augmentation applied to a whole uint8 NCHW batch on its device.
+
+    Mirrors get_transforms(is_train=True) after the resize: horizontal flip
+    (p=0.5), rotation in [-degrees, degrees] with nearest sampling and black
+    fill, brightness then contrast jitter, then ImageNet normalization. All
+    random draws come from one seeded generator, so a seed fixes the sequence.
+    """
+
+    def __init__(self, *, degrees=15.0, brightness=0.2, contrast=0.2, flip_p=0.5, seed=0):
+        self.degrees = float(degrees)
+        self.brightness = float(brightness)
+        self.contrast = float(contrast)
+        self.flip_p = float(flip_p)
+        self.generator = torch.Generator()
+        self.generator.manual_seed(int(seed))
+        self._constants = {}
+
+    def state_dict(self):
+        return {"generator": self.generator.get_state()}
+
+    def load_state_dict(self, state):
+        self.generator.set_state(state["generator"])
+
+    def _normalization(self, device):
+        if device not in self._constants:
+            mean = torch.tensor(IMAGENET_MEAN, device=device).view(1, 3, 1, 1)
+            std = torch.tensor(IMAGENET_STD, device=device).view(1, 3, 1, 1)
+            self._constants[device] = (1.0 / (255.0 * std), -mean / std)
+        return self._constants[device]
+
+    def _uniform(self, count, low, high):
+        return torch.empty(count).uniform_(low, high, generator=self.generator)
+
+    def normalize(self, batch):
+        """uint8 NCHW -> ImageNet-normalized float32, as ToTensor + Normalize would produce."""
+        scale, shift = self._normalization(batch.device)
+        return torch.addcmul(shift, batch.float(), scale)
+
+    def __call__(self, batch):
+        count = batch.shape[0]
+        # Draw every parameter on the CPU generator so results do not depend on the device.
+        flips = torch.rand(count, generator=self.generator) < self.flip_p
+        angles = self._uniform(count, -self.degrees, self.degrees)
+        brightness = self._uniform(count, max(0.0, 1.0 - self.brightness), 1.0 + self.brightness)
+        contrast = self._uniform(count, max(0.0, 1.0 - self.contrast), 1.0 + self.contrast)
+
+        device = batch.device
+        images = batch.float().div_(255.0)
+        flips = flips.to(device)
+        images = torch.where(flips.view(-1, 1, 1, 1), images.flip(-1), images)
+
+        radians = angles * (math.pi / 180.0)
+        cos, sin = torch.cos(radians), torch.sin(radians)
+        zeros = torch.zeros_like(cos)
+        # Angles are symmetric around zero, so the sign convention does not matter.
+        theta = torch.stack([torch.stack([cos, -sin, zeros], 1), torch.stack([sin, cos, zeros], 1)], 1)
+        grid = F.affine_grid(theta.to(device), list(images.shape), align_corners=False)
+        images = F.grid_sample(images, grid, mode="nearest", padding_mode="zeros", align_corners=False)
+
+        images = images.mul_(brightness.to(device).view(-1, 1, 1, 1)).clamp_(0.0, 1.0)
+        gray = (0.299 * images[:, 0] + 0.587 * images[:, 1] + 0.114 * images[:, 2]).mean(dim=(1, 2)).view(-1, 1, 1, 1)
+        factor = contrast.to(device).view(-1, 1, 1, 1)
+        images = (images * factor + gray * (1.0 - factor)).clamp_(0.0, 1.0)
+
+        scale, shift = self._normalization(device)
+        return torch.addcmul(shift, images, scale * 255.0)
@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+try:
+    from metadata_store import group_accuracy
+except ImportError:  # pragma: no cover - supports `python -m model.train`
+    from .metadata_store import group_accuracy
+
+CALIBRATED_CROPS = ("bean", "maize")
+_CROP_SEGMENT = {"bean": 0, "maize": 1}
+
+
+def _clamp(value, min_value, max_value):
+    return max(min_value, min(max_value, value))
+
+
+def _crop_from_label(label):
+    if ":" in str(label):
+        crop_name = str(label).split(":", 1)[0].strip().lower()
+        if crop_name in {"bean", "beans"}:
+            return "bean"
+        if crop_name == "maize":
+            return "maize"
+    return "unknown"
+
+
+def validation_arrays(logits, labels):
+    """Top-1 prediction, confidence and top-1/top-2 margin for a whole split at once.
+
+    Returns a dict of numpy arrays (`pred_idx`, `true_idx`, `confidence`,
+    `margin`, `correct`) with one entry per row of `logits`.
+    """
+    logits = torch.as_tensor(logits).float()
+    labels = torch.as_tensor(labels).long().reshape(-1)
+    if logits.shape[0] == 0 or logits.shape[1] == 0:
+        empty = np.empty(0, dtype=np.float64)
+        return {"pred_idx": np.empty(0, dtype=np.int64), "true_idx": np.empty(0, dtype=np.int64),
+                "confidence": empty, "margin": empty, "correct": np.empty(0, dtype=bool)}
+    probabilities = torch.softmax(logits, dim=1)
+    top_k = min(2, probabilities.shape[1])
+    top_values, top_indices = torch.topk(probabilities, k=top_k, dim=1)
+
+    confidence = top_values[:, 0].double()
+    second = top_values[:, 1].double() if top_k > 1 else torch.zeros_like(confidence)
+    pred_idx = top_indices[:, 0].numpy()
+    true_idx = labels.cpu().numpy()
+    return {
+        "pred_idx": pred_idx,
+        "true_idx": true_idx,
+        "confidence": confidence.numpy(),
+        "margin": (confidence - second).numpy(),
+        "correct": pred_idx == true_idx,
+    }
+
+
+def segment_quantiles(values, segments, num_segments, q):
+    """Linear-interpolated `q` quantile of `values` within each segment id, from one sort.
+
+    Matches sorting each segment separately and interpolating at
+    `q * (n - 1)`. Returns `(quantiles, counts)`; empty segments are NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    segments = np.asarray(segments, dtype=np.int64)
+    counts = np.bincount(segments, minlength=num_segments)[:num_segments]
+    quantiles = np.full(num_segments, np.nan)
+    present = counts > 0
+    if not present.any():
+        return quantiles, counts
+
+    sorted_values = values[np.lexsort((values, segments))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+    sizes = counts[present]
+    position = _clamp(q, 0.0, 1.0) * (sizes - 1)
+    low = position.astype(np.int64)
+    high = np.minimum(low + 1, sizes - 1)
+    ratio = position - low
+    low_values = sorted_values[starts + low]
+    high_values = sorted_values[starts + high]
+    quantiles[present] = np.where(low == high, low_values, low_values * (1 - ratio) + high_values * ratio)
+    return quantiles, counts
+
+
+def compute_calibration(
+    arrays,
+    class_names,
+    sample_metadata,
+    *,
+    default_threshold=0.65,
+    min_threshold=0.5,
+    max_threshold=0.92,
+    margin_floor=0.08,
+):
+    """Per-label and per-crop confidence thresholds plus a margin threshold from `validation_arrays`."""
+    correct = np.asarray(arrays["correct"], dtype=bool)
+    correct_true = np.asarray(arrays["true_idx"], dtype=np.int64)[correct]
+    correct_confidence = np.asarray(arrays["confidence"], dtype=np.float64)[correct]
+    correct_margins = np.asarray(arrays["margin"], dtype=np.float64)[correct]
+
+    # Duplicate class names share one threshold, as they always did when keyed by label.
+    unique_labels = list(dict.fromkeys(class_names))
+    label_segment = np.array([unique_labels.index(label) for label in class_names], dtype=np.int64)
+    label_quantiles, label_counts = segment_quantiles(
+        correct_confidence, label_segment[correct_true], len(unique_labels), 0.2)
+
+    threshold_by_label = {}
+    for position, label in enumerate(unique_labels):
+        threshold = float(label_quantiles[position]) if label_counts[position] >= 3 else default_threshold
+        threshold_by_label[label] = round(_clamp(threshold, min_threshold, max_threshold), 4)
+
+    crop_segment = np.array(
+        [_CROP_SEGMENT.get(_crop_from_label(label), len(CALIBRATED_CROPS)) for label in class_names], dtype=np.int64)
+    row_crops = crop_segment[correct_true] if len(class_names) else np.empty(0, dtype=np.int64)
+    crop_rows = row_crops < len(CALIBRATED_CROPS)
+    crop_quantiles, crop_counts = segment_quantiles(
+        correct_confidence[crop_rows], row_crops[crop_rows], len(CALIBRATED_CROPS), 0.2)
+
+    threshold_by_crop = {}
+    for position, crop_name in enumerate(CALIBRATED_CROPS):
+        threshold = float(crop_quantiles[position]) if crop_counts[position] >= 5 else default_threshold
+        threshold_by_crop[crop_name] = round(_clamp(threshold, min_threshold, max_threshold), 4)
+
+    if len(correct_margins) >= 5:
+        margin_threshold = float(segment_quantiles(correct_margins, np.zeros(len(correct_margins)), 1, 0.1)[0][0])
+    else:
+        margin_threshold = margin_floor
+    margin_threshold = round(_clamp(margin_threshold, margin_floor, 0.6), 4)
+
+    group_accuracy_report = {}
+    if len(correct) and sample_metadata is not None and len(sample_metadata):
+        group_accuracy_report = group_accuracy(correct, sample_metadata, min_samples=5)
+
+    return {
+        "default_confidence_threshold": round(default_threshold, 4),
+        "confidence_threshold_by_label": threshold_by_label,
+        "confidence_threshold_by_crop": threshold_by_crop,
+        "margin_threshold": margin_threshold,
+        "group_accuracy": group_accuracy_report,
+        "generated_at_epoch_time": int(time.time()),
+    }
+
+
+def save_validation_logits(path, logits, labels):
+    """Persist validation logits so thresholds can be recomputed without another forward pass."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, logits=np.asarray(logits, dtype=np.float32), labels=np.asarray(labels, dtype=np.int64))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_validation_logits(path):
+    with np.load(path) as payload:
+        return payload["logits"], payload["labels"]
+
+
+def _load_state_dict(model_path):
+    state = torch.load(model_path, map_location="cpu")
+    if isinstance(state, dict) and isinstance(state.get("state_dict"), dict):
+        state = state["state_dict"]
+    return {str(key).replace("module.", "", 1): value for key, value in state.items()}
+
+
+def logits_from_features(model_path, features, batch_size=65536):
+    """Apply a checkpoint's classifier head to cached pooled features (see feature_cache)."""
+    state = _load_state_dict(model_path)
+    weight = state["classifier.1.weight"].float()
+    bias = state["classifier.1.bias"].float()
+    if features.shape[1] != weight.shape[1]:
+        raise ValueError(f"Feature width {features.shape[1]} does not match classifier input {weight.shape[1]}")
+    logits = np.empty((len(features), weight.shape[0]), dtype=np.float32)
+    with torch.no_grad():
+        for start in range(0, len(features), batch_size):
+            chunk = torch.from_numpy(np.ascontiguousarray(features[start : start + batch_size], dtype=np.float32))
+            logits[start : start + len(chunk)] = torch.nn.functional.linear(chunk, weight, bias).numpy()
+    return logits
+
+
+def _labels_metadata_path(model_path):
+    model_stem, _ = os.path.splitext(model_path)
+    return f"{model_stem}.labels.json"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute confidence calibration for a trained checkpoint")
+    parser.add_argument("--model_path", type=str, required=True, help="Checkpoint whose labels sidecar is updated")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--logits", type=str, help="Validation logits .npz written by train.py")
+    source.add_argument("--features", type=str, help="Cached pooled validation features .npy (feature_cache)")
+    parser.add_argument("--labels", type=str, default=None, help="Labels .npy for --features (default: <features>.labels.npy)")
+    parser.add_argument("--labels_metadata", type=str, default=None, help="Labels sidecar (default: <model>.labels.json)")
+    parser.add_argument("--calibration_default_threshold", type=float, default=0.65)
+    parser.add_argument("--calibration_min_threshold", type=float, default=0.5)
+    parser.add_argument("--calibration_max_threshold", type=float, default=0.92)
+    parser.add_argument("--calibration_margin_floor", type=float, default=0.08)
+
+    args = parser.parse_args()
+    started = time.perf_counter()
+    if args.logits:
+        logits, labels = load_validation_logits(args.logits)
+    else:
+        labels_path = args.labels or f"{os.path.splitext(args.features)[0]}.labels.npy"
+        labels = np.load(labels_path)
+        logits = logits_from_features(args.model_path, np.load(args.features, mmap_mode="r"))
+
+    metadata_path = args.labels_metadata or _labels_metadata_path(args.model_path)
+    with open(metadata_path, "r", encoding="utf-8") as handle:
+        payload = json.load(handle)
+    previous_groups = (payload.get("calibration") or {}).get("group_accuracy") or {}
+    calibration = compute_calibration(
+        validation_arrays(logits, labels),
+        payload["class_names"],
+        None,
+        default_threshold=args.calibration_default_threshold,
+        min_threshold=args.calibration_min_threshold,
+        max_threshold=args.calibration_max_threshold,
+        margin_floor=args.calibration_margin_floor,
+    )
+    # Group accuracy needs per-sample metadata, which logit/feature files do not carry.
+    calibration["group_accuracy"] = previous_groups
+    payload["calibration"] = calibration
+
+    tmp_path = f"{metadata_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=2)
+    os.replace(tmp_path, metadata_path)
+    print(f"Calibrated {len(labels)} validation rows in {time.perf_counter() - started:.2f}s -> {metadata_path}")
+    print(json.dumps({key: value for key, value in calibration.items() if key != "group_accuracy"}, indent=2))
@@ -0,0 +1,110 @@
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+
+CHECKPOINT_VERSION = 1
+LAST_CHECKPOINT_NAME = "last_checkpoint.pt"
+
+
+def cpu_snapshot(value):
+    """Detached CPU copy of nested dicts/lists of tensors, safe to serialize while training continues."""
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: cpu_snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(cpu_snapshot(item) for item in value)
+    return value
+
+
+def capture_rng_state():
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+
+
+def restore_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+
+
+def _atomic_save(payload, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.save(payload, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointWriter:
+    """Writes checkpoints on a background thread so torch.save never stalls an epoch.
+
+    Payloads must already be CPU snapshots (see `cpu_snapshot`). Writes happen
+    in submission order through a temp file and `os.replace`, so a crash
+    mid-write leaves the previous file intact. A failed write is re-raised on
+    the next `submit` or `wait`.
+    """
+
+    def __init__(self, max_pending=2):
+        self._queue = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                payload, path = item
+                _atomic_save(payload, path)
+            except Exception as exc:  # noqa: BLE001
+                self._error = exc
+            finally:
+                self._queue.task_done()
+
+    def _raise_pending_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Checkpoint write failed: {error}") from error
+
+    def submit(self, payload, path):
+        self._raise_pending_error()
+        self._queue.put((payload, path))
+
+    def wait(self):
+        self._queue.join()
+        self._raise_pending_error()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_pending_error()
+
+
+def resolve_resume_path(resume, output_dir):
+    """`--resume` with no value means `<output_dir>/last_checkpoint.pt`; returns None if nothing to resume."""
+    if not resume:
+        return None
+    path = os.path.join(output_dir, LAST_CHECKPOINT_NAME) if resume == "auto" else resume
+    if not os.path.exists(path):
+        if resume == "auto":
+            print(f"No checkpoint at {path}; starting from scratch.")
+            return None
+        raise FileNotFoundError(f"Resume checkpoint not found: {path}")
+    return path
+
+
+def load_training_checkpoint(path):
+    checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        raise RuntimeError(f"Unsupported checkpoint version in {path}: {checkpoint.get('version')}")
+    return checkpoint
@@ -1,15 +1,23 @@
-import glob
 import os
-import random
 import re
 from collections import defaultdict
 from collections.abc import Iterable
 
 import torch
-from PIL import Image
 from torch.utils.data import DataLoader, Dataset, Subset
 from torchvision import transforms
 
+try:
+    from dataset_index import default_index_dir, load_dataset_index
+    from image_cache import CachedImageMixin
+    from integrity_scan import filter_samples
+    from splits import load_or_create_split
+except ImportError:  # pragma: no cover - supports `python -m model.train`
+    from .dataset_index import default_index_dir, load_dataset_index
+    from .image_cache import CachedImageMixin
+    from .integrity_scan import filter_samples
+    from .splits import load_or_create_split
+
 # Backward-compatible bean defaults (legacy imports may still rely on these names)
 BEAN_CLASS_NAMES = ["healthy", "bean_rust", "angular_leaf_spot"]
 MAIZE_CLASS_NAMES = ["healthy", "common_rust", "gray_leaf_spot", "northern_leaf_blight"]
@@ -74,21 +82,24 @@ def _preferred_class_order(class_names):
     return sorted(unique)
 
 
-def discover_dataset_classes(root_dir, class_names=None):
+def discover_dataset_classes(root_dir, class_names=None, index=None):
     if not os.path.isdir(root_dir):
         raise FileNotFoundError(f"Dataset directory not found: {root_dir}")
 
-    directory_entries = []
-    for entry_name in os.listdir(root_dir):
-        full_path = os.path.join(root_dir, entry_name)
-        if os.path.isdir(full_path):
-            directory_entries.append(
-                {
-                    "dir_name": entry_name,
-                    "dir_path": full_path,
-                    "label": normalize_class_name(entry_name),
-                }
-            )
+    if index is not None:
+        dir_names = index.class_dirs()
+    else:
+        with os.scandir(root_dir) as entries:
+            dir_names = [entry.name for entry in entries if entry.is_dir()]
+
+    directory_entries = [
+        {
+            "dir_name": entry_name,
+            "dir_path": os.path.join(root_dir, entry_name),
+            "label": normalize_class_name(entry_name),
+        }
+        for entry_name in dir_names
+    ]
 
     if not directory_entries:
         raise RuntimeError(f"No class directories were found in {root_dir}")
@@ -117,25 +128,15 @@ def discover_dataset_classes(root_dir, class_names=None):
     return selected_entries, ordered_labels
 
 
-def _iter_unique_image_paths(entry_dir):
-    seen_paths = set()
-    for ext in ["*.jpg", "*.jpeg", "*.png", "*.JPG", "*.JPEG", "*.PNG", "*.webp", "*.WEBP"]:
-        image_paths = glob.glob(os.path.join(entry_dir, ext))
-        for img_path in sorted(image_paths):
-            normalized_path = os.path.normcase(os.path.normpath(img_path))
-            if normalized_path in seen_paths:
-                continue
-            seen_paths.add(normalized_path)
-            yield img_path
-
-
-class LeafDiseaseDataset(Dataset):
-    def __init__(self, root_dir, transform=None, class_names=None):
+class LeafDiseaseDataset(CachedImageMixin, Dataset):
+    def __init__(self, root_dir, transform=None, class_names=None, image_cache=None, index_dir=None, clean_index=None):
         self.root_dir = root_dir
         self.transform = transform
         self.samples = []
 
-        selected_entries, discovered_class_names = discover_dataset_classes(root_dir, class_names=class_names)
+        index = load_dataset_index(root_dir, index_dir=index_dir)
+        selected_entries, discovered_class_names = discover_dataset_classes(
+            root_dir, class_names=class_names, index=index)
         self.class_names = discovered_class_names
         self.class_to_idx = {name: idx for idx, name in enumerate(self.class_names)}
         self.idx_to_class = {idx: name for name, idx in self.class_to_idx.items()}
@@ -144,22 +145,22 @@ class LeafDiseaseDataset(Dataset):
 
         for entry in selected_entries:
             label_idx = self.class_to_idx[entry["label"]]
-            for img_path in _iter_unique_image_paths(entry["dir_path"]):
+            for img_path in index.image_paths(entry["dir_name"]):
                 self.samples.append((img_path, label_idx))
+        if clean_index:
+            self.samples, _ = filter_samples(self.samples, clean_index)
 
         if not self.samples:
             raise RuntimeError(f"No images found in dataset directory: {root_dir}")
+        if image_cache:
+            self.attach_image_cache(image_cache)
 
     def __len__(self):
         return len(self.samples)
 
     def __getitem__(self, idx):
-        img_path, label = self.samples[idx]
-        try:
-            image = Image.open(img_path).convert("RGB")
-        except Exception as exc:  # noqa: BLE001
-            print(f"Error loading image {img_path}: {exc}")
-            image = Image.new("RGB", (224, 224), (0, 0, 0))
+        _, label = self.samples[idx]
+        image = self._load_image(idx)
 
         if self.transform:
             image = self.transform(image)
@@ -171,8 +172,8 @@ class LeafDiseaseDataset(Dataset):
 BeanLeafDataset = LeafDiseaseDataset
 
 
-class MultiCropLeafDiseaseDataset(Dataset):
-    def __init__(self, root_dirs, transform=None):
+class MultiCropLeafDiseaseDataset(CachedImageMixin, Dataset):
+    def __init__(self, root_dirs, transform=None, image_cache=None, index_dir=None, clean_index=None):
         if not isinstance(root_dirs, Iterable) or isinstance(root_dirs, (str, bytes)):
             raise TypeError("root_dirs must be an iterable of dataset directories")
 
@@ -190,7 +191,8 @@ class MultiCropLeafDiseaseDataset(Dataset):
         self.idx_to_class = {}
 
         for root_dir in self.root_dirs:
-            selected_entries, discovered_class_names = discover_dataset_classes(root_dir)
+            index = load_dataset_index(root_dir, index_dir=index_dir)
+            selected_entries, discovered_class_names = discover_dataset_classes(root_dir, index=index)
             crop_type = infer_crop_type(discovered_class_names)
             if crop_type not in {"bean", "maize"}:
                 raise RuntimeError(
@@ -209,22 +211,22 @@ class MultiCropLeafDiseaseDataset(Dataset):
 
                 label_idx = self.class_to_idx[prefixed_label]
                 self.source_dirs.append(f"{crop_type}:{entry['dir_name']}")
-                for img_path in _iter_unique_image_paths(entry["dir_path"]):
+                for img_path in index.image_paths(entry["dir_name"]):
                     self.samples.append((img_path, label_idx))
+        if clean_index:
+            self.samples, _ = filter_samples(self.samples, clean_index)
 
         if not self.samples:
             raise RuntimeError(f"No images found in dataset directories: {self.root_dirs}")
+        if image_cache:
+            self.attach_image_cache(image_cache)
 
     def __len__(self):
         return len(self.samples)
 
     def __getitem__(self, idx):
-        img_path, label = self.samples[idx]
-        try:
-            image = Image.open(img_path).convert("RGB")
-        except Exception as exc:  # noqa: BLE001
-            print(f"Error loading image {img_path}: {exc}")
-            image = Image.new("RGB", (224, 224), (0, 0, 0))
+        _, label = self.samples[idx]
+        image = self._load_image(idx)
 
         if self.transform:
             image = self.transform(image)
@@ -254,60 +256,47 @@ def get_transforms(is_train=True):
     )
 
 
-def _build_stratified_splits(samples, train_ratio=0.7, val_ratio=0.15, seed=42):
-    by_label = defaultdict(list)
-    for index, (_, label) in enumerate(samples):
-        by_label[label].append(index)
-
-    rng = random.Random(seed)
-    train_indices = []
-    val_indices = []
-    test_indices = []
-
-    for _, indices in by_label.items():
-        rng.shuffle(indices)
-        n = len(indices)
-        n_train = int(n * train_ratio)
-        n_val = int(n * val_ratio)
-        n_test = n - n_train - n_val
-
-        # Ensure non-empty val/test when the class has enough samples.
-        if n >= 3:
-            if n_val == 0:
-                n_val = 1
-                n_train = max(1, n_train - 1)
-            if n_test == 0:
-                n_test = 1
-                n_train = max(1, n_train - 1)
-
-        train_indices.extend(indices[:n_train])
-        val_indices.extend(indices[n_train : n_train + n_val])
-        test_indices.extend(indices[n_train + n_val : n_train + n_val + n_test])
-
-    rng.shuffle(train_indices)
-    rng.shuffle(val_indices)
-    rng.shuffle(test_indices)
-
-    return train_indices, val_indices, test_indices
-
-
-def get_dataloaders(data_dir=None, batch_size=32, num_workers=0, class_names=None, data_dirs=None):
+def get_uint8_transforms():
+    """Resize only, yielding uint8 CHW tensors for BatchAugmenter / on-device normalization."""
+    return transforms.Compose([transforms.Resize((224, 224)), transforms.PILToTensor()])
+
+
+def get_dataloaders(
+    data_dir=None,
+    batch_size=32,
+    num_workers=0,
+    class_names=None,
+    data_dirs=None,
+    image_cache=None,
+    index_dir=None,
+    augment="pil",
+    clean_index=None,
+):
     if data_dirs:
         if class_names:
             raise RuntimeError(
                 "class_names override is not supported with data_dirs multi-crop training. "
                 "Use discovered class folders for each dataset root.",
             )
-        full_dataset = MultiCropLeafDiseaseDataset(root_dirs=data_dirs, transform=None)
+        full_dataset = MultiCropLeafDiseaseDataset(
+            root_dirs=data_dirs, transform=None, image_cache=image_cache, index_dir=index_dir, clean_index=clean_index)
     else:
         if not data_dir:
             raise RuntimeError("data_dir is required when data_dirs is not provided")
-        full_dataset = LeafDiseaseDataset(root_dir=data_dir, transform=None, class_names=class_names)
-    train_indices, val_indices, test_indices = _build_stratified_splits(full_dataset.samples)
+        full_dataset = LeafDiseaseDataset(
+            root_dir=data_dir,
+            transform=None,
+            class_names=class_names,
+            image_cache=image_cache,
+            index_dir=index_dir,
+            clean_index=clean_index,
+        )
+    split = load_or_create_split(full_dataset.samples, split_dir=index_dir or default_index_dir())
+    full_dataset.split = split
 
-    train_subset = Subset(full_dataset, train_indices)
-    val_subset = Subset(full_dataset, val_indices)
-    test_subset = Subset(full_dataset, test_indices)
+    train_subset = Subset(full_dataset, split.train)
+    val_subset = Subset(full_dataset, split.val)
+    test_subset = Subset(full_dataset, split.test)
 
     class TransformSubset(Dataset):
         def __init__(self, subset, transform=None):
@@ -318,6 +307,7 @@ def get_dataloaders(data_dir=None, batch_size=32, num_workers=0, class_names=Non
             self.idx_to_class = subset.dataset.idx_to_class
             self.crop_type = subset.dataset.crop_type
             self.source_dirs = subset.dataset.source_dirs
+            self.split = getattr(subset.dataset, "split", None)
 
         def __getitem__(self, idx):
             x, y = self.subset[idx]
@@ -328,9 +318,13 @@ def get_dataloaders(data_dir=None, batch_size=32, num_workers=0, class_names=Non
         def __len__(self):
             return len(self.subset)
 
-    train_data = TransformSubset(train_subset, transform=get_transforms(is_train=True))
-    val_data = TransformSubset(val_subset, transform=get_transforms(is_train=False))
-    test_data = TransformSubset(test_subset, transform=get_transforms(is_train=False))
+    if augment == "batch":
+        train_transform = eval_transform = get_uint8_transforms()
+    else:
+        train_transform, eval_transform = get_transforms(is_train=True), get_transforms(is_train=False)
+    train_data = TransformSubset(train_subset, transform=train_transform)
+    val_data = TransformSubset(val_subset, transform=eval_transform)
+    test_data = TransformSubset(test_subset, transform=eval_transform)
 
     train_loader = DataLoader(train_data, batch_size=batch_size, shuffle=True, num_workers=num_workers)
     val_loader = DataLoader(val_data, batch_size=batch_size, shuffle=False, num_workers=num_workers)
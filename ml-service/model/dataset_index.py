@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+
+# Same extensions and precedence as the original per-extension glob passes, so
+# sample order (and therefore seeded splits) is unchanged.
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".JPG", ".JPEG", ".PNG", ".webp", ".WEBP"]
+INDEX_VERSION = 1
+_CASE_INSENSITIVE_FS = os.path.normcase("A") == "a"
+
+
+def _extension_rank(name):
+    if name.startswith("."):
+        return None
+    for rank, ext in enumerate(IMAGE_EXTENSIONS):
+        if name.endswith(ext) or (_CASE_INSENSITIVE_FS and name.lower().endswith(ext.lower())):
+            return rank
+    return None
+
+
+def scan_image_files(dir_path):
+    """One scandir pass over a class folder: [(name, size, mtime_ns)] in legacy glob order."""
+    files = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            rank = _extension_rank(entry.name)
+            if rank is None or not entry.is_file():
+                continue
+            stat = entry.stat()
+            files.append((rank, entry.name, int(stat.st_size), int(stat.st_mtime_ns)))
+    files.sort(key=lambda item: (item[0], item[1]))
+    return [(name, size, mtime_ns) for _, name, size, mtime_ns in files]
+
+
+def default_index_dir():
+    configured = os.getenv("DATASET_INDEX_DIR")
+    if configured:
+        return configured
+    return os.path.join(os.path.expanduser("~"), ".cache", "d2p-agri", "dataset-index")
+
+
+def default_index_path(root_dir, index_dir=None):
+    root = os.path.abspath(root_dir)
+    digest = hashlib.sha1(root.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(index_dir or default_index_dir(), f"{os.path.basename(root) or 'root'}-{digest}.json")
+
+
+class DatasetIndex:
+    """Persisted listing of a dataset root: class folders and their image files.
+
+    `refresh` walks the root once and re-lists only class folders whose mtime
+    changed since the index was written, so repeat runs on large or
+    network-mounted roots avoid re-listing hundreds of thousands of files.
+    """
+
+    def __init__(self, root_dir, index_path=None):
+        # Paths are joined onto the root as given so sample paths look the same as before.
+        self.root = root_dir
+        self.root_dir = os.path.abspath(root_dir)
+        self.index_path = index_path
+        self.dirs = {}
+        self.rescanned_dirs = []
+
+    def load(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as handle:
+                payload = json.load(handle)
+        except (OSError, ValueError):
+            return False
+        if payload.get("version") != INDEX_VERSION or payload.get("root") != self.root_dir:
+            return False
+        self.dirs = dict(payload.get("dirs") or {})
+        return True
+
+    def refresh(self):
+        if not os.path.isdir(self.root_dir):
+            raise FileNotFoundError(f"Dataset directory not found: {self.root_dir}")
+
+        refreshed = {}
+        self.rescanned_dirs = []
+        with os.scandir(self.root_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                mtime_ns = int(entry.stat().st_mtime_ns)
+                known = self.dirs.get(entry.name)
+                if known is not None and known.get("mtime_ns") == mtime_ns:
+                    refreshed[entry.name] = known
+                    continue
+                refreshed[entry.name] = {
+                    "mtime_ns": mtime_ns,
+                    "files": [list(item) for item in scan_image_files(entry.path)],
+                }
+                self.rescanned_dirs.append(entry.name)
+        changed = bool(self.rescanned_dirs) or set(refreshed) != set(self.dirs)
+        self.dirs = refreshed
+        return changed
+
+    def save(self):
+        if not self.index_path:
+            return False
+        payload = {"version": INDEX_VERSION, "root": self.root_dir, "dirs": self.dirs}
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                json.dump(payload, handle)
+            os.replace(tmp_path, self.index_path)
+        except OSError as exc:
+            print(f"Warning: could not write dataset index {self.index_path}: {exc}")
+            return False
+        return True
+
+    def class_dirs(self):
+        return sorted(self.dirs.keys())
+
+    def image_paths(self, dir_name):
+        dir_path = os.path.join(self.root, dir_name)
+        return [os.path.join(dir_path, name) for name, _, _ in self.dirs.get(dir_name, {}).get("files", [])]
+
+
+def load_dataset_index(root_dir, index_dir=None):
+    index = DatasetIndex(root_dir, default_index_path(root_dir, index_dir))
+    index.load()
+    if index.refresh():
+        index.save()
+    return index
@@ -0,0 +1,107 @@
+import math
+import os
+from dataclasses import dataclass
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+
+@dataclass
+class DistributedContext:
+    rank: int = 0
+    world_size: int = 1
+    local_world_size: int = 1
+
+    @property
+    def enabled(self):
+        return self.world_size > 1
+
+    @property
+    def is_main(self):
+        return self.rank == 0
+
+    def barrier(self):
+        if self.enabled:
+            dist.barrier()
+
+
+def init_distributed():
+    """Join the gloo process group when launched by torchrun (WORLD_SIZE > 1).
+
+    Each process gets an equal share of the machine's cores for intra-op
+    threads, since torchrun otherwise pins OMP_NUM_THREADS to 1.
+    """
+    world_size = int(os.getenv("WORLD_SIZE", "1"))
+    if world_size <= 1:
+        return DistributedContext()
+
+    if not dist.is_initialized():
+        dist.init_process_group(backend="gloo")
+    local_world_size = int(os.getenv("LOCAL_WORLD_SIZE", str(world_size)))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    return DistributedContext(rank=dist.get_rank(), world_size=dist.get_world_size(), local_world_size=local_world_size)
+
+
+def shutdown_distributed(context):
+    if context.enabled and dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def all_reduce_sums(values, context):
+    """Sum a list of Python numbers over all ranks (float64, so counts stay exact)."""
+    tensor = torch.tensor([float(value) for value in values], dtype=torch.float64)
+    if context.enabled:
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+
+class DistributedWeightedSampler(Sampler):
+    """Per-rank slice of one global draw, so ranks never overlap within an epoch.
+
+    With `weights`, every rank draws the same `num_samples` indices with
+    replacement (like WeightedRandomSampler) from a generator seeded by
+    `seed + epoch`, then keeps every `world_size`-th one. Without weights it is
+    a seeded permutation. The draw is padded so every rank gets the same
+    number of samples and DDP steps stay in lockstep.
+    """
+
+    def __init__(self, num_samples, context, *, weights=None, seed=0):
+        self.num_samples = int(num_samples)
+        self.rank = context.rank
+        self.world_size = context.world_size
+        self.weights = None if weights is None else torch.as_tensor(weights, dtype=torch.float64)
+        self.seed = int(seed)
+        self.epoch = 0
+        self.per_rank = math.ceil(self.num_samples / self.world_size)
+
+    def set_epoch(self, epoch):
+        self.epoch = int(epoch)
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        total = self.per_rank * self.world_size
+        if self.weights is not None:
+            indices = torch.multinomial(self.weights, total, replacement=True, generator=generator)
+        else:
+            indices = torch.randperm(self.num_samples, generator=generator)
+            if total > self.num_samples:
+                indices = torch.cat([indices, indices[: total - self.num_samples]])
+        return iter(indices[self.rank : total : self.world_size].tolist())
+
+    def __len__(self):
+        return self.per_rank
+
+
+class ShardSampler(Sampler):
+    """Deterministic, non-overlapping, unpadded shard of range(n) for exact evaluation sums."""
+
+    def __init__(self, num_samples, context):
+        self.indices = list(range(context.rank, int(num_samples), context.world_size))
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
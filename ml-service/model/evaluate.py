@@ -1,21 +1,37 @@
 import argparse
+import hashlib
 import json
 import os
-from collections import defaultdict
 
-import matplotlib.pyplot as plt
-import seaborn as sns
+import numpy as np
 import torch
-from sklearn.metrics import classification_report, confusion_matrix
+from sklearn.metrics import classification_report
+from torch.utils.data import DataLoader, Subset
 
 try:
-    from dataset import get_dataloaders
-    from finetune_dataset import get_manifest_dataloaders
+    from calibration import validation_arrays
+    from dataset import LeafDiseaseDataset, get_transforms
+    from dataset_index import default_index_dir
+    from finetune_dataset import ManifestLeafDiseaseDataset
+    from manifest_compiler import default_manifest_cache_dir
+    from metadata_store import GROUP_ACCURACY_KEYS, ColumnarMetadata, as_columnar, group_accuracy
     from model import get_model
+    from shards import SHARD_INDEX_NAME, ShardedImageDataset, read_shard_records
+    from splits import load_or_create_split
 except ImportError:  # pragma: no cover - supports `python -m model.evaluate`
-    from .dataset import get_dataloaders
-    from .finetune_dataset import get_manifest_dataloaders
+    from .calibration import validation_arrays
+    from .dataset import LeafDiseaseDataset, get_transforms
+    from .dataset_index import default_index_dir
+    from .finetune_dataset import ManifestLeafDiseaseDataset
+    from .manifest_compiler import default_manifest_cache_dir
+    from .metadata_store import GROUP_ACCURACY_KEYS, ColumnarMetadata, as_columnar, group_accuracy
     from .model import get_model
+    from .shards import SHARD_INDEX_NAME, ShardedImageDataset, read_shard_records
+    from .splits import load_or_create_split
+
+EVAL_ARTIFACT_VERSION = 1
+EVAL_SPLITS = ("val", "test")
+SWEEP_THRESHOLDS = tuple(round(0.3 + 0.05 * step, 2) for step in range(14))
 
 
 def _parse_class_names_arg(raw_value):
@@ -38,42 +54,237 @@ def _load_label_metadata(model_path):
     return None, None
 
 
-def _compute_group_accuracy(predictions, labels, sample_metadata, *, min_samples=5):
-    if not sample_metadata:
-        return {}
+def default_eval_cache_dir():
+    configured = os.getenv("EVAL_CACHE_DIR")
+    if configured:
+        return configured
+    return os.path.join(os.path.expanduser("~"), ".cache", "d2p-agri", "evaluations")
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
-    keys = ["province", "district", "season", "rainfall_band"]
-    groups = defaultdict(lambda: {"correct": 0, "total": 0})
+def _build_eval_split(
+    *,
+    data_dir,
+    manifest_path,
+    manifest_images_root,
+    class_names,
+    image_cache,
+    split,
+    split_seed,
+    clean_index=None,
+):
+    """Only the requested split, with the eval transform; the train split is never materialized."""
+    if manifest_path:
+        full_dataset = ManifestLeafDiseaseDataset(
+            manifest_path=manifest_path,
+            transform=get_transforms(is_train=False),
+            class_names=class_names,
+            images_root=manifest_images_root,
+            image_cache=image_cache,
+            clean_index=clean_index,
+        )
+        split_dir = default_manifest_cache_dir()
+    else:
+        # Folder datasets are always split with get_dataloaders' fixed seed.
+        split_seed = 42
+        full_dataset = LeafDiseaseDataset(
+            root_dir=data_dir,
+            transform=get_transforms(is_train=False),
+            class_names=class_names,
+            image_cache=image_cache,
+            clean_index=clean_index,
+        )
+        split_dir = default_index_dir()
+    data_split = load_or_create_split(full_dataset.samples, split_dir=split_dir, seed=split_seed)
+    return full_dataset, data_split, getattr(data_split, split)
 
-    for idx, (pred_idx, true_idx) in enumerate(zip(predictions, labels)):
-        metadata = sample_metadata[idx] if idx < len(sample_metadata) else {}
-        if not isinstance(metadata, dict):
-            continue
 
-        for key in keys:
-            value = str(metadata.get(key) or "").strip().lower()
-            if not value:
-                continue
-            bucket = groups[(key, value)]
-            bucket["total"] += 1
-            if pred_idx == true_idx:
-                bucket["correct"] += 1
+def _stream_logits(model, dataloader, device, num_rows, num_classes):
+    """Logits and labels in loader order; batches may carry a third element (shard rows), returned as keys."""
+    logits = np.empty((num_rows, num_classes), dtype=np.float32)
+    labels = np.empty(num_rows, dtype=np.int64)
+    keys = np.empty(num_rows, dtype=np.int64)
+    row = 0
+    with torch.no_grad():
+        for batch in dataloader:
+            outputs = model(batch[0].to(device)).float().cpu().numpy()
+            logits[row : row + len(outputs)] = outputs
+            labels[row : row + len(outputs)] = batch[1].numpy()
+            if len(batch) > 2:
+                keys[row : row + len(outputs)] = batch[2].numpy()
+            row += len(outputs)
+    return logits[:row], labels[:row], keys[:row]
+
+
+def save_eval_artifact(path, *, logits, labels, sample_indices, class_names, sample_metadata, info):
+    """Logits, labels, dataset indices and per-sample metadata codes in one npz."""
+    metadata = as_columnar(sample_metadata) if sample_metadata is not None and len(sample_metadata) else None
+    arrays = {
+        "logits": np.asarray(logits, dtype=np.float32),
+        "labels": np.asarray(labels, dtype=np.int64),
+        "sample_indices": np.asarray(sample_indices, dtype=np.int64),
+        "class_names": np.asarray(list(class_names), dtype=np.str_),
+        "info": np.asarray(json.dumps({**info, "version": EVAL_ARTIFACT_VERSION})),
+    }
+    if metadata is not None:
+        arrays["metadata_vocab"] = np.asarray(json.dumps(metadata.vocab))
+        arrays.update({f"metadata_{field}": codes for field, codes in metadata.codes.items()})
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_eval_artifact(path):
+    with np.load(path) as payload:
+        info = json.loads(str(payload["info"]))
+        if info.get("version") != EVAL_ARTIFACT_VERSION:
+            raise RuntimeError(f"Unsupported evaluation artifact version in {path}: {info.get('version')}")
+        sample_metadata = []
+        if "metadata_vocab" in payload.files:
+            vocab = json.loads(str(payload["metadata_vocab"]))
+            sample_metadata = ColumnarMetadata({field: payload[f"metadata_{field}"] for field in vocab}, vocab)
+        return {
+            "logits": payload["logits"],
+            "labels": payload["labels"],
+            "sample_indices": payload["sample_indices"],
+            "class_names": [str(name) for name in payload["class_names"]],
+            "sample_metadata": sample_metadata,
+            "info": info,
+        }
+
+
+def threshold_sweep(confidence, correct, thresholds=SWEEP_THRESHOLDS):
+    """Coverage and accuracy of predictions kept at each confidence threshold (one sort)."""
+    confidence = np.asarray(confidence, dtype=np.float64)
+    total = len(confidence)
+    order = np.argsort(confidence, kind="stable")
+    sorted_confidence = confidence[order]
+    correct_from = np.concatenate((np.cumsum(np.asarray(correct, dtype=np.int64)[order][::-1])[::-1], [0]))
+    starts = np.searchsorted(sorted_confidence, np.asarray(thresholds, dtype=np.float64), side="left")
 
     rows = []
-    for (key, value), item in groups.items():
-        if item["total"] < min_samples:
-            continue
+    for threshold, start in zip(thresholds, starts):
+        accepted = total - int(start)
         rows.append(
-            (
-                f"{key}:{value}",
-                {
-                    "samples": int(item["total"]),
-                    "accuracy": round(item["correct"] / item["total"], 4),
-                },
-            )
+            {
+                "threshold": float(threshold),
+                "accepted": accepted,
+                "coverage": round(accepted / total, 4) if total else 0.0,
+                "accuracy": round(int(correct_from[start]) / accepted, 4) if accepted else None,
+            }
         )
-    rows.sort(key=lambda row: row[1]["samples"], reverse=True)
-    return dict(rows[:40])
+    return rows
+
+
+def build_evaluation_report(artifact, *, group_keys=GROUP_ACCURACY_KEYS, min_group_samples=5, thresholds=SWEEP_THRESHOLDS):
+    """Classification report, confusion matrix, group accuracy and threshold sweep from an artifact."""
+    class_names = artifact["class_names"]
+    labels = artifact["labels"]
+    arrays = validation_arrays(artifact["logits"], labels)
+    num_classes = len(class_names)
+    confusion = np.bincount(
+        labels * num_classes + arrays["pred_idx"], minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+
+    sample_metadata = artifact["sample_metadata"]
+    groups = {}
+    if len(sample_metadata):
+        groups = group_accuracy(arrays["correct"], sample_metadata, keys=group_keys, min_samples=min_group_samples)
+
+    return {
+        "split": artifact["info"].get("split"),
+        "model_path": artifact["info"].get("model_path"),
+        "samples": int(len(labels)),
+        "accuracy": round(float(arrays["correct"].mean()), 4) if len(labels) else 0.0,
+        "class_names": list(class_names),
+        "classification_report": classification_report(
+            labels,
+            arrays["pred_idx"],
+            labels=list(range(num_classes)),
+            target_names=class_names,
+            output_dict=True,
+            zero_division=0,
+        ),
+        "confusion_matrix": confusion.tolist(),
+        "group_accuracy": groups,
+        "threshold_sweep": threshold_sweep(arrays["confidence"], arrays["correct"], thresholds),
+    }
+
+
+def _print_report(report):
+    print("\nClassification Report:")
+    for name in report["class_names"] + ["macro avg", "weighted avg"]:
+        row = report["classification_report"][name]
+        print(
+            f"{name:>32} precision {row['precision']:.2f} recall {row['recall']:.2f} "
+            f"f1 {row['f1-score']:.2f} support {int(row['support'])}"
+        )
+    print(f"{'accuracy':>32} {report['accuracy']:.4f} over {report['samples']} samples")
+
+    if report["group_accuracy"]:
+        print("\nDomain Accuracy (metadata-aware):")
+        print(json.dumps(report["group_accuracy"], indent=2))
+
+    print("\nConfusion Matrix:")
+    print(np.asarray(report["confusion_matrix"]))
+
+    print("\nThreshold sweep (threshold: coverage / accuracy):")
+    for row in report["threshold_sweep"]:
+        print(f"  {row['threshold']:.2f}: {row['coverage']:.4f} / {row['accuracy']}")
+
+
+def _save_confusion_plot(confusion, class_names, path):
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed; skipping confusion matrix plot.")
+        return None
+
+    plt.figure(figsize=(8, 6))
+    try:
+        import seaborn as sns
+
+        sns.heatmap(confusion, annot=True, fmt="d", xticklabels=class_names, yticklabels=class_names)
+    except ImportError:
+        plt.imshow(confusion, cmap="Blues")
+        plt.xticks(range(len(class_names)), class_names, rotation=45, ha="right")
+        plt.yticks(range(len(class_names)), class_names)
+        for (row, column), value in np.ndenumerate(confusion):
+            plt.text(column, row, str(value), ha="center", va="center")
+    plt.ylabel("Actual")
+    plt.xlabel("Predicted")
+    plt.title("Confusion Matrix")
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+    print(f"Confusion matrix saved to {path}")
+    return path
+
+
+def write_reports(artifact, output_dir=".", *, group_keys=GROUP_ACCURACY_KEYS, plot=True):
+    report = build_evaluation_report(artifact, group_keys=group_keys)
+    _print_report(report)
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = os.path.join(output_dir, "evaluation_report.json")
+    with open(report_path, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Evaluation report saved to {report_path}")
+    if plot:
+        _save_confusion_plot(np.asarray(report["confusion_matrix"]), report["class_names"],
+                             os.path.join(output_dir, "confusion_matrix.png"))
+    return report
 
 
 def evaluate_model(
@@ -85,32 +296,48 @@ def evaluate_model(
     num_workers=0,
     manifest_path=None,
     manifest_images_root=None,
+    image_cache=None,
+    split="test",
+    split_seed=None,
+    eval_cache_dir=None,
+    output_dir=".",
+    group_keys=GROUP_ACCURACY_KEYS,
+    plot=True,
+    shards_dir=None,
+    clean_index=None,
 ):
+    if split not in EVAL_SPLITS:
+        raise ValueError(f"split must be one of {EVAL_SPLITS}, got {split!r}")
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Using device: {device}")
 
-    if manifest_path:
-        _, _, test_loader = get_manifest_dataloaders(
-            manifest_path=manifest_path,
-            batch_size=batch_size,
-            num_workers=num_workers,
-            class_names=class_names,
-            images_root=manifest_images_root,
-        )
+    metadata, metadata_path = _load_label_metadata(model_path)
+    if split_seed is None:
+        split_seed = int((metadata or {}).get("split_seed", 42))
+
+    if shards_dir:
+        full_dataset = ShardedImageDataset(
+            os.path.join(shards_dir, split), get_transforms(is_train=False), with_keys=True)
+        data_split = full_dataset.split
+        indices = None
+        if data_split is not None:
+            split_seed = data_split.seed
     else:
-        _, _, test_loader = get_dataloaders(
+        full_dataset, data_split, indices = _build_eval_split(
             data_dir=data_dir,
-            batch_size=batch_size,
-            num_workers=num_workers,
+            manifest_path=manifest_path,
+            manifest_images_root=manifest_images_root,
             class_names=class_names,
+            image_cache=image_cache,
+            split=split,
+            split_seed=split_seed,
+            clean_index=clean_index,
         )
-
-    detected_class_names = list(getattr(test_loader.dataset, "class_names", []))
+    detected_class_names = list(getattr(full_dataset, "class_names", []))
     if not detected_class_names:
-        raise RuntimeError("Could not read class names from the test dataset.")
-    print(f"Detected test classes: {detected_class_names}")
+        raise RuntimeError(f"Could not read class names from the {split} dataset.")
+    print(f"Detected {split} classes: {detected_class_names}")
 
-    metadata, metadata_path = _load_label_metadata(model_path)
     if metadata:
         print(f"Loaded model label metadata: {metadata_path}")
         metadata_classes = list(metadata.get("class_names") or [])
@@ -133,51 +360,74 @@ def evaluate_model(
                 )
             )
 
-    model = get_model(num_classes=len(detected_class_names))
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model.to(device)
-    model.eval()
-
-    all_preds = []
-    all_labels = []
-
-    print("Evaluating on test set...")
-    with torch.no_grad():
-        for inputs, labels in test_loader:
-            inputs = inputs.to(device)
-            labels = labels.to(device)
-
-            outputs = model(inputs)
-            _, preds = torch.max(outputs, 1)
-
-            all_preds.extend(preds.cpu().numpy().tolist())
-            all_labels.extend(labels.cpu().numpy().tolist())
-
-    print("\nClassification Report:")
-    print(classification_report(all_labels, all_preds, target_names=detected_class_names))
+    expected_split_hash = (metadata or {}).get("split_hash")
+    if expected_split_hash and data_split is not None and expected_split_hash != data_split.split_hash:
+        print(
+            "Warning: this split differs from the one the model was trained with; "
+            "samples may have moved between train and test.\n"
+            f"  Training split: {expected_split_hash}\n"
+            f"  Current split:  {data_split.split_hash}"
+        )
 
-    sample_metadata = list(getattr(test_loader.dataset, "sample_metadata", []))
-    group_accuracy = _compute_group_accuracy(all_preds, all_labels, sample_metadata)
-    if group_accuracy:
-        print("\nDomain Accuracy (metadata-aware):")
-        print(json.dumps(group_accuracy, indent=2))
+    checkpoint_hash = _file_sha256(model_path)
+    if data_split is not None:
+        split_hash = data_split.split_hash
+    else:
+        split_hash = _file_sha256(os.path.join(full_dataset.shard_dir, SHARD_INDEX_NAME))
+    key = hashlib.sha256(
+        f"v{EVAL_ARTIFACT_VERSION}|{checkpoint_hash}|{split_hash}|{','.join(detected_class_names)}".encode("utf-8")
+    ).hexdigest()[:24]
+    artifact_path = os.path.join(eval_cache_dir or default_eval_cache_dir(), f"{split}-{key}.npz")
+
+    if os.path.exists(artifact_path):
+        print(f"Reusing cached {split} logits: {artifact_path}")
+    else:
+        model = get_model(num_classes=len(detected_class_names), pretrained=False)
+        model.load_state_dict(torch.load(model_path, map_location=device))
+        model.to(device)
+        model.eval()
+
+        print(f"Evaluating on {split} set...")
+        if shards_dir:
+            loader = DataLoader(full_dataset, batch_size=batch_size, num_workers=num_workers)
+            logits, labels, rows = _stream_logits(model, loader, device, len(full_dataset), len(detected_class_names))
+            # Workers interleave shards; restore packing order so rows line up with the inline records.
+            order = np.argsort(rows, kind="stable")
+            logits, labels = logits[order], labels[order]
+            records = read_shard_records(full_dataset.shard_dir)
+            indices = [record["index"] for record in records]
+            has_metadata = any(record.get("metadata") for record in records)
+            sample_metadata = ColumnarMetadata.from_records(
+                [record.get("metadata") or {} for record in records]) if has_metadata else []
+        else:
+            loader = DataLoader(
+                Subset(full_dataset, indices), batch_size=batch_size, shuffle=False, num_workers=num_workers)
+            logits, labels, _ = _stream_logits(model, loader, device, len(indices), len(detected_class_names))
+            source_metadata = getattr(full_dataset, "sample_metadata", [])
+            sample_metadata = as_columnar(source_metadata).subset(indices) if len(source_metadata) else []
+        save_eval_artifact(
+            artifact_path,
+            logits=logits,
+            labels=labels,
+            sample_indices=indices,
+            class_names=detected_class_names,
+            sample_metadata=sample_metadata,
+            info={
+                "model_path": os.path.abspath(model_path),
+                "checkpoint_sha256": checkpoint_hash,
+                "split": split,
+                "split_seed": split_seed,
+                "split_hash": split_hash,
+            },
+        )
+        print(f"Saved {split} logits to {artifact_path}")
 
-    print("\nConfusion Matrix:")
-    cm = confusion_matrix(all_labels, all_preds)
-    print(cm)
-
-    plt.figure(figsize=(8, 6))
-    sns.heatmap(cm, annot=True, fmt="d", xticklabels=detected_class_names, yticklabels=detected_class_names)
-    plt.ylabel("Actual")
-    plt.xlabel("Predicted")
-    plt.title("Confusion Matrix")
-    plt.savefig("confusion_matrix.png")
-    print("Confusion matrix saved to confusion_matrix.png")
+    return write_reports(load_eval_artifact(artifact_path), output_dir, group_keys=group_keys, plot=plot)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate Leaf Disease Classification Model (bean or maize)")
-    parser.add_argument("--model_path", type=str, required=True, help="Path to trained model .pth file")
+    parser.add_argument("--model_path", type=str, default=None, help="Path to trained model .pth file")
     parser.add_argument("--data_dir", type=str, default=None, help="Path to dataset root")
     parser.add_argument("--manifest_path", type=str, default=None, help="CSV manifest path for metadata-aware datasets")
     parser.add_argument(
@@ -194,12 +444,33 @@ if __name__ == "__main__":
         help="Optional comma-separated class names/folder names to enforce label order",
     )
     parser.add_argument("--num_workers", type=int, default=0, help="DataLoader workers")
+    parser.add_argument("--image_cache", type=str, default=None, help="Preprocessed image cache prefix")
+    parser.add_argument("--split", type=str, default="test", choices=EVAL_SPLITS, help="Split to evaluate")
+    parser.add_argument("--split_seed", type=int, default=None, help="Manifest split seed (default: sidecar value or 42)")
+    parser.add_argument("--eval_cache_dir", type=str, default=None, help="Logit artifact directory (default EVAL_CACHE_DIR)")
+    parser.add_argument("--artifact", type=str, default=None, help="Recompute reports from an existing logit artifact")
+    parser.add_argument(
+        "--group_by",
+        type=str,
+        default=None,
+        help="Comma-separated metadata fields for group accuracy (default province,district,season,rainfall_band)",
+    )
+    parser.add_argument("--output_dir", type=str, default=".", help="Where evaluation_report.json and plots are written")
+    parser.add_argument("--no_plot", action="store_true", help="Skip the confusion matrix plot")
+    parser.add_argument("--shards_dir", type=str, default=None, help="Evaluate <shards_dir>/<split> tar shards from model/shards.py")
+    parser.add_argument("--clean_index", type=str, default=None, help="Clean index from model/integrity_scan.py")
 
     args = parser.parse_args()
-    if args.manifest_path and args.data_dir:
-        parser.error("Use --manifest_path or --data_dir, not both.")
-    if not args.manifest_path and not args.data_dir:
-        parser.error("Provide --manifest_path or --data_dir")
+    group_keys = tuple(_parse_class_names_arg(args.group_by) or GROUP_ACCURACY_KEYS)
+    if args.artifact:
+        write_reports(load_eval_artifact(args.artifact), args.output_dir, group_keys=group_keys, plot=not args.no_plot)
+        raise SystemExit(0)
+    if not args.model_path:
+        parser.error("Provide --model_path (or --artifact to re-report cached logits)")
+    if sum(bool(value) for value in (args.manifest_path, args.data_dir, args.shards_dir)) > 1:
+        parser.error("Use one of --manifest_path, --data_dir or --shards_dir.")
+    if not args.manifest_path and not args.data_dir and not args.shards_dir:
+        parser.error("Provide --manifest_path, --data_dir or --shards_dir")
 
     evaluate_model(
         args.model_path,
@@ -209,4 +480,13 @@ if __name__ == "__main__":
         num_workers=args.num_workers,
         manifest_path=args.manifest_path,
         manifest_images_root=args.manifest_images_root,
+        image_cache=args.image_cache,
+        split=args.split,
+        split_seed=args.split_seed,
+        eval_cache_dir=args.eval_cache_dir,
+        output_dir=args.output_dir,
+        group_keys=group_keys,
+        plot=not args.no_plot,
+        shards_dir=args.shards_dir,
+        clean_index=args.clean_index,
     )
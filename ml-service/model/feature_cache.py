@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+
+try:
+    from dataset import get_transforms
+except ImportError:  # pragma: no cover - supports `python -m model.train`
+    from .dataset import get_transforms
+
+FEATURE_CACHE_VERSION = 1
+
+
+def default_feature_cache_dir():
+    configured = os.getenv("FEATURE_CACHE_DIR")
+    if configured:
+        return configured
+    return os.path.join(os.path.expanduser("~"), ".cache", "d2p-agri", "features")
+
+
+def backbone_signature(model):
+    """sha256 over the feature extractor weights; the head does not affect cached features."""
+    digest = hashlib.sha256()
+    for key, value in model.features.state_dict().items():
+        digest.update(key.encode("utf-8"))
+        digest.update(value.detach().to("cpu", torch.float32).contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def pooled_features(model, inputs):
+    """MobileNetV2 forward up to (not including) the classifier: (N, 1280)."""
+    return torch.flatten(F.adaptive_avg_pool2d(model.features(inputs), (1, 1)), 1)
+
+
+class _SubsetView(Dataset):
+    def __init__(self, subset, transform):
+        self.subset = subset
+        self.transform = transform
+
+    def __getitem__(self, idx):
+        image, label = self.subset[idx]
+        return self.transform(image), label
+
+    def __len__(self):
+        return len(self.subset)
+
+
+def _split_key(backbone_hash, subset, views, seed):
+    digest = hashlib.sha256()
+    digest.update(f"v{FEATURE_CACHE_VERSION}|{backbone_hash}|{views}|{seed}".encode("utf-8"))
+    samples = subset.dataset.samples
+    for index in subset.indices:
+        path, label = samples[index]
+        digest.update(f"{path}\0{label}\n".encode("utf-8"))
+    return digest.hexdigest()[:24]
+
+
+def cached_split_features(
+    model,
+    subset,
+    *,
+    split_name,
+    device,
+    cache_dir=None,
+    views=1,
+    seed=0,
+    batch_size=64,
+    num_workers=0,
+    forward_context=None,
+    memory_format=torch.contiguous_format,
+    backbone_hash=None,
+):
+    """Pooled backbone features for every sample of a `Subset`, cached as a memmap.
+
+    View 0 uses the eval transform; views 1..N-1 use the training augmentation
+    with torch seeded per view inside a forked RNG, so the same seed reproduces
+    the same views without touching the caller's random stream.
+    Rows are view-major: row `view * len(subset) + i`. Returns
+    `(features memmap (rows, 1280) float32, labels int64 array)`.
+    """
+    cache_dir = cache_dir or default_feature_cache_dir()
+    backbone_hash = backbone_hash or backbone_signature(model)
+    key = _split_key(backbone_hash, subset, views, seed)
+    prefix = os.path.join(cache_dir, f"{split_name}-{key}")
+    features_path, labels_path, info_path = f"{prefix}.npy", f"{prefix}.labels.npy", f"{prefix}.json"
+    if os.path.exists(features_path) and os.path.exists(labels_path):
+        print(f"Reusing cached {split_name} features: {features_path}")
+        return np.load(features_path, mmap_mode="r"), np.load(labels_path)
+
+    count = len(subset)
+    if count == 0:
+        # Tiny classes can leave a split empty; there is nothing to cache.
+        return np.zeros((0, model.classifier[-1].in_features), dtype=np.float32), np.zeros((0,), dtype=np.int64)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    features = None
+    labels = np.empty(count * views, dtype=np.int64)
+    was_training = model.training
+    model.eval()
+    try:
+        with torch.random.fork_rng(devices=[]):
+            for view in range(views):
+                if view:
+                    torch.manual_seed(seed + view)
+                loader = DataLoader(
+                    _SubsetView(subset, get_transforms(is_train=view > 0)),
+                    batch_size=batch_size,
+                    shuffle=False,
+                    num_workers=num_workers,
+                )
+                row = view * count
+                with torch.no_grad():
+                    for inputs, batch_labels in loader:
+                        inputs = inputs.to(device).contiguous(memory_format=memory_format)
+                        if forward_context is not None:
+                            with forward_context():
+                                batch_features = pooled_features(model, inputs)
+                        else:
+                            batch_features = pooled_features(model, inputs)
+                        batch_features = batch_features.float().cpu().numpy()
+                        if features is None:
+                            features = np.lib.format.open_memmap(
+                                f"{features_path}.tmp", mode="w+", dtype=np.float32,
+                                shape=(count * views, batch_features.shape[1]))
+                        features[row : row + len(batch_features)] = batch_features
+                        labels[row : row + len(batch_features)] = batch_labels.numpy()
+                        row += len(batch_features)
+    finally:
+        model.train(was_training)
+
+    features.flush()
+    del features
+    os.replace(f"{features_path}.tmp", features_path)
+    np.save(labels_path, labels)
+    with open(info_path, "w", encoding="utf-8") as handle:
+        json.dump({"split": split_name, "backbone": backbone_hash, "samples": count, "views": views, "seed": seed}, handle)
+    print(f"Cached {count * views} {split_name} feature rows at {features_path}")
+    return np.load(features_path, mmap_mode="r"), labels
+
+
+def iterate_feature_batches(features, labels, order, batch_size):
+    for start in range(0, len(order), batch_size):
+        rows = np.sort(order[start : start + batch_size])
+        yield torch.from_numpy(np.ascontiguousarray(features[rows])), torch.from_numpy(labels[rows])
@@ -1,60 +1,34 @@
-import csv
 import os
-import random
-import re
-from collections import defaultdict
 
-from PIL import Image
+import numpy as np
 from torch.utils.data import DataLoader, Dataset, Subset
 
 try:
-    from dataset import BEAN_CLASS_NAMES, MAIZE_CLASS_NAMES, get_transforms, normalize_class_name
+    from dataset import BEAN_CLASS_NAMES, MAIZE_CLASS_NAMES, get_transforms, get_uint8_transforms
+    from image_cache import CachedImageMixin
+    from integrity_scan import filter_samples
+    from metadata_store import ColumnarMetadata, as_columnar, encode_values
+    from manifest_compiler import (  # noqa: F401
+        default_manifest_cache_dir,
+        load_manifest,
+        normalize_crop_name,
+        normalize_label,
+        normalize_season,
+    )
+    from splits import build_stratified_splits, load_or_create_split  # noqa: F401
 except ImportError:  # pragma: no cover - supports `python -m model.train`
-    from .dataset import BEAN_CLASS_NAMES, MAIZE_CLASS_NAMES, get_transforms, normalize_class_name
-
-
-def normalize_crop_name(value):
-    normalized = str(value or "").strip().lower()
-    if normalized in {"bean", "beans"}:
-        return "bean"
-    if normalized in {"maize", "corn", "corn_maize"}:
-        return "maize"
-    return normalized
-
-
-def normalize_season(value):
-    normalized = str(value or "").strip().lower().replace("-", " ").replace("_", " ")
-    if not normalized:
-        return None
-    if normalized in {"a", "season a", "seasona"}:
-        return "season_a"
-    if normalized in {"b", "season b", "seasonb"}:
-        return "season_b"
-    if normalized in {"c", "season c", "seasonc"}:
-        return "season_c"
-    return re.sub(r"\s+", "_", normalized)
-
-
-def _normalize_text(value):
-    normalized = str(value or "").strip().lower()
-    return normalized if normalized else None
-
-
-def normalize_label(label, *, crop_type=None, disease=None):
-    raw = str(label or "").strip()
-    if ":" in raw:
-        crop_name, disease_name = raw.split(":", 1)
-        crop_name = normalize_crop_name(crop_name)
-        disease_name = normalize_class_name(disease_name)
-        if crop_name in {"bean", "maize"}:
-            return f"{crop_name}:{disease_name}"
-        return disease_name
-
-    crop_name = normalize_crop_name(crop_type)
-    disease_name = normalize_class_name(disease if disease is not None else raw)
-    if crop_name in {"bean", "maize"}:
-        return f"{crop_name}:{disease_name}"
-    return disease_name
+    from .dataset import BEAN_CLASS_NAMES, MAIZE_CLASS_NAMES, get_transforms, get_uint8_transforms
+    from .image_cache import CachedImageMixin
+    from .integrity_scan import filter_samples
+    from .metadata_store import ColumnarMetadata, as_columnar, encode_values
+    from .manifest_compiler import (  # noqa: F401
+        default_manifest_cache_dir,
+        load_manifest,
+        normalize_crop_name,
+        normalize_label,
+        normalize_season,
+    )
+    from .splits import build_stratified_splits, load_or_create_split  # noqa: F401
 
 
 def _label_sort_key(label):
@@ -78,79 +52,31 @@ def _label_sort_key(label):
     return (9, 99, label)
 
 
-def _resolve_image_path(raw_path, *, manifest_dir, images_root):
-    image_ref = str(raw_path or "").strip()
-    if not image_ref:
-        return None
-
-    if os.path.isabs(image_ref):
-        return image_ref
-
-    if images_root:
-        candidate = os.path.join(images_root, image_ref)
-        if os.path.exists(candidate):
-            return candidate
-
-    return os.path.join(manifest_dir, image_ref)
-
-
-def _build_metadata(row):
-    return {
-        "country": _normalize_text(row.get("country")) or "rwanda",
-        "province": _normalize_text(row.get("province")),
-        "district": _normalize_text(row.get("district")),
-        "sector": _normalize_text(row.get("sector")),
-        "season": normalize_season(row.get("season")),
-        "rainfall_band": _normalize_text(row.get("rainfall_band") or row.get("rainfall")),
-        "agro_zone": _normalize_text(row.get("agro_zone") or row.get("agro_ecological_zone")),
-        "capture_mode": _normalize_text(row.get("capture_mode")),
-        "source": _normalize_text(row.get("source")),
-        "crop_type": normalize_crop_name(row.get("crop_type") or row.get("crop")),
-    }
-
-
-class ManifestLeafDiseaseDataset(Dataset):
-    def __init__(self, manifest_path, transform=None, class_names=None, images_root=None):
+class ManifestLeafDiseaseDataset(CachedImageMixin, Dataset):
+    def __init__(
+        self,
+        manifest_path,
+        transform=None,
+        class_names=None,
+        images_root=None,
+        image_cache=None,
+        skip_invalid_rows=False,
+        clean_index=None,
+    ):
         self.manifest_path = manifest_path
         self.transform = transform
         self.samples = []
-        self.sample_metadata = []
         self.source_dirs = [f"manifest:{os.path.basename(manifest_path)}"]
 
-        if not os.path.exists(manifest_path):
-            raise FileNotFoundError(f"Manifest not found: {manifest_path}")
-
-        manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
-        resolved_images_root = os.path.abspath(images_root) if images_root else None
-        label_index = defaultdict(list)
-
-        with open(manifest_path, "r", encoding="utf-8-sig", newline="") as handle:
-            reader = csv.DictReader(handle)
-            if not reader.fieldnames:
-                raise RuntimeError(f"Manifest has no headers: {manifest_path}")
-
-            for row_number, row in enumerate(reader, start=2):
-                image_path = _resolve_image_path(
-                    row.get("image_path") or row.get("path") or row.get("image"),
-                    manifest_dir=manifest_dir,
-                    images_root=resolved_images_root,
-                )
-                if not image_path:
-                    raise RuntimeError(f"Row {row_number}: missing image_path/path/image")
-                if not os.path.exists(image_path):
-                    raise RuntimeError(f"Row {row_number}: image not found: {image_path}")
-
-                label = normalize_label(
-                    row.get("label"),
-                    crop_type=row.get("crop_type") or row.get("crop"),
-                    disease=row.get("disease"),
-                )
-                if not label:
-                    raise RuntimeError(
-                        f"Row {row_number}: label is empty. Provide label or crop_type+disease columns.",
-                    )
-
-                label_index[label].append((image_path, _build_metadata(row)))
+        compiled = load_manifest(manifest_path, images_root=images_root, skip_invalid_rows=skip_invalid_rows)
+        paths = compiled["paths"]
+        label_codes = compiled["label_codes"]
+        metadata_codes = compiled["metadata_codes"]
+        metadata_records = compiled["metadata"]
+        label_index = {
+            label: np.flatnonzero(label_codes == code) for code, label in enumerate(compiled["labels"])
+        }
+        label_index = {label: rows for label, rows in label_index.items() if len(rows)}
 
         discovered_labels = sorted(label_index.keys(), key=_label_sort_key)
         if class_names:
@@ -179,25 +105,29 @@ class ManifestLeafDiseaseDataset(Dataset):
         else:
             self.crop_type = "unknown"
 
+        sample_rows = []
         for class_name in self.class_names:
             label_id = self.class_to_idx[class_name]
-            for image_path, metadata in sorted(label_index[class_name], key=lambda item: item[0]):
-                self.samples.append((image_path, label_id))
-                self.sample_metadata.append(metadata)
+            # Stable path sort keeps CSV order for duplicate paths, as before.
+            for row in sorted(label_index[class_name].tolist(), key=paths.__getitem__):
+                self.samples.append((paths[row], label_id))
+                sample_rows.append(row)
+        if clean_index:
+            self.samples, kept = filter_samples(self.samples, clean_index)
+            sample_rows = [sample_rows[position] for position in kept]
+        self.sample_metadata = ColumnarMetadata.from_records(metadata_records, metadata_codes[sample_rows])
 
         if not self.samples:
             raise RuntimeError(f"No samples loaded from manifest: {manifest_path}")
+        if image_cache:
+            self.attach_image_cache(image_cache)
 
     def __len__(self):
         return len(self.samples)
 
     def __getitem__(self, idx):
-        image_path, label = self.samples[idx]
-        try:
-            image = Image.open(image_path).convert("RGB")
-        except Exception as exc:  # noqa: BLE001
-            print(f"Error loading image {image_path}: {exc}")
-            image = Image.new("RGB", (224, 224), (0, 0, 0))
+        _, label = self.samples[idx]
+        image = self._load_image(idx)
 
         if self.transform:
             image = self.transform(image)
@@ -213,9 +143,13 @@ class _TransformSubset(Dataset):
         self.idx_to_class = subset.dataset.idx_to_class
         self.crop_type = subset.dataset.crop_type
         self.source_dirs = subset.dataset.source_dirs
+        self.split = getattr(subset.dataset, "split", None)
 
         source_metadata = getattr(subset.dataset, "sample_metadata", [])
-        self.sample_metadata = [source_metadata[i] for i in subset.indices] if source_metadata else []
+        if isinstance(source_metadata, ColumnarMetadata):
+            self.sample_metadata = source_metadata.subset(subset.indices)
+        else:
+            self.sample_metadata = [source_metadata[i] for i in subset.indices] if source_metadata else []
 
     def __getitem__(self, idx):
         image, label = self.subset[idx]
@@ -227,41 +161,6 @@ class _TransformSubset(Dataset):
         return len(self.subset)
 
 
-def build_stratified_splits(samples, train_ratio=0.7, val_ratio=0.15, seed=42):
-    by_label = defaultdict(list)
-    for index, (_, label) in enumerate(samples):
-        by_label[label].append(index)
-
-    rng = random.Random(seed)
-    train_indices = []
-    val_indices = []
-    test_indices = []
-
-    for _, indices in by_label.items():
-        rng.shuffle(indices)
-        total = len(indices)
-        n_train = int(total * train_ratio)
-        n_val = int(total * val_ratio)
-        n_test = total - n_train - n_val
-
-        if total >= 3:
-            if n_val == 0:
-                n_val = 1
-                n_train = max(1, n_train - 1)
-            if n_test == 0:
-                n_test = 1
-                n_train = max(1, n_train - 1)
-
-        train_indices.extend(indices[:n_train])
-        val_indices.extend(indices[n_train : n_train + n_val])
-        test_indices.extend(indices[n_train + n_val : n_train + n_val + n_test])
-
-    rng.shuffle(train_indices)
-    rng.shuffle(val_indices)
-    rng.shuffle(test_indices)
-    return train_indices, val_indices, test_indices
-
-
 def get_manifest_dataloaders(
     manifest_path,
     *,
@@ -270,21 +169,30 @@ def get_manifest_dataloaders(
     class_names=None,
     images_root=None,
     split_seed=42,
+    image_cache=None,
+    skip_invalid_rows=False,
+    augment="pil",
+    clean_index=None,
 ):
     full_dataset = ManifestLeafDiseaseDataset(
         manifest_path=manifest_path,
         transform=None,
         class_names=class_names,
         images_root=images_root,
+        image_cache=image_cache,
+        skip_invalid_rows=skip_invalid_rows,
+        clean_index=clean_index,
     )
-    train_indices, val_indices, test_indices = build_stratified_splits(
-        full_dataset.samples,
-        seed=split_seed,
-    )
+    split = load_or_create_split(full_dataset.samples, split_dir=default_manifest_cache_dir(), seed=split_seed)
+    full_dataset.split = split
 
-    train_subset = _TransformSubset(Subset(full_dataset, train_indices), transform=get_transforms(is_train=True))
-    val_subset = _TransformSubset(Subset(full_dataset, val_indices), transform=get_transforms(is_train=False))
-    test_subset = _TransformSubset(Subset(full_dataset, test_indices), transform=get_transforms(is_train=False))
+    if augment == "batch":
+        train_transform = eval_transform = get_uint8_transforms()
+    else:
+        train_transform, eval_transform = get_transforms(is_train=True), get_transforms(is_train=False)
+    train_subset = _TransformSubset(Subset(full_dataset, split.train), transform=train_transform)
+    val_subset = _TransformSubset(Subset(full_dataset, split.val), transform=eval_transform)
+    test_subset = _TransformSubset(Subset(full_dataset, split.test), transform=eval_transform)
 
     train_loader = DataLoader(train_subset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
     val_loader = DataLoader(val_subset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
@@ -330,9 +238,15 @@ def load_sampling_profile(profile_path=None):
 
 
 def compute_metadata_sample_weights(sample_metadata, sample_label_names, profile):
+    """Per-sample sampling weights as a float64 array, computed column-wise.
+
+    Each metadata column contributes a lookup table over its distinct values,
+    and crop/disease weights are resolved once per distinct (crop, label) pair.
+    """
     if not sample_metadata or len(sample_metadata) != len(sample_label_names):
         return None
 
+    metadata = as_columnar(sample_metadata)
     season_weights = dict(profile.get("season_weights") or {})
     province_weights = dict(profile.get("province_weights") or {})
     rainfall_weights = dict(profile.get("rainfall_weights") or {})
@@ -343,29 +257,28 @@ def compute_metadata_sample_weights(sample_metadata, sample_label_names, profile
     min_weight = float(profile.get("min_weight", 0.6))
     max_weight = float(profile.get("max_weight", 3.0))
 
-    weights = []
-    for metadata, label in zip(sample_metadata, sample_label_names):
-        meta = metadata if isinstance(metadata, dict) else {}
-
-        crop_type = normalize_crop_name(meta.get("crop_type"))
-        disease_name = str(label or "").strip().lower()
-        province = str(meta.get("province") or "").strip().lower()
-        district = str(meta.get("district") or "").strip().lower()
-        season = str(meta.get("season") or "").strip().lower()
-        rainfall_band = str(meta.get("rainfall_band") or "").strip().lower()
+    crop_codes, crop_values = metadata.normalized_column("crop_type")
+    label_codes, label_values = encode_values(sample_label_names)
+    pairs, pair_codes = np.unique(crop_codes.astype(np.int64) * len(label_values) + label_codes, return_inverse=True)
 
+    pair_weights = np.empty(len(pairs), dtype=np.float64)
+    for position, pair in enumerate(pairs.tolist()):
+        crop_type = normalize_crop_name(crop_values[pair // len(label_values)])
+        disease_name = str(label_values[pair % len(label_values)] or "").strip().lower()
         if ":" in disease_name and crop_type not in {"bean", "maize"}:
             crop_type = disease_name.split(":", 1)[0]
         if ":" not in disease_name and crop_type in {"bean", "maize"}:
             disease_name = f"{crop_type}:{disease_name}"
-
-        weight = 1.0
-        weight *= float(crop_weights.get(crop_type, 1.0))
-        weight *= float(disease_weights.get(disease_name, 1.0))
-        weight *= float(province_weights.get(province, 1.0))
-        weight *= float(district_weights.get(district, 1.0))
-        weight *= float(season_weights.get(season, 1.0))
-        weight *= float(rainfall_weights.get(rainfall_band, 1.0))
-
-        weights.append(max(min_weight, min(max_weight, weight)))
-    return weights
+        pair_weights[position] = 1.0 * float(crop_weights.get(crop_type, 1.0)) * float(disease_weights.get(disease_name, 1.0))
+
+    weights = pair_weights[pair_codes.reshape(-1)]
+    for field, table in (
+        ("province", province_weights),
+        ("district", district_weights),
+        ("season", season_weights),
+        ("rainfall_band", rainfall_weights),
+    ):
+        codes, values = metadata.normalized_column(field)
+        weights = weights * np.array([float(table.get(value, 1.0)) for value in values], dtype=np.float64)[codes]
+
+    return np.clip(weights, min_weight, max_weight)
@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_CACHE_SIZE = 256
+
+
+def source_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _cache_files(cache_path):
+    return f"{cache_path}.npy", f"{cache_path}.json"
+
+
+def _decode_resized(task):
+    row, path, size = task
+    try:
+        with Image.open(path) as image:
+            # Same squash-to-square geometry as get_transforms' Resize((224, 224)),
+            # so cached and uncached training see identical framing.
+            pixels = np.asarray(image.convert("RGB").resize((size, size), Image.BILINEAR), dtype=np.uint8)
+        return row, pixels, None
+    except Exception as exc:  # noqa: BLE001
+        return row, None, str(exc)
+
+
+def compile_image_cache(image_paths, cache_path, *, size=DEFAULT_CACHE_SIZE, num_workers=0):
+    """Decode every image once into a single uint8 memmap of shape (N, size, size, 3).
+
+    A JSON sidecar records the source path and size/mtime signature of each row
+    so datasets can tell which rows are still valid.
+    """
+    image_paths = [str(path) for path in image_paths]
+    data_path, index_path = _cache_files(cache_path)
+    os.makedirs(os.path.dirname(os.path.abspath(data_path)), exist_ok=True)
+
+    pixels = np.lib.format.open_memmap(
+        f"{data_path}.tmp", mode="w+", dtype=np.uint8, shape=(len(image_paths), size, size, 3))
+    signatures = [source_signature(path) for path in image_paths]
+    failures = []
+    tasks = [(row, path, size) for row, path in enumerate(image_paths)]
+
+    if num_workers and num_workers > 1:
+        with Pool(num_workers) as pool:
+            results = pool.imap_unordered(_decode_resized, tasks, chunksize=64)
+            for row, array, error in results:
+                if array is None:
+                    failures.append({"path": image_paths[row], "error": error})
+                    signatures[row] = None
+                else:
+                    pixels[row] = array
+    else:
+        for task in tasks:
+            row, array, error = _decode_resized(task)
+            if array is None:
+                failures.append({"path": image_paths[row], "error": error})
+                signatures[row] = None
+            else:
+                pixels[row] = array
+
+    pixels.flush()
+    del pixels
+    os.replace(f"{data_path}.tmp", data_path)
+
+    index = {
+        "size": int(size),
+        "count": len(image_paths),
+        "paths": [os.path.abspath(path) for path in image_paths],
+        "signatures": signatures,
+        "failures": failures,
+    }
+    with open(index_path, "w", encoding="utf-8") as handle:
+        json.dump(index, handle)
+    return index
+
+
+class ImageCache:
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.data_path, index_path = _cache_files(cache_path)
+        if not os.path.exists(self.data_path) or not os.path.exists(index_path):
+            raise FileNotFoundError(f"Image cache not found: {cache_path}")
+
+        with open(index_path, "r", encoding="utf-8") as handle:
+            index = json.load(handle)
+        self.size = int(index["size"])
+        self._row_by_path = {path: row for row, path in enumerate(index["paths"])}
+        self._signatures = index["signatures"]
+        self._pixels = None
+
+    def __getstate__(self):
+        # DataLoader workers reopen the memmap instead of pickling it.
+        state = dict(self.__dict__)
+        state["_pixels"] = None
+        return state
+
+    def rows_for(self, image_paths):
+        """Cache row per path, or -1 where the file is missing from the cache or changed since compile."""
+        rows = np.full(len(image_paths), -1, dtype=np.int64)
+        for position, path in enumerate(image_paths):
+            row = self._row_by_path.get(os.path.abspath(path))
+            if row is None or self._signatures[row] is None:
+                continue
+            if source_signature(path) == self._signatures[row]:
+                rows[position] = row
+        return rows
+
+    def read(self, row):
+        if self._pixels is None:
+            self._pixels = np.load(self.data_path, mmap_mode="r")
+        return self._pixels[row]
+
+
+class CachedImageMixin:
+    """Shared image loading for datasets whose `samples` are (path, label) pairs."""
+
+    image_cache = None
+    _cache_rows = None
+
+    def attach_image_cache(self, cache):
+        if isinstance(cache, str):
+            cache = ImageCache(cache)
+        self.image_cache = cache
+        self._cache_rows = cache.rows_for([path for path, _ in self.samples])
+        hits = int((self._cache_rows >= 0).sum())
+        print(f"Image cache {cache.cache_path}: {hits}/{len(self.samples)} samples served from cache")
+        return hits
+
+    def _load_image(self, idx):
+        if self._cache_rows is not None and self._cache_rows[idx] >= 0:
+            return Image.fromarray(np.array(self.image_cache.read(int(self._cache_rows[idx]))))
+
+        img_path = self.samples[idx][0]
+        try:
+            return Image.open(img_path).convert("RGB")
+        except Exception as exc:  # noqa: BLE001
+            print(f"Error loading image {img_path}: {exc}")
+            return Image.new("RGB", (224, 224), (0, 0, 0))
+
+
+if __name__ == "__main__":
+    try:
+        from dataset import LeafDiseaseDataset, MultiCropLeafDiseaseDataset
+        from finetune_dataset import ManifestLeafDiseaseDataset
+    except ImportError:  # pragma: no cover - supports `python -m model.image_cache`
+        from .dataset import LeafDiseaseDataset, MultiCropLeafDiseaseDataset
+        from .finetune_dataset import ManifestLeafDiseaseDataset
+
+    parser = argparse.ArgumentParser(description="Compile a preprocessed uint8 image cache for training/evaluation")
+    parser.add_argument("--data_dir", type=str, default=None, help="Path to one dataset root (class folders inside)")
+    parser.add_argument("--data_dirs", type=str, default=None, help="Comma-separated dataset roots")
+    parser.add_argument("--manifest_path", type=str, default=None, help="CSV manifest path")
+    parser.add_argument("--manifest_images_root", type=str, default=None, help="Optional manifest images root")
+    parser.add_argument("--output", type=str, required=True, help="Cache path prefix (writes <output>.npy and <output>.json)")
+    parser.add_argument("--size", type=int, default=DEFAULT_CACHE_SIZE, help="Cached square resolution")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count() or 1, help="Decode processes")
+
+    args = parser.parse_args()
+    if args.manifest_path:
+        dataset = ManifestLeafDiseaseDataset(args.manifest_path, images_root=args.manifest_images_root)
+    elif args.data_dirs:
+        dataset = MultiCropLeafDiseaseDataset([item.strip() for item in args.data_dirs.split(",") if item.strip()])
+    elif args.data_dir:
+        dataset = LeafDiseaseDataset(args.data_dir)
+    else:
+        parser.error("Provide --manifest_path, or --data_dir, or --data_dirs")
+
+    result = compile_image_cache(
+        [path for path, _ in dataset.samples],
+        args.output,
+        size=args.size,
+        num_workers=args.num_workers,
+    )
+    print(f"Cached {result['count'] - len(result['failures'])}/{result['count']} images at {args.output}")
+    for failure in result["failures"]:
+        print(f"  failed: {failure['path']}: {failure['error']}")
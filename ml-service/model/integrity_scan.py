@@ -0,0 +1,254 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+from collections import Counter, defaultdict
+from multiprocessing import Pool
+
+from PIL import Image
+
+try:
+    from image_cache import source_signature
+except ImportError:  # pragma: no cover - supports `python -m model.train`
+    from .image_cache import source_signature
+
+CLEAN_INDEX_VERSION = 1
+DHASH_BITS = 64
+
+
+def dhash(image):
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 grayscale thumbnail."""
+    pixels = image.convert("L").resize((9, 8), Image.BILINEAR).tobytes()
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = (value << 1) | int(pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return value
+
+
+def _scan_file(task):
+    position, path = task
+    result = {"path": path, "signature": source_signature(path)}
+    try:
+        with open(path, "rb") as handle:
+            payload = handle.read()
+        result["sha256"] = hashlib.sha256(payload).hexdigest()
+        with Image.open(io.BytesIO(payload)) as image:
+            image.verify()
+        # verify() leaves the image unusable; decode fully from a fresh handle.
+        with Image.open(io.BytesIO(payload)) as image:
+            image.load()
+            result["width"], result["height"] = image.size
+            result["dhash"] = f"{dhash(image):016x}"
+        result["ok"] = True
+    except Exception as exc:  # noqa: BLE001
+        result["ok"] = False
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    return position, result
+
+
+def scan_paths(paths, *, num_workers=0, previous=None):
+    """Verify, decode and hash every path; results whose size/mtime signature is unchanged are reused."""
+    previous = previous or {}
+    results = [None] * len(paths)
+    tasks = []
+    for position, path in enumerate(paths):
+        cached = previous.get(os.path.abspath(path))
+        if cached and cached.get("signature") and cached["signature"] == source_signature(path):
+            results[position] = dict(cached, path=path)
+        else:
+            tasks.append((position, path))
+
+    if num_workers and num_workers > 1 and len(tasks) > 1:
+        with Pool(num_workers) as pool:
+            for position, result in pool.imap_unordered(_scan_file, tasks, chunksize=32):
+                results[position] = result
+    else:
+        for task in tasks:
+            position, result = _scan_file(task)
+            results[position] = result
+    return results, len(tasks)
+
+
+def _hamming(left, right):
+    return bin(left ^ right).count("1")
+
+
+def find_dropped(samples, results, class_names, *, max_distance=0):
+    """Corrupt files, then exact (sha256) and perceptual (dHash within `max_distance`) duplicates.
+
+    The first occurrence in sample order is kept; a path the manifest lists
+    more than once is not a duplicate of itself, and each dropped entry
+    records which `occurrence` of its path it is. Near-duplicate candidates
+    come from `max_distance + 1` hash bands, any of which must match exactly
+    for two hashes within that Hamming distance (pigeonhole).
+    """
+    if max_distance > 15:
+        raise ValueError("max_distance above 15 bits would treat unrelated photos as duplicates")
+    dropped = []
+    kept_by_sha = {}
+    bands = max_distance + 1 if max_distance >= 0 else 0
+    width = DHASH_BITS // bands if bands else 0
+    buckets = defaultdict(list)
+    seen = Counter()
+    occurrences = []
+    for path, _ in samples:
+        occurrences.append(seen[os.path.abspath(path)])
+        seen[os.path.abspath(path)] += 1
+
+    def drop(position, reason, **fields):
+        path, label = samples[position]
+        dropped.append({
+            "path": path,
+            "occurrence": occurrences[position],
+            "label": class_names[label],
+            "reason": reason,
+            **fields,
+        })
+
+    for position, result in enumerate(results):
+        if not result["ok"]:
+            drop(position, "corrupt", error=result["error"])
+            continue
+
+        original = kept_by_sha.get(result["sha256"])
+        if original is not None and os.path.abspath(samples[original][0]) == os.path.abspath(samples[position][0]):
+            # The same file listed twice keeps both rows, as the manifest loaders do.
+            continue
+        reason = "duplicate"
+        if original is None and bands:
+            value = int(result["dhash"], 16)
+            for band in range(bands):
+                for candidate in buckets[(band, (value >> (band * width)) & ((1 << width) - 1))]:
+                    if _hamming(value, int(results[candidate]["dhash"], 16)) <= max_distance:
+                        original, reason = candidate, "near_duplicate"
+                        break
+                if original is not None:
+                    break
+
+        if original is not None:
+            drop(
+                position,
+                reason,
+                duplicate_of=samples[original][0],
+                label_conflict=samples[original][1] != samples[position][1],
+            )
+            continue
+
+        kept_by_sha[result["sha256"]] = position
+        if bands:
+            value = int(result["dhash"], 16)
+            for band in range(bands):
+                buckets[(band, (value >> (band * width)) & ((1 << width) - 1))].append(position)
+    return dropped
+
+
+def build_clean_index(dataset, output_path, *, num_workers=0, max_distance=0):
+    """Scan `dataset.samples` and write the clean index (scan results plus the dropped list)."""
+    previous = {}
+    if os.path.exists(output_path):
+        try:
+            with open(output_path, "r", encoding="utf-8") as handle:
+                previous = json.load(handle).get("scans", {})
+        except (OSError, ValueError):
+            previous = {}
+
+    paths = [path for path, _ in dataset.samples]
+    results, scanned = scan_paths(paths, num_workers=num_workers, previous=previous)
+    dropped = find_dropped(dataset.samples, results, dataset.class_names, max_distance=max_distance)
+    payload = {
+        "version": CLEAN_INDEX_VERSION,
+        "source_dirs": list(getattr(dataset, "source_dirs", [])),
+        "max_distance": max_distance,
+        "samples": len(paths),
+        "scanned": scanned,
+        "kept": len(paths) - len(dropped),
+        "dropped": dropped,
+        "scans": {
+            os.path.abspath(result["path"]): {key: value for key, value in result.items() if key != "path"}
+            for result in results
+        },
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle)
+    os.replace(tmp_path, output_path)
+    return payload
+
+
+def _load_dropped(clean_index):
+    with open(clean_index, "r", encoding="utf-8") as handle:
+        payload = json.load(handle)
+    if payload.get("version") != CLEAN_INDEX_VERSION:
+        raise RuntimeError(f"Unsupported clean index version in {clean_index}: {payload.get('version')}")
+    return payload["dropped"]
+
+
+def load_excluded_paths(clean_index):
+    return {os.path.abspath(entry["path"]) for entry in _load_dropped(clean_index)}
+
+
+def filter_samples(samples, clean_index):
+    """`(kept samples, kept positions)` after removing the clean index's dropped occurrences."""
+    # Entries without an occurrence (older indexes) exclude every row of their path.
+    excluded = {(os.path.abspath(entry["path"]), entry.get("occurrence")) for entry in _load_dropped(clean_index)}
+    seen = Counter()
+    positions = []
+    for position, (path, _) in enumerate(samples):
+        key = os.path.abspath(path)
+        occurrence = seen[key]
+        seen[key] += 1
+        if (key, occurrence) not in excluded and (key, None) not in excluded:
+            positions.append(position)
+    if len(positions) != len(samples):
+        print(f"Clean index {clean_index}: excluded {len(samples) - len(positions)}/{len(samples)} samples")
+    return [samples[position] for position in positions], positions
+
+
+if __name__ == "__main__":
+    try:
+        from dataset import LeafDiseaseDataset, MultiCropLeafDiseaseDataset
+        from finetune_dataset import ManifestLeafDiseaseDataset
+    except ImportError:  # pragma: no cover - supports `python -m model.integrity_scan`
+        from .dataset import LeafDiseaseDataset, MultiCropLeafDiseaseDataset
+        from .finetune_dataset import ManifestLeafDiseaseDataset
+
+    parser = argparse.ArgumentParser(description="Verify every image once and write a deduplicated clean index")
+    parser.add_argument("--data_dir", type=str, default=None, help="Path to one dataset root (class folders inside)")
+    parser.add_argument("--data_dirs", type=str, default=None, help="Comma-separated dataset roots")
+    parser.add_argument("--manifest_path", type=str, default=None, help="CSV manifest path")
+    parser.add_argument("--manifest_images_root", type=str, default=None, help="Optional manifest images root")
+    parser.add_argument("--output", type=str, required=True, help="Clean index JSON (re-scans reuse unchanged files)")
+    parser.add_argument(
+        "--dhash_distance",
+        type=int,
+        default=0,
+        help="Max dHash Hamming distance treated as a near-duplicate (0 = identical hash, -1 = content hash only)",
+    )
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count() or 1, help="Scan processes")
+
+    args = parser.parse_args()
+    if args.manifest_path:
+        dataset = ManifestLeafDiseaseDataset(args.manifest_path, images_root=args.manifest_images_root)
+    elif args.data_dirs:
+        dataset = MultiCropLeafDiseaseDataset([item.strip() for item in args.data_dirs.split(",") if item.strip()])
+    elif args.data_dir:
+        dataset = LeafDiseaseDataset(args.data_dir)
+    else:
+        parser.error("Provide --manifest_path, or --data_dir, or --data_dirs")
+
+    result = build_clean_index(dataset, args.output, num_workers=args.num_workers, max_distance=args.dhash_distance)
+    reasons = defaultdict(int)
+    for entry in result["dropped"]:
+        reasons[entry["reason"]] += 1
+    print(
+        f"Scanned {result['scanned']} new/changed of {result['samples']} images; kept {result['kept']}, "
+        f"dropped {len(result['dropped'])} ({dict(reasons)})"
+    )
+    for entry in result["dropped"]:
+        detail = entry.get("error") or f"duplicate of {entry['duplicate_of']}"
+        conflict = " [label conflict]" if entry.get("label_conflict") else ""
+        print(f"  {entry['reason']}: {entry['path']} ({entry['label']}): {detail}{conflict}")
+    print(f"Clean index written to {args.output}")
@@ -0,0 +1,335 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from dataset import normalize_class_name
+except ImportError:  # pragma: no cover - supports `python -m model.train`
+    from .dataset import normalize_class_name
+
+COMPILED_MANIFEST_VERSION = 1
+MAX_REPORTED_ERRORS = 20
+_METADATA_COLUMNS = (
+    "country",
+    "province",
+    "district",
+    "sector",
+    "season",
+    "rainfall_band",
+    "rainfall",
+    "agro_zone",
+    "agro_ecological_zone",
+    "capture_mode",
+    "source",
+    "crop_type",
+    "crop",
+)
+
+
+def normalize_crop_name(value):
+    normalized = str(value or "").strip().lower()
+    if normalized in {"bean", "beans"}:
+        return "bean"
+    if normalized in {"maize", "corn", "corn_maize"}:
+        return "maize"
+    return normalized
+
+
+def normalize_season(value):
+    normalized = str(value or "").strip().lower().replace("-", " ").replace("_", " ")
+    if not normalized:
+        return None
+    if normalized in {"a", "season a", "seasona"}:
+        return "season_a"
+    if normalized in {"b", "season b", "seasonb"}:
+        return "season_b"
+    if normalized in {"c", "season c", "seasonc"}:
+        return "season_c"
+    return re.sub(r"\s+", "_", normalized)
+
+
+def _normalize_text(value):
+    normalized = str(value or "").strip().lower()
+    return normalized if normalized else None
+
+
+def normalize_label(label, *, crop_type=None, disease=None):
+    raw = str(label or "").strip()
+    if ":" in raw:
+        crop_name, disease_name = raw.split(":", 1)
+        crop_name = normalize_crop_name(crop_name)
+        disease_name = normalize_class_name(disease_name)
+        if crop_name in {"bean", "maize"}:
+            return f"{crop_name}:{disease_name}"
+        return disease_name
+
+    crop_name = normalize_crop_name(crop_type)
+    disease_name = normalize_class_name(disease if disease is not None else raw)
+    if crop_name in {"bean", "maize"}:
+        return f"{crop_name}:{disease_name}"
+    return disease_name
+
+
+def _build_metadata(row):
+    return {
+        "country": _normalize_text(row.get("country")) or "rwanda",
+        "province": _normalize_text(row.get("province")),
+        "district": _normalize_text(row.get("district")),
+        "sector": _normalize_text(row.get("sector")),
+        "season": normalize_season(row.get("season")),
+        "rainfall_band": _normalize_text(row.get("rainfall_band") or row.get("rainfall")),
+        "agro_zone": _normalize_text(row.get("agro_zone") or row.get("agro_ecological_zone")),
+        "capture_mode": _normalize_text(row.get("capture_mode")),
+        "source": _normalize_text(row.get("source")),
+        "crop_type": normalize_crop_name(row.get("crop_type") or row.get("crop")),
+    }
+
+
+class ManifestError(RuntimeError):
+    """Raised with every invalid manifest row, not just the first one."""
+
+    def __init__(self, manifest_path, errors):
+        self.manifest_path = manifest_path
+        self.errors = list(errors)
+        lines = [f"{len(self.errors)} invalid row(s) in manifest {manifest_path}:"]
+        lines.extend(f"  Row {row_number}: {message}" for row_number, message in self.errors[:MAX_REPORTED_ERRORS])
+        if len(self.errors) > MAX_REPORTED_ERRORS:
+            lines.append(f"  ... and {len(self.errors) - MAX_REPORTED_ERRORS} more")
+        super().__init__("\n".join(lines))
+
+
+def default_manifest_cache_dir():
+    configured = os.getenv("MANIFEST_CACHE_DIR")
+    if configured:
+        return configured
+    return os.path.join(os.path.expanduser("~"), ".cache", "d2p-agri", "manifests")
+
+
+def manifest_signature(manifest_path, images_root=None):
+    """Hash of the CSV bytes plus everything that changes how its paths resolve."""
+    digest = hashlib.sha256()
+    with open(manifest_path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(f"|v{COMPILED_MANIFEST_VERSION}".encode("utf-8"))
+    digest.update(f"|{os.path.dirname(os.path.abspath(manifest_path))}".encode("utf-8"))
+    digest.update(f"|{os.path.abspath(images_root) if images_root else ''}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def compiled_manifest_path(manifest_path, signature, cache_dir=None):
+    name = os.path.splitext(os.path.basename(manifest_path))[0] or "manifest"
+    return os.path.join(cache_dir or default_manifest_cache_dir(), f"{name}-{signature[:16]}.npz")
+
+
+def _parallel_exists(paths, num_workers):
+    if not paths:
+        return []
+    if num_workers <= 1:
+        return [os.path.exists(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(os.path.exists, paths, chunksize=256))
+
+
+def _resolve_image_paths(image_refs, *, manifest_dir, images_root, num_workers):
+    """Same precedence as the per-row resolver: absolute, then images_root, then manifest dir.
+
+    Existence checks (the slow part on network storage) run on a thread pool.
+    """
+    resolved = [None] * len(image_refs)
+    pending = []
+    for position, image_ref in enumerate(image_refs):
+        if not image_ref:
+            continue
+        if os.path.isabs(image_ref):
+            resolved[position] = image_ref
+        elif images_root:
+            pending.append(position)
+        else:
+            resolved[position] = os.path.join(manifest_dir, image_ref)
+
+    candidates = [os.path.join(images_root, image_refs[position]) for position in pending] if images_root else []
+    for position, candidate, found in zip(pending, candidates, _parallel_exists(candidates, num_workers)):
+        resolved[position] = candidate if found else os.path.join(manifest_dir, image_refs[position])
+
+    checked = [position for position, path in enumerate(resolved) if path is not None]
+    exists = [False] * len(image_refs)
+    for position, found in zip(checked, _parallel_exists([resolved[position] for position in checked], num_workers)):
+        exists[position] = found
+    return resolved, exists
+
+
+def compile_manifest(manifest_path, *, images_root=None, num_workers=32):
+    """Parse, validate and normalize a CSV manifest in one pass.
+
+    Returns a dict with parallel `paths`/`label_codes`/`metadata_codes` arrays,
+    the distinct `labels` and `metadata` records they index, and `errors` as
+    `(row_number, message)` pairs for every invalid row.
+    """
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"Manifest not found: {manifest_path}")
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    resolved_images_root = os.path.abspath(images_root) if images_root else None
+
+    image_refs = []
+    label_keys = []
+    metadata_keys = []
+    with open(manifest_path, "r", encoding="utf-8-sig", newline="") as handle:
+        reader = csv.DictReader(handle)
+        if not reader.fieldnames:
+            raise RuntimeError(f"Manifest has no headers: {manifest_path}")
+        for row in reader:
+            image_refs.append(str(row.get("image_path") or row.get("path") or row.get("image") or "").strip())
+            label_keys.append((row.get("label"), row.get("crop_type") or row.get("crop"), row.get("disease")))
+            metadata_keys.append(tuple(row.get(column) for column in _METADATA_COLUMNS))
+
+    paths, exists = _resolve_image_paths(
+        image_refs,
+        manifest_dir=manifest_dir,
+        images_root=resolved_images_root,
+        num_workers=num_workers,
+    )
+
+    # Manifests repeat a small set of label/metadata combinations, so normalize
+    # each distinct combination once and store per-row codes.
+    label_normalized = {
+        key: normalize_label(key[0], crop_type=key[1], disease=key[2]) for key in set(label_keys)
+    }
+    labels = sorted({label for label in label_normalized.values() if label})
+    label_code_of = {label: code for code, label in enumerate(labels)}
+    metadata_code_of = {}
+    metadata = []
+    for key in metadata_keys:
+        if key not in metadata_code_of:
+            metadata_code_of[key] = len(metadata)
+            metadata.append(_build_metadata(dict(zip(_METADATA_COLUMNS, key))))
+
+    errors = []
+    label_codes = np.full(len(image_refs), -1, dtype=np.int32)
+    for position, (path, found, label_key) in enumerate(zip(paths, exists, label_keys)):
+        row_number = position + 2
+        label = label_normalized[label_key]
+        if not path:
+            errors.append((row_number, "missing image_path/path/image"))
+        elif not found:
+            errors.append((row_number, f"image not found: {path}"))
+        elif not label:
+            errors.append((row_number, "label is empty. Provide label or crop_type+disease columns."))
+        else:
+            label_codes[position] = label_code_of[label]
+
+    return {
+        "paths": [path or "" for path in paths],
+        "label_codes": label_codes,
+        "metadata_codes": np.asarray([metadata_code_of[key] for key in metadata_keys], dtype=np.int32),
+        "labels": labels,
+        "metadata": metadata,
+        "errors": errors,
+    }
+
+
+def _text_array(value):
+    return np.frombuffer(value.encode("utf-8"), dtype=np.uint8)
+
+
+def save_compiled_manifest(compiled, output_path):
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tables = {"labels": compiled["labels"], "metadata": compiled["metadata"], "errors": compiled["errors"]}
+    tmp_path = f"{output_path}.tmp.npz"
+    np.savez(
+        tmp_path,
+        paths=_text_array("\0".join(compiled["paths"])),
+        label_codes=compiled["label_codes"],
+        metadata_codes=compiled["metadata_codes"],
+        tables=_text_array(json.dumps(tables)),
+    )
+    os.replace(tmp_path, output_path)
+
+
+def read_compiled_manifest(compiled_path):
+    with np.load(compiled_path, allow_pickle=False) as payload:
+        tables = json.loads(payload["tables"].tobytes().decode("utf-8"))
+        path_blob = payload["paths"].tobytes().decode("utf-8")
+        label_codes = payload["label_codes"]
+        return {
+            "paths": path_blob.split("\0") if len(label_codes) else [],
+            "label_codes": label_codes,
+            "metadata_codes": payload["metadata_codes"],
+            "labels": tables["labels"],
+            "metadata": tables["metadata"],
+            "errors": [tuple(error) for error in tables["errors"]],
+        }
+
+
+def _missing_images_restored(compiled, num_workers):
+    """True when any image reported missing by a cached compile exists now."""
+    missing = [
+        compiled["paths"][row_number - 2]
+        for row_number, message in compiled["errors"]
+        if message.startswith("image not found")
+    ]
+    return any(_parallel_exists(missing, num_workers))
+
+
+def load_manifest(manifest_path, *, images_root=None, cache_dir=None, num_workers=32, skip_invalid_rows=False):
+    """Compiled manifest for `manifest_path`, reusing the cached copy when the CSV is unchanged.
+
+    Image existence is checked when the manifest is compiled. Compiles with
+    invalid rows are cached too, with their errors; on reuse only the images
+    reported missing are checked again, and restoring any of them triggers a
+    recompile.
+    """
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"Manifest not found: {manifest_path}")
+
+    compiled_path = compiled_manifest_path(
+        manifest_path, manifest_signature(manifest_path, images_root), cache_dir)
+    compiled = None
+    if os.path.exists(compiled_path):
+        try:
+            compiled = read_compiled_manifest(compiled_path)
+        except (OSError, ValueError, KeyError) as exc:
+            print(f"Warning: ignoring unreadable compiled manifest {compiled_path}: {exc}")
+        if compiled is not None and _missing_images_restored(compiled, num_workers):
+            compiled = None
+
+    if compiled is None:
+        compiled = compile_manifest(manifest_path, images_root=images_root, num_workers=num_workers)
+        try:
+            save_compiled_manifest(compiled, compiled_path)
+        except OSError as exc:
+            print(f"Warning: could not write compiled manifest {compiled_path}: {exc}")
+
+    if compiled["errors"]:
+        error = ManifestError(manifest_path, compiled["errors"])
+        if not skip_invalid_rows:
+            raise error
+        print(f"Warning: skipping {error}")
+    return compiled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate a CSV manifest and cache its compiled form")
+    parser.add_argument("--manifest_path", type=str, required=True, help="CSV manifest path")
+    parser.add_argument("--manifest_images_root", type=str, default=None, help="Optional manifest images root")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Compiled manifest directory (default MANIFEST_CACHE_DIR)")
+    parser.add_argument("--num_workers", type=int, default=32, help="Threads used for image existence checks")
+
+    args = parser.parse_args()
+    result = compile_manifest(args.manifest_path, images_root=args.manifest_images_root, num_workers=args.num_workers)
+    valid = int((result["label_codes"] >= 0).sum())
+    print(f"{valid}/{len(result['paths'])} valid rows, {len(result['labels'])} labels")
+    output_path = compiled_manifest_path(
+        args.manifest_path, manifest_signature(args.manifest_path, args.manifest_images_root), args.cache_dir)
+    save_compiled_manifest(result, output_path)
+    print(f"Compiled manifest written to {output_path}")
+    if result["errors"]:
+        print(ManifestError(args.manifest_path, result["errors"]))
+        raise SystemExit(1)
@@ -0,0 +1,129 @@
+import numpy as np
+
+METADATA_FIELDS = (
+    "country",
+    "province",
+    "district",
+    "sector",
+    "season",
+    "rainfall_band",
+    "agro_zone",
+    "capture_mode",
+    "source",
+    "crop_type",
+)
+GROUP_ACCURACY_KEYS = ("province", "district", "season", "rainfall_band")
+
+
+class ColumnarMetadata:
+    """Per-sample manifest metadata stored as int32 category codes per field.
+
+    Each field keeps a small vocabulary of distinct values and one code per
+    sample (-1 for missing), so a million-row manifest costs a few int32
+    columns instead of a million dicts. Indexing or iterating still yields the
+    original per-sample dicts for callers that need them.
+    """
+
+    def __init__(self, codes, vocab):
+        self.codes = codes
+        self.vocab = vocab
+        self._length = len(next(iter(codes.values()))) if codes else 0
+
+    @classmethod
+    def from_records(cls, records, record_codes=None):
+        """Build from a list of metadata dicts, or from distinct dicts plus one record code per sample."""
+        records = list(records)
+        codes = {}
+        vocab = {}
+        for field in METADATA_FIELDS:
+            values = []
+            value_codes = {}
+            per_record = np.empty(len(records), dtype=np.int32)
+            for position, record in enumerate(records):
+                value = record.get(field) if isinstance(record, dict) else None
+                if value is None:
+                    per_record[position] = -1
+                    continue
+                if value not in value_codes:
+                    value_codes[value] = len(values)
+                    values.append(value)
+                per_record[position] = value_codes[value]
+            codes[field] = per_record if record_codes is None else per_record[np.asarray(record_codes, dtype=np.int64)]
+            vocab[field] = values
+        return cls(codes, vocab)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        return {
+            field: (self.vocab[field][code] if code >= 0 else None)
+            for field, code in ((field, int(self.codes[field][index])) for field in METADATA_FIELDS)
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def subset(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        return ColumnarMetadata({field: column[indices] for field, column in self.codes.items()}, self.vocab)
+
+    def normalized_column(self, field):
+        """(codes, values) with vocabulary entries lower-cased/stripped and merged; "" marks missing."""
+        merged_values = []
+        merged_codes = {}
+        remap = np.empty(len(self.vocab[field]) + 1, dtype=np.int32)
+        for code, value in enumerate(list(self.vocab[field]) + [None]):
+            normalized = str(value or "").strip().lower()
+            if normalized not in merged_codes:
+                merged_codes[normalized] = len(merged_values)
+                merged_values.append(normalized)
+            remap[code] = merged_codes[normalized]
+        # Code -1 indexes the trailing None slot.
+        return remap[self.codes[field]], merged_values
+
+
+def as_columnar(sample_metadata):
+    if isinstance(sample_metadata, ColumnarMetadata):
+        return sample_metadata
+    return ColumnarMetadata.from_records(sample_metadata or [])
+
+
+def encode_values(values):
+    """Category codes for a sequence of hashable values, plus the distinct values in first-seen order."""
+    lookup = {}
+    codes = np.fromiter((lookup.setdefault(value, len(lookup)) for value in values), dtype=np.int64, count=len(values))
+    return codes, list(lookup)
+
+
+def group_accuracy(correct, sample_metadata, *, keys=GROUP_ACCURACY_KEYS, min_samples=5, limit=40):
+    """Accuracy per metadata value, largest groups first, via bincount per field.
+
+    Ties keep the order in which groups are first met when scanning samples
+    and, within a sample, `keys`.
+    """
+    metadata = as_columnar(sample_metadata)
+    count = min(len(correct), len(metadata))
+    if count == 0:
+        return {}
+    correct = np.asarray(correct, dtype=bool)[:count]
+
+    groups = []
+    for key_position, key in enumerate(keys):
+        codes, values = metadata.normalized_column(key)
+        codes = codes[:count]
+        totals = np.bincount(codes, minlength=len(values))
+        hits = np.bincount(codes, weights=correct, minlength=len(values))
+        first_seen = np.full(len(values), count, dtype=np.int64)
+        np.minimum.at(first_seen, codes, np.arange(count))
+        for code, value in enumerate(values):
+            if not value or totals[code] < min_samples:
+                continue
+            groups.append((-int(totals[code]), int(first_seen[code]), key_position, key, value, float(hits[code])))
+
+    groups.sort()
+    return {
+        f"{key}:{value}": {"samples": -neg_total, "accuracy": round(hits / -neg_total, 4)}
+        for neg_total, _, _, key, value, hits in groups[:limit]
+    }
@@ -0,0 +1,366 @@
+import argparse
+import io
+import json
+import os
+import random
+import tarfile
+import time
+from collections import Counter
+
+from PIL import Image
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+try:
+    from dataset import get_transforms, get_uint8_transforms
+    from distributed import DistributedContext
+    from splits import DatasetSplit
+except ImportError:  # pragma: no cover - supports `python -m model.train`
+    from .dataset import get_transforms, get_uint8_transforms
+    from .distributed import DistributedContext
+    from .splits import DatasetSplit
+
+SHARD_FORMAT_VERSION = 1
+SHARD_INDEX_NAME = "shards.json"
+DEFAULT_SAMPLES_PER_SHARD = 2000
+DEFAULT_SHUFFLE_BUFFER = 2000
+
+
+def _add_member(archive, name, payload):
+    info = tarfile.TarInfo(name)
+    info.size = len(payload)
+    info.mtime = int(time.time())
+    archive.addfile(info, io.BytesIO(payload))
+
+
+def _sample_metadata(dataset, index):
+    metadata = getattr(dataset, "sample_metadata", None)
+    if metadata is None or not len(metadata):
+        return None
+    return {key: value for key, value in metadata[index].items() if value is not None}
+
+
+def pack_shards(dataset, indices, output_dir, *, split_name, split=None, samples_per_shard=DEFAULT_SAMPLES_PER_SHARD):
+    """Write `dataset.samples[indices]` into tar shards with one JSON record per image.
+
+    Each sample is stored as `<row>.json` (label, class name, source path and
+    index, manifest metadata) followed by `<row><ext>` holding the original
+    file bytes, so shards decode exactly like the source files. `shards.json`
+    lists the shards, their sample counts and the class layout.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    samples_per_shard = max(1, int(samples_per_shard))
+    shards = []
+    class_counts = Counter()
+    failures = []
+    archive = None
+    shard_samples = 0
+    row = 0
+
+    for index in indices:
+        path, label = dataset.samples[index]
+        try:
+            with open(path, "rb") as handle:
+                payload = handle.read()
+        except OSError as exc:
+            failures.append({"path": path, "error": str(exc)})
+            continue
+
+        if archive is None or shard_samples >= samples_per_shard:
+            if archive is not None:
+                archive.close()
+                shards[-1]["samples"] = shard_samples
+            name = f"shard-{len(shards):05d}.tar"
+            archive = tarfile.open(os.path.join(output_dir, name), mode="w")
+            shards.append({"name": name, "samples": 0})
+            shard_samples = 0
+
+        record = {
+            "row": row,
+            "label": int(label),
+            "class_name": dataset.class_names[label],
+            "path": path,
+            "index": int(index),
+            "metadata": _sample_metadata(dataset, index),
+        }
+        _add_member(archive, f"{row:09d}.json", json.dumps(record).encode("utf-8"))
+        _add_member(archive, f"{row:09d}{os.path.splitext(path)[1].lower() or '.img'}", payload)
+        class_counts[int(label)] += 1
+        shard_samples += 1
+        row += 1
+
+    if archive is not None:
+        archive.close()
+        shards[-1]["samples"] = shard_samples
+
+    index_payload = {
+        "version": SHARD_FORMAT_VERSION,
+        "split": split_name,
+        "samples": row,
+        "class_names": list(dataset.class_names),
+        "class_counts": [class_counts.get(label, 0) for label in range(len(dataset.class_names))],
+        "crop_type": getattr(dataset, "crop_type", "unknown"),
+        "source_dirs": list(getattr(dataset, "source_dirs", [])),
+        "shards": shards,
+        "failures": failures,
+    }
+    if split is not None:
+        index_payload.update({"split_hash": split.split_hash, "split_seed": split.seed, "split_path": split.path})
+    with open(os.path.join(output_dir, SHARD_INDEX_NAME), "w", encoding="utf-8") as handle:
+        json.dump(index_payload, handle, indent=2)
+    return index_payload
+
+
+def pack_dataset_splits(dataset, split, output_dir, *, samples_per_shard=DEFAULT_SAMPLES_PER_SHARD):
+    """Pack train/val/test of a persisted split into `<output_dir>/<split_name>/`."""
+    return {
+        name: pack_shards(
+            dataset,
+            getattr(split, name),
+            os.path.join(output_dir, name),
+            split_name=name,
+            split=split,
+            samples_per_shard=samples_per_shard,
+        )
+        for name in ("train", "val", "test")
+    }
+
+
+def _iter_shard(path):
+    """(record, image bytes) pairs from one shard, read front to back."""
+    record = None
+    with tarfile.open(path, mode="r|") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            payload = archive.extractfile(member).read()
+            if member.name.endswith(".json"):
+                record = json.loads(payload)
+            elif record is not None:
+                yield record, payload
+                record = None
+
+
+def read_shard_records(shard_dir):
+    """Per-sample JSON records of a shard directory, in packing (row) order, without decoding images."""
+    with open(os.path.join(shard_dir, SHARD_INDEX_NAME), "r", encoding="utf-8") as handle:
+        index = json.load(handle)
+    records = []
+    for shard in index["shards"]:
+        with tarfile.open(os.path.join(shard_dir, shard["name"]), mode="r:") as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(".json"):
+                    records.append(json.loads(archive.extractfile(member).read()))
+    return records
+
+
+class ShardedImageDataset(IterableDataset):
+    """Streams (image, label) samples from tar shards with sequential reads.
+
+    Each epoch the shard order is shuffled (seeded by `seed + epoch`), shards
+    are dealt to ranks and then to DataLoader workers, and samples pass
+    through a `shuffle_buffer`-sized buffer. With `even_ranks`, every worker
+    on every rank yields the same number of samples (wrapping over its own
+    shards if short), so DDP ranks take the same number of steps. With
+    `with_keys`, items are (image, label, row) where row is the packing order.
+    """
+
+    def __init__(
+        self,
+        shard_dir,
+        transform=None,
+        *,
+        shuffle=False,
+        shuffle_buffer=DEFAULT_SHUFFLE_BUFFER,
+        seed=0,
+        context=None,
+        even_ranks=False,
+        with_keys=False,
+        num_workers=0,
+    ):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, SHARD_INDEX_NAME), "r", encoding="utf-8") as handle:
+            index = json.load(handle)
+        if index.get("version") != SHARD_FORMAT_VERSION:
+            raise RuntimeError(f"Unsupported shard format in {shard_dir}: {index.get('version')}")
+
+        self.transform = transform
+        self.shuffle = shuffle
+        self.shuffle_buffer = max(1, int(shuffle_buffer)) if shuffle else 1
+        self.seed = int(seed)
+        self.context = context or DistributedContext()
+        self.even_ranks = even_ranks and self.context.enabled
+        self.with_keys = with_keys
+        self.num_workers = max(1, int(num_workers))
+        self.epoch = 0
+
+        self.shards = index["shards"]
+        self.class_names = list(index["class_names"])
+        self.class_to_idx = {name: idx for idx, name in enumerate(self.class_names)}
+        self.idx_to_class = {idx: name for name, idx in self.class_to_idx.items()}
+        self.class_counts = dict(enumerate(index["class_counts"]))
+        self.crop_type = index.get("crop_type", "unknown")
+        self.source_dirs = index.get("source_dirs", [])
+        self.total_samples = int(index["samples"])
+        self.split = None
+        if index.get("split_hash"):
+            self.split = DatasetSplit([], [], [], split_hash=index["split_hash"], seed=index.get("split_seed"),
+                                      path=index.get("split_path"))
+        if len(self.shards) < self.context.world_size:
+            raise RuntimeError(
+                f"{shard_dir} has {len(self.shards)} shards for {self.context.world_size} ranks; repack with smaller shards.")
+
+    def set_epoch(self, epoch):
+        self.epoch = int(epoch)
+
+    def _epoch_shards(self):
+        order = list(range(len(self.shards)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(order)
+        return order
+
+    def _rank_shards(self, order, rank):
+        return order[rank :: self.context.world_size]
+
+    def _even_quota(self, order, num_workers):
+        smallest = min(
+            sum(self.shards[shard]["samples"] for shard in self._rank_shards(order, rank))
+            for rank in range(self.context.world_size)
+        )
+        return smallest // num_workers
+
+    def __len__(self):
+        order = self._epoch_shards()
+        if self.even_ranks:
+            return self._even_quota(order, self.num_workers) * self.num_workers
+        return sum(self.shards[shard]["samples"] for shard in self._rank_shards(order, self.context.rank))
+
+    def _decode(self, record, payload):
+        try:
+            image = Image.open(io.BytesIO(payload)).convert("RGB")
+        except Exception as exc:  # noqa: BLE001
+            print(f"Error decoding {record.get('path')}: {exc}")
+            image = Image.new("RGB", (224, 224), (0, 0, 0))
+        if self.transform:
+            image = self.transform(image)
+        return image
+
+    def _iter_records(self, shard_ids, quota, rng):
+        produced = 0
+        while True:
+            for shard in shard_ids:
+                for record, payload in _iter_shard(os.path.join(self.shard_dir, self.shards[shard]["name"])):
+                    if quota is not None and produced >= quota:
+                        return
+                    yield record, payload
+                    produced += 1
+            if quota is None or produced >= quota or not shard_ids:
+                return
+            # Short worker under even_ranks: wrap over its own shards in a new order.
+            shard_ids = list(shard_ids)
+            rng.shuffle(shard_ids)
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        order = self._epoch_shards()
+        shard_ids = self._rank_shards(order, self.context.rank)[worker_id::num_workers]
+        quota = self._even_quota(order, num_workers) if self.even_ranks else None
+        if quota and not shard_ids:
+            raise RuntimeError(
+                f"DataLoader worker {worker_id} on rank {self.context.rank} has no shards; use fewer workers or smaller shards.")
+        rng = random.Random((self.seed + self.epoch) * 1000003 + self.context.rank * 1009 + worker_id)
+
+        records = self._iter_records(shard_ids, quota, rng)
+        if not self.shuffle:
+            for record, payload in records:
+                yield self._emit(record, payload)
+            return
+
+        buffer = []
+        for item in records:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(item)
+                continue
+            position = rng.randrange(len(buffer))
+            item, buffer[position] = buffer[position], item
+            yield self._emit(*item)
+        rng.shuffle(buffer)
+        for item in buffer:
+            yield self._emit(*item)
+
+    def unsharded(self):
+        """Unshuffled copy over every shard, for single-process evaluation."""
+        return ShardedImageDataset(self.shard_dir, self.transform, with_keys=self.with_keys)
+
+    def _emit(self, record, payload):
+        image = self._decode(record, payload)
+        if self.with_keys:
+            return image, record["label"], record["row"]
+        return image, record["label"]
+
+
+def get_shard_dataloaders(shards_dir, *, batch_size=32, num_workers=0, augment="pil", seed=0, context=None,
+                          shuffle_buffer=DEFAULT_SHUFFLE_BUFFER):
+    """Train/val/test loaders over `<shards_dir>/<split>/` written by `pack_dataset_splits`."""
+    if augment == "batch":
+        train_transform = eval_transform = get_uint8_transforms()
+    else:
+        train_transform, eval_transform = get_transforms(is_train=True), get_transforms(is_train=False)
+
+    train_data = ShardedImageDataset(
+        os.path.join(shards_dir, "train"), train_transform, shuffle=True, shuffle_buffer=shuffle_buffer,
+        seed=seed, context=context, even_ranks=True, num_workers=num_workers)
+    val_data = ShardedImageDataset(os.path.join(shards_dir, "val"), eval_transform, context=context)
+    test_dir = os.path.join(shards_dir, "test")
+    test_data = ShardedImageDataset(test_dir, eval_transform) if os.path.exists(
+        os.path.join(test_dir, SHARD_INDEX_NAME)) else None
+
+    train_loader = DataLoader(train_data, batch_size=batch_size, num_workers=num_workers)
+    val_loader = DataLoader(val_data, batch_size=batch_size, num_workers=num_workers)
+    test_loader = DataLoader(test_data, batch_size=batch_size, num_workers=num_workers) if test_data else None
+    return train_loader, val_loader, test_loader
+
+
+if __name__ == "__main__":
+    try:
+        from dataset import LeafDiseaseDataset, MultiCropLeafDiseaseDataset
+        from dataset_index import default_index_dir
+        from finetune_dataset import ManifestLeafDiseaseDataset
+        from manifest_compiler import default_manifest_cache_dir
+        from splits import load_or_create_split
+    except ImportError:  # pragma: no cover - supports `python -m model.shards`
+        from .dataset import LeafDiseaseDataset, MultiCropLeafDiseaseDataset
+        from .dataset_index import default_index_dir
+        from .finetune_dataset import ManifestLeafDiseaseDataset
+        from .manifest_compiler import default_manifest_cache_dir
+        from .splits import load_or_create_split
+
+    parser = argparse.ArgumentParser(description="Pack a dataset's train/val/test split into sequential tar shards")
+    parser.add_argument("--data_dir", type=str, default=None, help="Path to one dataset root (class folders inside)")
+    parser.add_argument("--data_dirs", type=str, default=None, help="Comma-separated dataset roots")
+    parser.add_argument("--manifest_path", type=str, default=None, help="CSV manifest path")
+    parser.add_argument("--manifest_images_root", type=str, default=None, help="Optional manifest images root")
+    parser.add_argument("--split_seed", type=int, default=42, help="Manifest split seed (folder datasets always use 42)")
+    parser.add_argument("--output", type=str, required=True, help="Output directory (train/, val/, test/ inside)")
+    parser.add_argument("--samples_per_shard", type=int, default=DEFAULT_SAMPLES_PER_SHARD, help="Samples per tar shard")
+    parser.add_argument("--clean_index", type=str, default=None, help="Clean index from model/integrity_scan.py")
+
+    args = parser.parse_args()
+    if args.manifest_path:
+        dataset = ManifestLeafDiseaseDataset(
+            args.manifest_path, images_root=args.manifest_images_root, clean_index=args.clean_index)
+        data_split = load_or_create_split(dataset.samples, split_dir=default_manifest_cache_dir(), seed=args.split_seed)
+    elif args.data_dirs or args.data_dir:
+        if args.data_dirs:
+            dataset = MultiCropLeafDiseaseDataset(
+                [item.strip() for item in args.data_dirs.split(",") if item.strip()], clean_index=args.clean_index)
+        else:
+            dataset = LeafDiseaseDataset(args.data_dir, clean_index=args.clean_index)
+        data_split = load_or_create_split(dataset.samples, split_dir=default_index_dir())
+    else:
+        parser.error("Provide --manifest_path, or --data_dir, or --data_dirs")
+
+    for name, result in pack_dataset_splits(dataset, data_split, args.output, samples_per_shard=args.samples_per_shard).items():
+        print(f"{name}: {result['samples']} samples in {len(result['shards'])} shards")
+        for failure in result["failures"]:
+            print(f"  failed: {failure['path']}: {failure['error']}")
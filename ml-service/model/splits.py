@@ -0,0 +1,196 @@
+import glob
+import hashlib
+import os
+import random
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+
+SPLIT_VERSION = 1
+SPLIT_NAMES = ("train", "val", "test")
+
+
+def _split_counts(total, train_ratio, val_ratio):
+    n_train = int(total * train_ratio)
+    n_val = int(total * val_ratio)
+    n_test = total - n_train - n_val
+
+    # Ensure non-empty val/test when the class has enough samples.
+    if total >= 3:
+        if n_val == 0:
+            n_val = 1
+            n_train = max(1, n_train - 1)
+        if n_test == 0:
+            n_test = 1
+            n_train = max(1, n_train - 1)
+    return n_train, n_val, n_test
+
+
+def build_stratified_splits(samples, train_ratio=0.7, val_ratio=0.15, seed=42):
+    by_label = defaultdict(list)
+    for index, (_, label) in enumerate(samples):
+        by_label[label].append(index)
+
+    rng = random.Random(seed)
+    train_indices = []
+    val_indices = []
+    test_indices = []
+
+    for _, indices in by_label.items():
+        rng.shuffle(indices)
+        n_train, n_val, n_test = _split_counts(len(indices), train_ratio, val_ratio)
+
+        train_indices.extend(indices[:n_train])
+        val_indices.extend(indices[n_train : n_train + n_val])
+        test_indices.extend(indices[n_train + n_val : n_train + n_val + n_test])
+
+    rng.shuffle(train_indices)
+    rng.shuffle(val_indices)
+    rng.shuffle(test_indices)
+    return train_indices, val_indices, test_indices
+
+
+def extend_stratified_splits(samples, kept_codes, train_ratio=0.7, val_ratio=0.15, seed=42):
+    """Stratified splits that keep every sample with `kept_codes[i] >= 0` in split `SPLIT_NAMES[code]`.
+
+    Only the other samples are placed: per label they top up test, then val,
+    towards the ratios of the new total, and the rest go to train. No sample
+    already assigned ever changes split.
+    """
+    by_label = defaultdict(list)
+    for index, (_, label) in enumerate(samples):
+        by_label[label].append(index)
+
+    rng = random.Random(seed)
+    splits = ([], [], [])
+    for indices in by_label.values():
+        targets = _split_counts(len(indices), train_ratio, val_ratio)
+        new = []
+        for index in indices:
+            if kept_codes[index] >= 0:
+                splits[kept_codes[index]].append(index)
+            else:
+                new.append(index)
+        counts = [sum(1 for index in indices if kept_codes[index] == code) for code in range(len(SPLIT_NAMES))]
+        rng.shuffle(new)
+        for code in (2, 1):
+            deficit = max(0, targets[code] - counts[code])
+            splits[code].extend(new[:deficit])
+            new = new[deficit:]
+        splits[0].extend(new)
+    return tuple(sorted(indices) for indices in splits)
+
+
+def sample_hashes(samples):
+    """64-bit hash of each (path, label) pair, as a uint64 array in sample order."""
+    digests = b"".join(
+        hashlib.blake2b(f"{path}\0{label}".encode("utf-8"), digest_size=8).digest() for path, label in samples
+    )
+    return np.frombuffer(digests, dtype="<u8").astype(np.uint64)
+
+
+def _split_hash(hashes, splits):
+    """Order-independent: the same samples in the same splits hash alike however they are listed."""
+    digest = hashlib.sha256(f"v{SPLIT_VERSION}".encode("utf-8"))
+    for name, indices in zip(SPLIT_NAMES, splits):
+        digest.update(name.encode("utf-8"))
+        digest.update(np.sort(hashes[np.asarray(indices, dtype=np.int64)]).tobytes())
+    return digest.hexdigest()
+
+
+def _remap_indices(stored_hashes, hashes):
+    """Position in `hashes` of each stored position, pairing equal hashes by occurrence."""
+    new_for_old = np.empty(len(stored_hashes), dtype=np.int64)
+    new_for_old[np.argsort(stored_hashes, kind="stable")] = np.argsort(hashes, kind="stable")
+    return new_for_old
+
+
+def _previous_assignment(split_dir, config, hashes):
+    """Split code of each sample in the stored split (same settings) sharing the most samples; -1 if new."""
+    best = None
+    for candidate in sorted(glob.glob(os.path.join(split_dir, "split-*.npz"))):
+        try:
+            with np.load(candidate) as payload:
+                if "config" not in payload.files or str(payload["config"]) != config:
+                    continue
+                stored_hashes = payload["sample_hashes"]
+                codes = np.full(len(stored_hashes), -1, dtype=np.int64)
+                for code, name in enumerate(SPLIT_NAMES):
+                    codes[payload[name]] = code
+        except (OSError, KeyError, ValueError, IndexError):
+            continue
+        overlap = int(np.isin(hashes, stored_hashes).sum())
+        if overlap and (best is None or overlap > best[0]):
+            best = (overlap, stored_hashes, codes)
+    if best is None:
+        return None
+
+    _, stored_hashes, codes = best
+    order = np.argsort(stored_hashes, kind="stable")
+    sorted_hashes = stored_hashes[order]
+    positions = np.minimum(np.searchsorted(sorted_hashes, hashes), len(sorted_hashes) - 1)
+    return np.where(sorted_hashes[positions] == hashes, codes[order][positions], -1)
+
+
+@dataclass
+class DatasetSplit:
+    train: list
+    val: list
+    test: list
+    split_hash: str
+    seed: int
+    path: str = None
+
+
+def load_or_create_split(samples, *, split_dir, seed=42, train_ratio=0.7, val_ratio=0.15):
+    """Stratified train/val/test indices for `samples`, materialized once per sample set.
+
+    The file is keyed by the set of (path, label) pairs, not their order, so a
+    dataset listed in a different order loads the same split (remapped to the
+    current order) instead of silently reshuffling samples across splits.
+    When samples are added or removed, the new split extends the stored split
+    that shares the most samples, so images that were held out for an earlier
+    model never move into train.
+    """
+    hashes = sample_hashes(samples)
+    set_digest = hashlib.sha256(np.sort(hashes).tobytes()).hexdigest()
+    config = f"v{SPLIT_VERSION}|{seed}|{train_ratio}|{val_ratio}"
+    key = hashlib.sha256(f"{config}|{set_digest}".encode("utf-8"))
+    path = os.path.join(split_dir, f"split-{key.hexdigest()[:24]}.npz")
+
+    if os.path.exists(path):
+        try:
+            with np.load(path) as payload:
+                stored_hashes = payload["sample_hashes"]
+                splits = [payload[name] for name in SPLIT_NAMES]
+                split_hash = str(payload["split_hash"])
+            if not np.array_equal(stored_hashes, hashes):
+                new_for_old = _remap_indices(stored_hashes, hashes)
+                splits = [new_for_old[indices] for indices in splits]
+            return DatasetSplit(*(indices.tolist() for indices in splits), split_hash=split_hash, seed=seed, path=path)
+        except (OSError, KeyError, ValueError) as exc:
+            print(f"Warning: ignoring unreadable split file {path}: {exc}")
+
+    kept_codes = _previous_assignment(split_dir, config, hashes) if os.path.isdir(split_dir) else None
+    if kept_codes is None:
+        splits = build_stratified_splits(samples, train_ratio=train_ratio, val_ratio=val_ratio, seed=seed)
+    else:
+        splits = extend_stratified_splits(
+            samples, kept_codes.tolist(), train_ratio=train_ratio, val_ratio=val_ratio, seed=seed)
+    split_hash = _split_hash(hashes, splits)
+    try:
+        os.makedirs(split_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            sample_hashes=hashes,
+            config=np.asarray(config),
+            split_hash=np.asarray(split_hash),
+            **{name: np.asarray(indices, dtype=np.int64) for name, indices in zip(SPLIT_NAMES, splits)},
+        )
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        print(f"Warning: could not persist split to {path}: {exc}")
+        path = None
+    return DatasetSplit(*splits, split_hash=split_hash, seed=seed, path=path)
@@ -0,0 +1,361 @@
+import csv
+import hashlib
+import os
+import random
+from collections import Counter, defaultdict
+
+from PIL import Image
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+try:
+    from dataset import get_transforms, get_uint8_transforms
+    from distributed import DistributedContext
+    from finetune_dataset import _label_sort_key, compute_metadata_sample_weights
+    from integrity_scan import load_excluded_paths
+    from manifest_compiler import _METADATA_COLUMNS, ManifestError, _build_metadata, manifest_signature, normalize_label
+    from splits import DatasetSplit
+except ImportError:  # pragma: no cover - supports `python -m model.train`
+    from .dataset import get_transforms, get_uint8_transforms
+    from .distributed import DistributedContext
+    from .finetune_dataset import _label_sort_key, compute_metadata_sample_weights
+    from .integrity_scan import load_excluded_paths
+    from .manifest_compiler import _METADATA_COLUMNS, ManifestError, _build_metadata, manifest_signature, normalize_label
+    from .splits import DatasetSplit
+
+STREAM_SPLIT_VERSION = 1
+STREAM_SPLITS = ("train", "val", "test")
+DEFAULT_RESERVOIR_SIZE = 256
+
+
+def stream_split_name(image_ref, *, seed=42, train_ratio=0.7, val_ratio=0.15):
+    """Split of one manifest row from a seeded hash of its image reference.
+
+    Needs no other row, so the assignment is stable however large the manifest
+    grows; per-label proportions match the ratios only approximately.
+    """
+    digest = hashlib.blake2b(f"{seed}\0{image_ref}".encode("utf-8"), digest_size=8).digest()
+    fraction = int.from_bytes(digest, "little") / 2.0**64
+    if fraction < train_ratio:
+        return "train"
+    if fraction < train_ratio + val_ratio:
+        return "val"
+    return "test"
+
+
+class StreamingManifestDataset(IterableDataset):
+    """Streams (image, label) samples for one split of a CSV manifest without holding its rows.
+
+    Construction makes one pass over the CSV to count labels and sampling
+    weight mass; memory scales with the number of distinct labels and
+    metadata combinations, not rows. Rows are dealt round-robin to
+    (DataLoader worker, rank) slots. With `shuffle`, each worker buffers up to
+    `reservoir_size` rows per label and emits from a label drawn by its share
+    of the weighted split (approximate stratification: labels can only be mixed
+    within the buffer window), and rows are accepted with
+    probability `weight / max_weight` under `sampling_profile` (rejection
+    sampling). Shuffled streams yield a fixed quota per worker, wrapping over
+    their rows if short, so every DDP rank takes the same number of steps.
+    """
+
+    def __init__(
+        self,
+        manifest_path,
+        transform=None,
+        *,
+        split="train",
+        class_names=None,
+        images_root=None,
+        split_seed=42,
+        train_ratio=0.7,
+        val_ratio=0.15,
+        sampling_profile=None,
+        shuffle=False,
+        stratify=True,
+        reservoir_size=DEFAULT_RESERVOIR_SIZE,
+        seed=0,
+        context=None,
+        with_keys=False,
+        num_workers=0,
+        skip_invalid_rows=False,
+        clean_index=None,
+    ):
+        if split not in STREAM_SPLITS:
+            raise ValueError(f"split must be one of {STREAM_SPLITS}, got {split!r}")
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"Manifest not found: {manifest_path}")
+
+        self.manifest_path = manifest_path
+        self.manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+        self.images_root = os.path.abspath(images_root) if images_root else None
+        self.transform = transform
+        self.split_name = split
+        self.split_seed = int(split_seed)
+        self.train_ratio = float(train_ratio)
+        self.val_ratio = float(val_ratio)
+        self.sampling_profile = sampling_profile
+        self.shuffle = shuffle
+        self.stratify = stratify
+        self.reservoir_size = max(1, int(reservoir_size))
+        self.seed = int(seed)
+        self.context = context or DistributedContext()
+        self.with_keys = with_keys
+        self.num_workers = max(1, int(num_workers))
+        self.skip_invalid_rows = skip_invalid_rows
+        self.clean_index = clean_index
+        self.excluded = load_excluded_paths(clean_index) if clean_index else set()
+        self.source_dirs = [f"manifest:{os.path.basename(manifest_path)}"]
+        self.epoch = 0
+        self._labels = {}
+        self._metadata = {}
+        self._weights = {}
+
+        self._count_rows(class_names)
+        signature = manifest_signature(manifest_path, images_root)
+        split_hash = hashlib.sha256(
+            f"stream-v{STREAM_SPLIT_VERSION}|{self.split_seed}|{self.train_ratio}|{self.val_ratio}|{signature}".encode(
+                "utf-8")).hexdigest()
+        self.split = DatasetSplit([], [], [], split_hash=split_hash, seed=self.split_seed)
+
+    def _read_rows(self):
+        with open(self.manifest_path, "r", encoding="utf-8-sig", newline="", buffering=1 << 20) as handle:
+            reader = csv.DictReader(handle)
+            if not reader.fieldnames:
+                raise RuntimeError(f"Manifest has no headers: {self.manifest_path}")
+            yield from enumerate(reader)
+
+    def _resolve(self, image_ref):
+        if os.path.isabs(image_ref):
+            return image_ref
+        if self.images_root:
+            candidate = os.path.join(self.images_root, image_ref)
+            if os.path.exists(candidate):
+                return candidate
+        return os.path.join(self.manifest_dir, image_ref)
+
+    def _parse(self, row):
+        """(image_ref, label, metadata_key) with label/metadata normalized once per distinct value."""
+        image_ref = str(row.get("image_path") or row.get("path") or row.get("image") or "").strip()
+        label_key = (row.get("label"), row.get("crop_type") or row.get("crop"), row.get("disease"))
+        if label_key not in self._labels:
+            self._labels[label_key] = normalize_label(label_key[0], crop_type=label_key[1], disease=label_key[2])
+        metadata_key = tuple(row.get(column) for column in _METADATA_COLUMNS)
+        return image_ref, self._labels[label_key], metadata_key
+
+    def _weight(self, metadata_key, label):
+        key = (metadata_key, label)
+        if key not in self._weights:
+            if metadata_key not in self._metadata:
+                self._metadata[metadata_key] = _build_metadata(dict(zip(_METADATA_COLUMNS, metadata_key)))
+            weights = None
+            if self.sampling_profile:
+                weights = compute_metadata_sample_weights(
+                    [self._metadata[metadata_key]], [label], self.sampling_profile)
+            self._weights[key] = float(weights[0]) if weights is not None else 1.0
+        return self._weights[key]
+
+    def _count_rows(self, class_names):
+        split_kwargs = {"seed": self.split_seed, "train_ratio": self.train_ratio, "val_ratio": self.val_ratio}
+        counts = Counter()
+        rank_counts = Counter()
+        weight_mass = defaultdict(float)
+        max_weight = 0.0
+        errors = []
+        for row_number, row in self._read_rows():
+            image_ref, label, metadata_key = self._parse(row)
+            if not image_ref:
+                errors.append((row_number + 2, "missing image_path/path/image"))
+                continue
+            if not label:
+                errors.append((row_number + 2, "label is empty. Provide label or crop_type+disease columns."))
+                continue
+            if stream_split_name(image_ref, **split_kwargs) != self.split_name:
+                continue
+            if self.excluded and os.path.abspath(self._resolve(image_ref)) in self.excluded:
+                continue
+            counts[label] += 1
+            if row_number % self.context.world_size == self.context.rank:
+                rank_counts[label] += 1
+            weight = self._weight(metadata_key, label)
+            weight_mass[label] += weight
+            max_weight = max(max_weight, weight)
+
+        if errors:
+            error = ManifestError(self.manifest_path, errors)
+            if not self.skip_invalid_rows:
+                raise error
+            print(f"Warning: skipping {error}")
+
+        if class_names:
+            self.class_names = [normalize_label(name) for name in class_names]
+        else:
+            self.class_names = sorted(counts.keys(), key=_label_sort_key)
+        if not self.class_names:
+            raise RuntimeError(f"No {self.split_name} samples in manifest: {self.manifest_path}")
+        self.class_to_idx = {name: idx for idx, name in enumerate(self.class_names)}
+        self.idx_to_class = {idx: name for name, idx in self.class_to_idx.items()}
+        prefixes = {name.split(":", 1)[0] for name in self.class_names if ":" in name}
+        self.crop_type = prefixes.pop() if len(prefixes) == 1 else ("mixed" if prefixes else "unknown")
+
+        self.class_counts = {idx: counts.get(name, 0) for idx, name in enumerate(self.class_names)}
+        self.total_samples = sum(self.class_counts.values())
+        self.rank_samples = sum(rank_counts.get(name, 0) for name in self.class_names)
+        self.max_weight = max_weight or 1.0
+        mass = [weight_mass.get(name, 0.0) for name in self.class_names]
+        total_mass = sum(mass) or 1.0
+        # Share of each label in the weighted stream, and the expected number of accepted rows.
+        self.label_shares = [value / total_mass for value in mass]
+        self.expected_samples = sum(mass) / self.max_weight if self.shuffle else self.total_samples
+
+    def set_epoch(self, epoch):
+        self.epoch = int(epoch)
+
+    def _quota(self, num_workers):
+        return int(self.expected_samples // (self.context.world_size * num_workers))
+
+    def __len__(self):
+        if self.shuffle:
+            return self._quota(self.num_workers) * self.num_workers
+        return self.rank_samples
+
+    def _iter_slot(self, slot, num_slots, rng):
+        """(row, path, label) for this slot's rows of the split, after rejection sampling when shuffled."""
+        split_kwargs = {"seed": self.split_seed, "train_ratio": self.train_ratio, "val_ratio": self.val_ratio}
+        for row_number, row in self._read_rows():
+            if row_number % num_slots != slot:
+                continue
+            image_ref, label, metadata_key = self._parse(row)
+            if not image_ref or label not in self.class_to_idx:
+                continue
+            if stream_split_name(image_ref, **split_kwargs) != self.split_name:
+                continue
+            if self.shuffle and rng.random() * self.max_weight >= self._weight(metadata_key, label):
+                continue
+            path = self._resolve(image_ref)
+            if self.excluded and os.path.abspath(path) in self.excluded:
+                continue
+            yield row_number, path, self.class_to_idx[label]
+
+    def _iter_quota(self, slot, num_slots, quota, rng):
+        produced = 0
+        while produced < quota:
+            before = produced
+            for item in self._iter_slot(slot, num_slots, rng):
+                yield item
+                produced += 1
+                if produced >= quota:
+                    return
+            if produced == before:
+                return
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        # Slot w * world_size + rank keeps every row of a rank on that rank whatever the worker count.
+        num_slots = num_workers * self.context.world_size
+        slot = worker_id * self.context.world_size + self.context.rank
+        rng = random.Random((self.seed + self.epoch) * 1000003 + self.context.rank * 1009 + worker_id)
+
+        if not self.shuffle:
+            for item in self._iter_slot(slot, num_slots, rng):
+                yield self._emit(*item)
+            return
+
+        quota = self._quota(num_workers)
+        if quota <= 0:
+            raise RuntimeError(
+                f"{self.split_name} split has too few rows for {num_slots} worker slots; use fewer workers.")
+        num_buckets = len(self.class_names) if self.stratify else 1
+        shares = self.label_shares if self.stratify else [1.0]
+        buffers = [[] for _ in range(num_buckets)]
+        buffered = 0
+        capacity = self.reservoir_size * num_buckets
+
+        def pop():
+            # A random buffered row of a label drawn by its share, among labels with rows buffered.
+            candidates = [bucket for bucket in range(num_buckets) if buffers[bucket]]
+            bucket = rng.choices(candidates, weights=[shares[bucket] or 1e-12 for bucket in candidates])[0]
+            items = buffers[bucket]
+            position = rng.randrange(len(items))
+            items[position], items[-1] = items[-1], items[position]
+            return items.pop()
+
+        for item in self._iter_quota(slot, num_slots, quota, rng):
+            buffers[item[2] if self.stratify else 0].append(item)
+            buffered += 1
+            if buffered >= capacity:
+                buffered -= 1
+                yield self._emit(*pop())
+        while buffered:
+            buffered -= 1
+            yield self._emit(*pop())
+
+    def _emit(self, row_number, path, label):
+        try:
+            image = Image.open(path).convert("RGB")
+        except Exception as exc:  # noqa: BLE001
+            # Same fallback as the map-style datasets, so one bad file cannot stop a long run.
+            print(f"Error loading image {path}: {exc}")
+            image = Image.new("RGB", (224, 224), (0, 0, 0))
+        if self.transform:
+            image = self.transform(image)
+        if self.with_keys:
+            return image, label, row_number
+        return image, label
+
+    def unsharded(self):
+        """Unshuffled copy of this split over all ranks, for single-process evaluation."""
+        return StreamingManifestDataset(
+            self.manifest_path,
+            self.transform,
+            split=self.split_name,
+            class_names=self.class_names,
+            images_root=self.images_root,
+            split_seed=self.split_seed,
+            train_ratio=self.train_ratio,
+            val_ratio=self.val_ratio,
+            with_keys=self.with_keys,
+            skip_invalid_rows=self.skip_invalid_rows,
+            clean_index=self.clean_index,
+        )
+
+
+def get_streaming_manifest_dataloaders(
+    manifest_path,
+    *,
+    batch_size=32,
+    num_workers=0,
+    class_names=None,
+    images_root=None,
+    split_seed=42,
+    sampling_profile=None,
+    reservoir_size=DEFAULT_RESERVOIR_SIZE,
+    augment="pil",
+    seed=0,
+    context=None,
+    skip_invalid_rows=False,
+    clean_index=None,
+):
+    """Train/val/test loaders that stream manifest rows; the train split is shuffled, stratified and reweighted."""
+    if augment == "batch":
+        train_transform = eval_transform = get_uint8_transforms()
+    else:
+        train_transform, eval_transform = get_transforms(is_train=True), get_transforms(is_train=False)
+
+    common = {
+        "images_root": images_root,
+        "split_seed": split_seed,
+        "skip_invalid_rows": skip_invalid_rows,
+        "clean_index": clean_index,
+    }
+    train_data = StreamingManifestDataset(
+        manifest_path, train_transform, split="train", class_names=class_names, sampling_profile=sampling_profile,
+        shuffle=True, reservoir_size=reservoir_size, seed=seed, context=context, num_workers=num_workers, **common)
+    val_data = StreamingManifestDataset(
+        manifest_path, eval_transform, split="val", class_names=train_data.class_names, context=context, **common)
+    test_data = StreamingManifestDataset(
+        manifest_path, eval_transform, split="test", class_names=train_data.class_names, **common)
+
+    train_loader = DataLoader(train_data, batch_size=batch_size, num_workers=num_workers)
+    val_loader = DataLoader(val_data, batch_size=batch_size, num_workers=num_workers)
+    test_loader = DataLoader(test_data, batch_size=batch_size, num_workers=num_workers)
+    return train_loader, val_loader, test_loader
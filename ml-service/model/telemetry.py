@@ -0,0 +1,130 @@
+import json
+import os
+import sys
+import time
+
+import torch
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+SECTIONS = ("data_wait", "preprocess", "forward", "backward", "optimizer")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of reaped children (DataLoader workers), in MB."""
+    if resource is None:
+        return None, None
+    scale = 1.0 / (1024 * 1024) if sys.platform == "darwin" else 1.0 / 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return round(own, 1), round(children, 1)
+
+
+def _children_cpu_seconds():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class PhaseTelemetry:
+    """Wall-clock breakdown of one epoch phase.
+
+    Call `mark(section)` at the end of each section of a step; the time since
+    the previous mark is charged to that section, so sections tile the phase.
+    On CUDA the compute sections measure dispatch time unless the caller syncs.
+    Worker utilization is DataLoader worker CPU time (reaped when the epoch's
+    workers exit) over `num_workers` x wall time.
+    """
+
+    def __init__(self, num_workers=0):
+        self.num_workers = int(num_workers)
+        self.seconds = dict.fromkeys(SECTIONS, 0.0)
+        self.steps = 0
+        self._start = time.perf_counter()
+        self._mark = self._start
+        self._children_cpu_start = _children_cpu_seconds()
+
+    def mark(self, section):
+        now = time.perf_counter()
+        self.seconds[section] += now - self._mark
+        self._mark = now
+
+    def summary(self, samples, **fields):
+        wall = max(time.perf_counter() - self._start, 1e-9)
+        worker_cpu = max(_children_cpu_seconds() - self._children_cpu_start, 0.0)
+        rss, worker_rss = peak_rss_mb()
+        record = dict(fields)
+        record.update(
+            {
+                "samples": int(samples),
+                "steps": self.steps,
+                "seconds": round(wall, 4),
+                "samples_per_sec": round(samples / wall, 2),
+                **{f"{name}_s": round(value, 4) for name, value in self.seconds.items()},
+                "data_wait_fraction": round(self.seconds["data_wait"] / wall, 4),
+                "peak_rss_mb": rss,
+                "peak_worker_rss_mb": worker_rss,
+                "num_workers": self.num_workers,
+                "worker_cpu_s": round(worker_cpu, 3),
+                "worker_utilization": round(worker_cpu / (self.num_workers * wall), 4) if self.num_workers else None,
+            }
+        )
+        return record
+
+
+class TelemetryLog:
+    def __init__(self, path):
+        self.path = path
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, record):
+        if not self.path:
+            return
+        with open(self.path, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(record) + "\n")
+
+
+def parse_step_window(value):
+    """'START:END' (global training steps, END exclusive) -> (start, end), or None."""
+    if not value:
+        return None
+    start, _, end = str(value).partition(":")
+    start, end = int(start), int(end)
+    if start < 0 or end <= start:
+        raise ValueError(f"Invalid profiler step window {value!r}; expected START:END with END > START >= 0")
+    return start, end
+
+
+class StepProfiler:
+    """Runs torch.profiler over a window of global training steps and exports a Chrome trace."""
+
+    def __init__(self, window, output_path):
+        self.window = window
+        self.output_path = output_path
+        self._profiler = None
+
+    def step(self, global_step):
+        if self.window is None:
+            return
+        start, end = self.window
+        if global_step == start and self._profiler is None:
+            self._profiler = torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True, profile_memory=True)
+            self._profiler.__enter__()
+        elif global_step == end and self._profiler is not None:
+            self.stop()
+
+    def stop(self):
+        if self._profiler is None:
+            return
+        self._profiler.__exit__(None, None, None)
+        self._profiler.export_chrome_trace(self.output_path)
+        print(self._profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=15))
+        print(f"Profiler trace written to {self.output_path}")
+        self._profiler = None
+        self.window = None
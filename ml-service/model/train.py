@@ -1,31 +1,83 @@
 import argparse
-import copy
+import contextlib
 import json
 import os
 import time
-from collections import Counter, defaultdict
+from collections import Counter
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, WeightedRandomSampler
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, IterableDataset, WeightedRandomSampler
 
 try:
+    from batch_augment import AUGMENT_MODES, BatchAugmenter
+    from calibration import compute_calibration, save_validation_logits, validation_arrays
+    from checkpointing import (
+        CHECKPOINT_VERSION,
+        LAST_CHECKPOINT_NAME,
+        AsyncCheckpointWriter,
+        capture_rng_state,
+        cpu_snapshot,
+        load_training_checkpoint,
+        resolve_resume_path,
+        restore_rng_state,
+    )
     from dataset import get_dataloaders
+    from distributed import (
+        DistributedWeightedSampler,
+        ShardSampler,
+        all_reduce_sums,
+        init_distributed,
+        shutdown_distributed,
+    )
+    from feature_cache import backbone_signature, cached_split_features, iterate_feature_batches
     from finetune_dataset import (
         compute_metadata_sample_weights,
         get_manifest_dataloaders,
         load_sampling_profile,
     )
     from model import get_model
+    from shards import ShardedImageDataset, get_shard_dataloaders
+    from streaming_manifest import DEFAULT_RESERVOIR_SIZE, get_streaming_manifest_dataloaders
+    from telemetry import PhaseTelemetry, StepProfiler, TelemetryLog, parse_step_window
 except ImportError:  # pragma: no cover - supports `python -m model.train`
+    from .batch_augment import AUGMENT_MODES, BatchAugmenter
+    from .calibration import compute_calibration, save_validation_logits, validation_arrays
+    from .checkpointing import (
+        CHECKPOINT_VERSION,
+        LAST_CHECKPOINT_NAME,
+        AsyncCheckpointWriter,
+        capture_rng_state,
+        cpu_snapshot,
+        load_training_checkpoint,
+        resolve_resume_path,
+        restore_rng_state,
+    )
     from .dataset import get_dataloaders
+    from .distributed import (
+        DistributedWeightedSampler,
+        ShardSampler,
+        all_reduce_sums,
+        init_distributed,
+        shutdown_distributed,
+    )
+    from .feature_cache import backbone_signature, cached_split_features, iterate_feature_batches
     from .finetune_dataset import (
         compute_metadata_sample_weights,
         get_manifest_dataloaders,
         load_sampling_profile,
     )
     from .model import get_model
+    from .shards import ShardedImageDataset, get_shard_dataloaders
+    from .streaming_manifest import DEFAULT_RESERVOIR_SIZE, get_streaming_manifest_dataloaders
+    from .telemetry import PhaseTelemetry, StepProfiler, TelemetryLog, parse_step_window
+
+
+PRECISIONS = ("fp32", "bf16")
+VALIDATION_LOGITS_NAME = "val_logits.npz"
 
 
 def _parse_class_names_arg(raw_value):
@@ -51,161 +103,147 @@ def _prefixed_labels(class_names, crop_type):
     return list(class_names)
 
 
-def _clamp(value, min_value, max_value):
-    return max(min_value, min(max_value, value))
-
-
-def _quantile(values, q):
-    if not values:
-        return 0.0
-    sorted_values = sorted(float(v) for v in values)
-    if len(sorted_values) == 1:
-        return sorted_values[0]
-    position = _clamp(q, 0.0, 1.0) * (len(sorted_values) - 1)
-    low = int(position)
-    high = min(low + 1, len(sorted_values) - 1)
-    if low == high:
-        return sorted_values[low]
-    ratio = position - low
-    return sorted_values[low] * (1 - ratio) + sorted_values[high] * ratio
-
-
-def _crop_from_label(label):
-    if ":" in str(label):
-        crop_name = str(label).split(":", 1)[0].strip().lower()
-        if crop_name in {"bean", "beans"}:
-            return "bean"
-        if crop_name == "maize":
-            return "maize"
-    return "unknown"
-
-
-def _collect_validation_records(model, dataloader, device):
+def _collect_validation_logits(model, dataloader, device, input_transform=None):
+    """Whole-split `(logits, labels)` as CPU float32/int64 tensors, concatenated once."""
     model.eval()
-    records = []
+    outputs = []
+    targets = []
     with torch.no_grad():
         for inputs, labels in dataloader:
             inputs = inputs.to(device)
-            labels = labels.to(device)
+            if input_transform is not None:
+                inputs = input_transform(inputs)
+            outputs.append(model(inputs).float().cpu())
+            targets.append(labels.cpu())
+    if not outputs:
+        return torch.empty((0, 0)), torch.empty(0, dtype=torch.long)
+    return torch.cat(outputs), torch.cat(targets).long()
 
-            outputs = model(inputs)
-            probabilities = torch.softmax(outputs, dim=1)
-            top_k = min(2, probabilities.shape[1])
-            top_values, top_indices = torch.topk(probabilities, k=top_k, dim=1)
 
-            for row_index in range(labels.shape[0]):
-                confidence = float(top_values[row_index, 0].item())
-                pred_idx = int(top_indices[row_index, 0].item())
-                true_idx = int(labels[row_index].item())
+def _autocast_context(device, precision):
+    if precision == "bf16":
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
 
-                second_conf = float(top_values[row_index, 1].item()) if top_k > 1 else 0.0
-                margin = confidence - second_conf
-                records.append(
-                    {
-                        "pred_idx": pred_idx,
-                        "true_idx": true_idx,
-                        "confidence": confidence,
-                        "margin": margin,
-                        "correct": pred_idx == true_idx,
-                    }
-                )
-    return records
-
-
-def _compute_group_accuracy(records, sample_metadata, *, min_samples=5):
-    if not records or not sample_metadata:
-        return {}
-
-    keys = ["province", "district", "season", "rainfall_band"]
-    stats = defaultdict(lambda: {"correct": 0, "total": 0})
-
-    for index, record in enumerate(records):
-        metadata = sample_metadata[index] if index < len(sample_metadata) else {}
-        if not isinstance(metadata, dict):
-            continue
-
-        for key in keys:
-            value = str(metadata.get(key) or "").strip().lower()
-            if not value:
-                continue
-            entry = stats[(key, value)]
-            entry["total"] += 1
-            if record["correct"]:
-                entry["correct"] += 1
-
-    rows = []
-    for (key, value), item in stats.items():
-        if item["total"] < min_samples:
-            continue
-        rows.append(
-            (
-                f"{key}:{value}",
-                {
-                    "samples": int(item["total"]),
-                    "accuracy": round(item["correct"] / item["total"], 4),
-                },
-            )
-        )
 
-    rows.sort(key=lambda row: row[1]["samples"], reverse=True)
-    return dict(rows[:40])
+def _checkpoint_state(model):
+    """fp32, contiguous copy of the weights, loadable regardless of --precision/--channels_last."""
+    return {
+        key: value.detach().to(torch.float32 if value.is_floating_point() else value.dtype).contiguous().clone()
+        for key, value in model.state_dict().items()
+    }
 
 
-def _compute_calibration(
-    records,
-    class_names,
-    sample_metadata,
+def _load_init_checkpoint(model, checkpoint_path):
+    """Start from an existing checkpoint's backbone; its head is reused only if the class count matches."""
+    state = torch.load(checkpoint_path, map_location="cpu")
+    if isinstance(state, dict) and isinstance(state.get("state_dict"), dict):
+        state = state["state_dict"]
+    state = {str(key).replace("module.", "", 1): value for key, value in state.items()}
+    head_shape = model.classifier[1].weight.shape
+    if state.get("classifier.1.weight") is not None and state["classifier.1.weight"].shape != head_shape:
+        state = {key: value for key, value in state.items() if not key.startswith("classifier.")}
+        print("Initial checkpoint has a different class count; training a fresh classifier head.")
+    model.load_state_dict(state, strict=False)
+    print(f"Initialized weights from {checkpoint_path}")
+
+
+def _train_head_on_features(
+    model,
+    train_loader,
+    val_loader,
     *,
-    default_threshold=0.65,
-    min_threshold=0.5,
-    max_threshold=0.92,
-    margin_floor=0.08,
+    device,
+    criterion,
+    num_epochs,
+    batch_size,
+    learning_rate,
+    sample_weights=None,
+    feature_cache_dir=None,
+    feature_views=1,
+    seed=0,
+    num_workers=0,
+    forward_context=None,
+    memory_format=torch.contiguous_format,
 ):
-    confidence_by_label = defaultdict(list)
-    confidence_by_crop = defaultdict(list)
-    correct_margins = []
-
-    for record in records:
-        true_label = class_names[record["true_idx"]]
-        if record["correct"]:
-            confidence_by_label[true_label].append(record["confidence"])
-            crop_name = _crop_from_label(true_label)
-            if crop_name in {"bean", "maize"}:
-                confidence_by_crop[crop_name].append(record["confidence"])
-            correct_margins.append(record["margin"])
-
-    threshold_by_label = {}
-    for label in class_names:
-        values = confidence_by_label.get(label, [])
-        if len(values) >= 3:
-            threshold = _quantile(values, 0.2)
-        else:
-            threshold = default_threshold
-        threshold_by_label[label] = round(_clamp(threshold, min_threshold, max_threshold), 4)
-
-    threshold_by_crop = {}
-    for crop_name in ["bean", "maize"]:
-        values = confidence_by_crop.get(crop_name, [])
-        if len(values) >= 5:
-            threshold = _quantile(values, 0.2)
-        else:
-            threshold = default_threshold
-        threshold_by_crop[crop_name] = round(_clamp(threshold, min_threshold, max_threshold), 4)
+    """Train only `model.classifier` on cached pooled features of the frozen backbone.
+
+    Returns `(best_state, best_acc, (val_logits, val_labels))` where the logits
+    come from the cached validation features of the best head.
+    """
+    for param in model.features.parameters():
+        param.requires_grad = False
+
+    backbone_hash = backbone_signature(model)
+    print(f"Frozen backbone {backbone_hash[:12]}; caching pooled features ({feature_views} train view(s)).")
+    cache_options = {
+        "device": device,
+        "cache_dir": feature_cache_dir,
+        "seed": seed,
+        "batch_size": batch_size,
+        "num_workers": num_workers,
+        "forward_context": forward_context,
+        "memory_format": memory_format,
+        "backbone_hash": backbone_hash,
+    }
+    train_features, train_labels = cached_split_features(
+        model, train_loader.dataset.subset, split_name="train", views=feature_views, **cache_options)
+    val_features, val_labels = cached_split_features(
+        model, val_loader.dataset.subset, split_name="val", views=1, **cache_options)
+
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    row_weights = None
+    if sample_weights is not None:
+        row_weights = torch.as_tensor(sample_weights, dtype=torch.float64).repeat(feature_views)
+
+    head = model.classifier.to(device)
+    optimizer = optim.Adam(head.parameters(), lr=learning_rate)
+    best_state = {key: value.detach().clone() for key, value in head.state_dict().items()}
+    best_acc = -1.0
 
-    if len(correct_margins) >= 5:
-        margin_threshold = _quantile(correct_margins, 0.1)
-    else:
-        margin_threshold = margin_floor
-    margin_threshold = round(_clamp(margin_threshold, margin_floor, 0.6), 4)
+    for epoch in range(num_epochs):
+        phase_start = time.perf_counter()
+        if row_weights is not None:
+            order = torch.multinomial(row_weights, len(row_weights), replacement=True, generator=generator).numpy()
+        else:
+            order = torch.randperm(len(train_labels), generator=generator).numpy()
+
+        head.train()
+        running_loss = 0.0
+        running_corrects = 0
+        for inputs, labels in iterate_feature_batches(train_features, train_labels, order, batch_size):
+            inputs, labels = inputs.to(device), labels.to(device)
+            optimizer.zero_grad()
+            outputs = head(inputs)
+            loss = criterion(outputs, labels)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item() * inputs.size(0)
+            running_corrects += int((outputs.argmax(1) == labels).sum())
+
+        head.eval()
+        with torch.no_grad():
+            val_outputs = head(torch.from_numpy(np.ascontiguousarray(val_features)).to(device))
+            val_targets = torch.from_numpy(val_labels).to(device)
+            val_loss = float(criterion(val_outputs, val_targets))
+            val_acc = float((val_outputs.argmax(1) == val_targets).double().mean()) if len(val_labels) else 0.0
+
+        elapsed = max(time.perf_counter() - phase_start, 1e-9)
+        print(
+            f"Epoch {epoch + 1}/{num_epochs} head train Loss: {running_loss / max(len(order), 1):.4f} "
+            f"Acc: {running_corrects / max(len(order), 1):.4f} | val Loss: {val_loss:.4f} Acc: {val_acc:.4f} "
+            f"({len(order) / elapsed:.1f} samples/sec)"
+        )
+        if val_acc > best_acc:
+            best_acc = val_acc
+            best_state = {key: value.detach().clone() for key, value in head.state_dict().items()}
 
-    return {
-        "default_confidence_threshold": round(default_threshold, 4),
-        "confidence_threshold_by_label": threshold_by_label,
-        "confidence_threshold_by_crop": threshold_by_crop,
-        "margin_threshold": margin_threshold,
-        "group_accuracy": _compute_group_accuracy(records, sample_metadata),
-        "generated_at_epoch_time": int(time.time()),
-    }
+    head.load_state_dict(best_state)
+    head.eval()
+    with torch.no_grad():
+        val_outputs = head(torch.from_numpy(np.ascontiguousarray(val_features)).to(device))
+    return _checkpoint_state(model), best_acc, (val_outputs.float().cpu(), torch.from_numpy(val_labels))
 
 
 def _write_labels_metadata(
@@ -220,9 +258,12 @@ def _write_labels_metadata(
     model_version,
     manifest_path=None,
     manifest_images_root=None,
+    shards_dir=None,
+    clean_index=None,
     calibration=None,
     sampling_profile=None,
     split_seed=42,
+    split=None,
 ):
     model_stem, _ = os.path.splitext(model_file_name)
     metadata_path = os.path.join(output_dir, f"{model_stem}.labels.json")
@@ -234,14 +275,23 @@ def _write_labels_metadata(
         "best_val_accuracy": float(best_val_acc),
         "saved_at_epoch_time": int(time.time()),
         "model_version": str(model_version),
-        "split_seed": int(split_seed),
+        "split_seed": int(split.seed if split is not None else split_seed),
     }
+    if split is not None:
+        payload["split_hash"] = split.split_hash
+        if split.path:
+            payload["split_path"] = os.path.abspath(split.path)
 
     if manifest_path:
         payload["manifest_path"] = os.path.abspath(manifest_path)
     if manifest_images_root:
         payload["manifest_images_root"] = os.path.abspath(manifest_images_root)
 
+    if shards_dir:
+        payload["shards_dir"] = os.path.abspath(shards_dir)
+    if clean_index:
+        payload["clean_index"] = os.path.abspath(clean_index)
+
     if isinstance(data_dir, (list, tuple)):
         payload["data_dirs"] = [os.path.abspath(path) for path in data_dir]
     elif data_dir:
@@ -267,7 +317,41 @@ def _choose_dataloaders(
     manifest_path,
     manifest_images_root,
     split_seed,
+    image_cache=None,
+    skip_invalid_rows=False,
+    augment="pil",
+    shards_dir=None,
+    context=None,
+    clean_index=None,
+    stream_manifest=False,
+    sampling_profile=None,
+    reservoir_size=DEFAULT_RESERVOIR_SIZE,
 ):
+    if shards_dir:
+        return get_shard_dataloaders(
+            shards_dir,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            augment=augment,
+            seed=split_seed,
+            context=context,
+        )
+    if manifest_path and stream_manifest:
+        return get_streaming_manifest_dataloaders(
+            manifest_path,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            class_names=class_names,
+            images_root=manifest_images_root,
+            split_seed=split_seed,
+            sampling_profile=sampling_profile,
+            reservoir_size=reservoir_size,
+            augment=augment,
+            seed=split_seed,
+            context=context,
+            skip_invalid_rows=skip_invalid_rows,
+            clean_index=clean_index,
+        )
     if manifest_path:
         return get_manifest_dataloaders(
             manifest_path=manifest_path,
@@ -276,6 +360,10 @@ def _choose_dataloaders(
             class_names=class_names,
             images_root=manifest_images_root,
             split_seed=split_seed,
+            image_cache=image_cache,
+            skip_invalid_rows=skip_invalid_rows,
+            augment=augment,
+            clean_index=clean_index,
         )
     return get_dataloaders(
         data_dir=data_dir,
@@ -283,13 +371,16 @@ def _choose_dataloaders(
         num_workers=num_workers,
         class_names=class_names,
         data_dirs=data_dirs,
+        image_cache=image_cache,
+        augment=augment,
+        clean_index=clean_index,
     )
 
 
 def _build_weighted_sampler(train_loader, class_names, sampling_profile):
     train_dataset = train_loader.dataset
-    sample_metadata = list(getattr(train_dataset, "sample_metadata", []))
-    if not sample_metadata:
+    sample_metadata = getattr(train_dataset, "sample_metadata", [])
+    if not len(sample_metadata):
         return None
 
     full_dataset = train_loader.dataset.subset.dataset
@@ -298,13 +389,13 @@ def _build_weighted_sampler(train_loader, class_names, sampling_profile):
     label_names = [class_names[label_idx] for label_idx in label_indices]
 
     sample_weights = compute_metadata_sample_weights(sample_metadata, label_names, sampling_profile)
-    if not sample_weights:
+    if sample_weights is None or not len(sample_weights):
         return None
 
-    if not any(abs(float(weight) - 1.0) > 1e-6 for weight in sample_weights):
+    if not np.any(np.abs(sample_weights - 1.0) > 1e-6):
         return None
 
-    tensor_weights = torch.DoubleTensor(sample_weights)
+    tensor_weights = torch.from_numpy(np.ascontiguousarray(sample_weights, dtype=np.float64))
     return WeightedRandomSampler(tensor_weights, num_samples=len(sample_weights), replacement=True)
 
 
@@ -325,10 +416,44 @@ def train_model(
     calibration_min_threshold=0.5,
     calibration_max_threshold=0.92,
     calibration_margin_floor=0.08,
+    image_cache=None,
+    skip_invalid_rows=False,
+    augment="pil",
+    augment_seed=0,
+    precision="fp32",
+    channels_last=False,
+    freeze_backbone=False,
+    feature_views=1,
+    feature_cache_dir=None,
+    init_checkpoint=None,
+    resume=None,
+    checkpoint_every=1,
+    telemetry_path=None,
+    profile_steps=None,
+    shards_dir=None,
+    clean_index=None,
+    stream_manifest=False,
+    reservoir_size=DEFAULT_RESERVOIR_SIZE,
 ):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+    context = init_distributed()
+    if context.enabled and freeze_backbone:
+        raise RuntimeError("--freeze_backbone trains on cached features in one process; launch it without torchrun.")
+    if shards_dir and freeze_backbone:
+        raise RuntimeError("--freeze_backbone caches features per dataset sample; use it without --shards_dir.")
+    if stream_manifest and freeze_backbone:
+        raise RuntimeError("--freeze_backbone caches features per dataset sample; use it without --stream_manifest.")
+    # Distributed mode targets multi-core CPU nodes (gloo backend).
+    device = torch.device("cpu" if context.enabled or not torch.cuda.is_available() else "cuda")
     print(f"Using device: {device}")
+    if context.enabled:
+        print(
+            f"Distributed training: rank {context.rank}/{context.world_size}, "
+            f"{torch.get_num_threads()} intra-op threads per process"
+        )
 
+    sampling_profile = load_sampling_profile(sampling_profile_path)
     train_loader, val_loader, _ = _choose_dataloaders(
         data_dir=data_dir,
         batch_size=batch_size,
@@ -338,9 +463,19 @@ def train_model(
         manifest_path=manifest_path,
         manifest_images_root=manifest_images_root,
         split_seed=split_seed,
+        image_cache=image_cache,
+        skip_invalid_rows=skip_invalid_rows,
+        augment=augment,
+        shards_dir=shards_dir,
+        context=context,
+        clean_index=clean_index,
+        stream_manifest=stream_manifest,
+        sampling_profile=sampling_profile,
+        reservoir_size=reservoir_size,
     )
 
     train_dataset = train_loader.dataset
+    streaming = isinstance(train_dataset, IterableDataset)
     detected_class_names = list(getattr(train_dataset, "class_names", []))
     if not detected_class_names:
         raise RuntimeError("Could not read class names from the training dataset.")
@@ -354,11 +489,13 @@ def train_model(
     if source_dirs:
         print(f"Source directories: {source_dirs}")
 
-    full_dataset = train_loader.dataset.subset.dataset
-    indices = train_loader.dataset.subset.indices
-    all_labels = [full_dataset.samples[i][1] for i in indices]
-    class_counts = Counter(all_labels)
-    total_samples = len(all_labels)
+    if streaming:
+        class_counts = Counter(train_dataset.class_counts)
+    else:
+        full_dataset = train_loader.dataset.subset.dataset
+        indices = train_loader.dataset.subset.indices
+        class_counts = Counter(full_dataset.samples[i][1] for i in indices)
+    total_samples = sum(class_counts.values())
 
     readable_distribution = {
         detected_class_names[idx]: int(class_counts.get(idx, 0)) for idx in range(num_classes)
@@ -377,9 +514,12 @@ def train_model(
     class_weights = torch.FloatTensor(weights).to(device)
     print(f"Class weights: {weights}")
 
-    sampling_profile = load_sampling_profile(sampling_profile_path)
-    sampler = _build_weighted_sampler(train_loader, detected_class_names, sampling_profile)
-    if sampler is not None:
+    sampler = None if streaming else _build_weighted_sampler(train_loader, detected_class_names, sampling_profile)
+    if isinstance(train_dataset, ShardedImageDataset):
+        print("Streaming training shards with shard-level shuffling (metadata-weighted sampling does not apply).")
+    elif streaming:
+        print("Streaming manifest rows with per-label reservoirs and metadata rejection sampling.")
+    elif sampler is not None:
         print("Using metadata-weighted sampling for training split.")
         train_loader = DataLoader(
             train_loader.dataset,
@@ -390,64 +530,226 @@ def train_model(
     else:
         print("Using standard shuffled sampling for training split.")
 
-    model = get_model(num_classes=num_classes).to(device)
+    if context.enabled and not streaming:
+        # Every rank takes a disjoint slice of the same seeded (weighted) draw,
+        # and evaluates a disjoint shard of the validation split.
+        train_loader = DataLoader(
+            train_loader.dataset,
+            batch_size=batch_size,
+            sampler=DistributedWeightedSampler(
+                len(train_loader.dataset),
+                context,
+                weights=sampler.weights if sampler is not None else None,
+                seed=split_seed,
+            ),
+            num_workers=num_workers,
+        )
+        val_loader = DataLoader(
+            val_loader.dataset,
+            batch_size=batch_size,
+            sampler=ShardSampler(len(val_loader.dataset), context),
+            num_workers=num_workers,
+        )
+
+    model = get_model(num_classes=num_classes)
+    if init_checkpoint:
+        _load_init_checkpoint(model, init_checkpoint)
+    model = model.to(device)
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    if channels_last:
+        model = model.to(memory_format=memory_format)
+    print(f"Precision: {precision}, memory format: {'channels_last' if channels_last else 'contiguous'}")
     criterion = nn.CrossEntropyLoss(weight=class_weights)
     optimizer = optim.Adam(model.parameters(), lr=learning_rate)
+    batch_augmenter = None
+    if augment == "batch" and not freeze_backbone:
+        batch_augmenter = BatchAugmenter(seed=augment_seed + context.rank)
+        print(f"Using batched tensor augmentation (seed {augment_seed}).")
 
-    best_model_wts = copy.deepcopy(model.state_dict())
+    best_model_wts = _checkpoint_state(model)
     best_acc = -1.0
     best_model_path = os.path.join(output_dir, "best_model.pth")
+    last_checkpoint_path = os.path.join(output_dir, LAST_CHECKPOINT_NAME)
+    val_outputs = None
+    start_epoch = 0
+
+    resume_path = None if freeze_backbone else resolve_resume_path(resume, output_dir)
+    if resume_path:
+        checkpoint = load_training_checkpoint(resume_path)
+        if checkpoint["class_names"] != detected_class_names:
+            raise RuntimeError(
+                f"Checkpoint classes {checkpoint['class_names']} do not match dataset classes {detected_class_names}")
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        best_model_wts = checkpoint["best_model"]
+        best_acc = checkpoint["best_acc"]
+        start_epoch = int(checkpoint["epoch"])
+        restore_rng_state(checkpoint["rng"])
+        if batch_augmenter is not None:
+            if context.enabled:
+                # Only rank 0's generator is saved; other ranks move to a fresh, deterministic stream.
+                batch_augmenter = BatchAugmenter(seed=augment_seed + context.rank + start_epoch * context.world_size)
+            elif checkpoint.get("batch_augmenter"):
+                batch_augmenter.load_state_dict(checkpoint["batch_augmenter"])
+        print(f"Resumed from {resume_path} after epoch {start_epoch} (best val Acc {best_acc:.4f})")
+
+    train_module = DistributedDataParallel(model) if context.enabled else model
+    writer = AsyncCheckpointWriter() if context.is_main else None
+    telemetry = TelemetryLog(
+        (telemetry_path or os.path.join(output_dir, "telemetry.jsonl")) if context.is_main else None)
+    profiler = StepProfiler(
+        parse_step_window(profile_steps),
+        os.path.join(output_dir, f"profile_trace_rank{context.rank}.json"),
+    )
+    global_step = start_epoch * len(train_loader)
+
+    if freeze_backbone:
+        best_model_wts, best_acc, val_outputs = _train_head_on_features(
+            model,
+            train_loader,
+            val_loader,
+            device=device,
+            criterion=criterion,
+            num_epochs=num_epochs,
+            batch_size=batch_size,
+            learning_rate=learning_rate,
+            sample_weights=sampler.weights if sampler is not None else None,
+            feature_cache_dir=feature_cache_dir,
+            feature_views=max(1, int(feature_views)),
+            seed=augment_seed,
+            num_workers=num_workers,
+            forward_context=lambda: _autocast_context(device, precision),
+            memory_format=memory_format,
+        )
 
-    for epoch in range(num_epochs):
-        print(f"Epoch {epoch + 1}/{num_epochs}")
-        print("-" * 10)
+    # With a frozen backbone the head has already been trained on cached features.
+    for epoch in range(num_epochs if freeze_backbone else start_epoch, num_epochs):
+        if context.is_main:
+            print(f"Epoch {epoch + 1}/{num_epochs}")
+            print("-" * 10)
+        if hasattr(train_loader.sampler, "set_epoch"):
+            train_loader.sampler.set_epoch(epoch)
+        if streaming:
+            train_dataset.set_epoch(epoch)
 
         for phase in ["train", "val"]:
             if phase == "train":
                 model.train()
                 dataloader = train_loader
+                forward_module = train_module
             else:
                 model.eval()
                 dataloader = val_loader
+                # Evaluation needs no gradient sync, so ranks may run uneven shards.
+                forward_module = model
 
-            running_loss = 0.0
-            running_corrects = 0
+            # Metrics accumulate on the device; the only host sync is once per phase.
+            running_loss = torch.zeros((), dtype=torch.float64, device=device)
+            running_corrects = torch.zeros((), dtype=torch.int64, device=device)
+            samples_seen = 0
+            timer = PhaseTelemetry(num_workers=num_workers)
 
             for inputs, labels in dataloader:
+                timer.mark("data_wait")
+                if phase == "train":
+                    profiler.step(global_step)
                 inputs = inputs.to(device)
                 labels = labels.to(device)
+                if batch_augmenter is not None:
+                    inputs = batch_augmenter(inputs) if phase == "train" else batch_augmenter.normalize(inputs)
+                if channels_last:
+                    inputs = inputs.contiguous(memory_format=memory_format)
                 optimizer.zero_grad()
+                timer.mark("preprocess")
 
                 with torch.set_grad_enabled(phase == "train"):
-                    outputs = model(inputs)
+                    with _autocast_context(device, precision):
+                        outputs = forward_module(inputs)
+                    # Loss and metrics stay in fp32 whatever the forward precision.
+                    outputs = outputs.float()
                     _, preds = torch.max(outputs, 1)
                     loss = criterion(outputs, labels)
+                    timer.mark("forward")
 
                     if phase == "train":
                         loss.backward()
+                        timer.mark("backward")
                         optimizer.step()
-
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
-
-            epoch_loss = running_loss / len(dataloader.dataset)
-            epoch_acc = running_corrects.double() / len(dataloader.dataset)
-            print(f"{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}")
+                        timer.mark("optimizer")
+                        global_step += 1
+
+                running_loss += loss.detach().double() * inputs.size(0)
+                running_corrects += (preds == labels).sum()
+                samples_seen += inputs.size(0)
+                timer.steps += 1
+
+            # Sums over all ranks, so every rank sees the same metrics and best-model decision.
+            loss_sum, correct_sum = torch.stack([running_loss, running_corrects.double()]).tolist()
+            running_loss, running_corrects, samples_seen = all_reduce_sums(
+                [loss_sum, correct_sum, samples_seen], context)
+            epoch_loss = running_loss / max(samples_seen, 1)
+            epoch_acc = running_corrects / max(samples_seen, 1)
+            phase_record = timer.summary(
+                samples_seen, epoch=epoch + 1, phase=phase, loss=round(epoch_loss, 6), acc=round(epoch_acc, 6),
+                world_size=context.world_size)
+            if context.is_main:
+                telemetry.write(phase_record)
+                print(
+                    f"{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f} "
+                    f"({phase_record['samples_per_sec']:.1f} samples/sec, "
+                    f"data wait {phase_record['data_wait_fraction']:.0%})"
+                )
 
             if phase == "val" and epoch_acc > best_acc:
                 best_acc = epoch_acc
-                best_model_wts = copy.deepcopy(model.state_dict())
-                torch.save(model.state_dict(), best_model_path)
-                print(f"New best model saved with Acc: {best_acc:.4f}")
+                best_model_wts = _checkpoint_state(model)
+                if context.is_main:
+                    writer.submit(cpu_snapshot(best_model_wts), best_model_path)
+                    print(f"New best model saved with Acc: {best_acc:.4f}")
+
+        if context.is_main and ((epoch + 1) % max(1, checkpoint_every) == 0 or epoch + 1 == num_epochs):
+            # Snapshot on this thread (cheap copies); serialization happens on the writer thread.
+            writer.submit(
+                cpu_snapshot(
+                    {
+                        "version": CHECKPOINT_VERSION,
+                        "epoch": epoch + 1,
+                        "class_names": detected_class_names,
+                        "model": _checkpoint_state(model),
+                        "optimizer": optimizer.state_dict(),
+                        "best_model": best_model_wts,
+                        "best_acc": best_acc,
+                        "rng": capture_rng_state(),
+                        "batch_augmenter": batch_augmenter.state_dict() if batch_augmenter is not None else None,
+                    }
+                ),
+                last_checkpoint_path,
+            )
 
-    print(f"Best val Acc: {best_acc:.4f}")
+    profiler.stop()
     model.load_state_dict(best_model_wts)
-    torch.save(model.state_dict(), best_model_path)
+    if not context.is_main:
+        context.barrier()
+        shutdown_distributed(context)
+        return model
 
-    calibration = _compute_calibration(
-        _collect_validation_records(model, val_loader, device),
+    print(f"Best val Acc: {best_acc:.4f}")
+    writer.submit(cpu_snapshot(best_model_wts), best_model_path)
+    writer.close()
+
+    if context.enabled:
+        val_dataset = val_loader.dataset
+        if streaming:
+            val_dataset = val_dataset.unsharded()
+        val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    if val_outputs is None:
+        val_outputs = _collect_validation_logits(
+            model, val_loader, device, input_transform=batch_augmenter.normalize if batch_augmenter else None)
+    save_validation_logits(os.path.join(output_dir, VALIDATION_LOGITS_NAME), *val_outputs)
+    calibration = compute_calibration(
+        validation_arrays(*val_outputs),
         detected_class_names,
-        list(getattr(val_loader.dataset, "sample_metadata", [])),
+        getattr(val_loader.dataset, "sample_metadata", []),
         default_threshold=calibration_default_threshold,
         min_threshold=calibration_min_threshold,
         max_threshold=calibration_max_threshold,
@@ -462,6 +764,8 @@ def train_model(
         crop_type=crop_type,
         source_dirs=source_dirs,
         data_dir=data_dirs or data_dir,
+        shards_dir=shards_dir,
+        clean_index=clean_index,
         best_val_acc=float(best_acc),
         model_version=model_version,
         manifest_path=manifest_path,
@@ -469,8 +773,11 @@ def train_model(
         calibration=calibration,
         sampling_profile=sampling_profile,
         split_seed=split_seed,
+        split=getattr(train_dataset, "split", None),
     )
     print(f"Saved label metadata: {metadata_path}")
+    context.barrier()
+    shutdown_distributed(context)
     return model
 
 
@@ -490,6 +797,11 @@ if __name__ == "__main__":
         default=None,
         help="Optional root folder where manifest image paths are resolved first",
     )
+    parser.add_argument(
+        "--skip_invalid_rows",
+        action="store_true",
+        help="Drop manifest rows with missing images or labels (reported) instead of failing",
+    )
     parser.add_argument("--epochs", type=int, default=10, help="Number of epochs")
     parser.add_argument("--batch_size", type=int, default=32, help="Batch size")
     parser.add_argument("--lr", type=float, default=0.001, help="Learning rate")
@@ -503,6 +815,82 @@ if __name__ == "__main__":
     parser.add_argument("--num_workers", type=int, default=0, help="DataLoader workers")
     parser.add_argument("--sampling_profile", type=str, default=None, help="JSON file with metadata weighting profile")
     parser.add_argument("--split_seed", type=int, default=42, help="Random seed for train/val/test split")
+    parser.add_argument(
+        "--image_cache",
+        type=str,
+        default=None,
+        help="Preprocessed image cache prefix from model/image_cache.py (stale entries fall back to disk)",
+    )
+    parser.add_argument(
+        "--augment",
+        choices=AUGMENT_MODES,
+        default="pil",
+        help="pil: per-image PIL transforms in workers; batch: uint8 batches augmented as tensors on the device",
+    )
+    parser.add_argument("--augment_seed", type=int, default=0, help="Seed for --augment batch random parameters")
+    parser.add_argument(
+        "--precision",
+        choices=PRECISIONS,
+        default="fp32",
+        help="bf16 runs forward/backward under autocast (AMX/AVX512-BF16 CPUs); checkpoints stay fp32",
+    )
+    parser.add_argument("--channels_last", action="store_true", help="Use channels_last memory format for the model and inputs")
+    parser.add_argument(
+        "--freeze_backbone",
+        action="store_true",
+        help="Cache pooled backbone features once and train only the classifier head on them",
+    )
+    parser.add_argument(
+        "--feature_views",
+        type=int,
+        default=1,
+        help="With --freeze_backbone: 1 un-augmented view plus N-1 augmented views per training sample",
+    )
+    parser.add_argument("--feature_cache_dir", type=str, default=None, help="Feature cache directory (default FEATURE_CACHE_DIR)")
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const="auto",
+        default=None,
+        help="Continue from a training checkpoint (default <output_dir>/last_checkpoint.pt)",
+    )
+    parser.add_argument("--checkpoint_every", type=int, default=1, help="Write last_checkpoint.pt every N epochs")
+    parser.add_argument(
+        "--telemetry_path",
+        type=str,
+        default=None,
+        help="JSON lines file for per-epoch throughput telemetry (default <output_dir>/telemetry.jsonl)",
+    )
+    parser.add_argument(
+        "--profile_steps",
+        type=str,
+        default=None,
+        help="Run torch.profiler over global training steps START:END and export a Chrome trace",
+    )
+    parser.add_argument(
+        "--shards_dir",
+        type=str,
+        default=None,
+        help="Stream train/val from tar shards written by model/shards.py instead of individual image files",
+    )
+    parser.add_argument(
+        "--clean_index",
+        type=str,
+        default=None,
+        help="Clean index from model/integrity_scan.py; its corrupt and duplicate images are left out",
+    )
+    parser.add_argument(
+        "--stream_manifest",
+        action="store_true",
+        help="With --manifest_path: stream CSV rows (hash split, per-label reservoirs) instead of loading them all",
+    )
+    parser.add_argument(
+        "--reservoir_size",
+        type=int,
+        default=DEFAULT_RESERVOIR_SIZE,
+        help="With --stream_manifest: rows buffered per label and DataLoader worker for shuffling",
+    )
+    parser.add_argument("--init_checkpoint", type=str, default=None, help="Start from this .pth (backbone, and head if shapes match)")
     parser.add_argument(
         "--calibration_default_threshold",
         type=float,
@@ -531,10 +919,14 @@ if __name__ == "__main__":
     args = parser.parse_args()
     parsed_data_dirs = _parse_paths_arg(args.data_dirs)
 
+    if args.shards_dir and (args.manifest_path or args.data_dir or parsed_data_dirs):
+        parser.error("--shards_dir replaces --manifest_path/--data_dir/--data_dirs.")
     if args.manifest_path and (args.data_dir or parsed_data_dirs):
         parser.error("Use --manifest_path alone, or use --data_dir/--data_dirs.")
-    if not args.manifest_path and not args.data_dir and not parsed_data_dirs:
-        parser.error("Provide --manifest_path, or --data_dir, or --data_dirs")
+    if not args.manifest_path and not args.data_dir and not parsed_data_dirs and not args.shards_dir:
+        parser.error("Provide --manifest_path, or --data_dir, or --data_dirs, or --shards_dir")
+    if args.stream_manifest and not args.manifest_path:
+        parser.error("--stream_manifest requires --manifest_path")
     if parsed_data_dirs and args.class_names:
         parser.error("--class_names is not supported with --data_dirs combined training")
 
@@ -558,4 +950,22 @@ if __name__ == "__main__":
         calibration_min_threshold=args.calibration_min_threshold,
         calibration_max_threshold=args.calibration_max_threshold,
         calibration_margin_floor=args.calibration_margin_floor,
+        image_cache=args.image_cache,
+        skip_invalid_rows=args.skip_invalid_rows,
+        augment=args.augment,
+        augment_seed=args.augment_seed,
+        precision=args.precision,
+        channels_last=args.channels_last,
+        freeze_backbone=args.freeze_backbone,
+        feature_views=args.feature_views,
+        feature_cache_dir=args.feature_cache_dir,
+        init_checkpoint=args.init_checkpoint,
+        resume=args.resume,
+        checkpoint_every=args.checkpoint_every,
+        telemetry_path=args.telemetry_path,
+        profile_steps=args.profile_steps,
+        shards_dir=args.shards_dir,
+        clean_index=args.clean_index,
+        stream_manifest=args.stream_manifest,
+        reservoir_size=args.reservoir_size,
     )
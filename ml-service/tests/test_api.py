@@ -13,6 +13,7 @@ class StubDiseaseModel(BaseDiseaseModel):
     """Minimal in-process stub used only in tests: no file I/O, no PyTorch."""
 
     model_version = "stub-v1"
+    image_size = (224, 224)
 
     def load_model(self) -> None:
         return None
@@ -121,3 +122,204 @@ def test_generate_returns_diagnosis_and_recommendation():
     assert "diagnosis" in item
     assert "recommendation" in item
     assert "generatedText" in item
+
+
+def _make_textured_image_bytes(seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    image = Image.fromarray(rng.integers(40, 220, size=(64, 64, 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_predict_best_selection_runs_model_on_sharpest_frame_only():
+    files = [
+        ("images", ("flat.jpg", _make_image_bytes((120, 120, 120)), "image/jpeg")),
+        ("images", ("sharp.png", _make_textured_image_bytes(7), "image/png")),
+        ("images", ("dark.jpg", _make_image_bytes((5, 5, 5)), "image/jpeg")),
+    ]
+
+    response = client.post("/predict", files=files, data={"selection": "best", "topK": "1"})
+
+    assert response.status_code == 200
+    payload = response.json()
+    assert [item["selected"] for item in payload] == [False, True, False]
+    assert payload[1]["disease"] == "healthy"
+    assert "disease" not in payload[0]
+    assert payload[1]["qualityScore"] > payload[0]["qualityScore"]
+    assert client.post("/predict", files=files, data={"selection": "sharpest"}).status_code == 400
+
+
+class StubCanaryModel(StubDiseaseModel):
+    model_version = "stub-v2"
+
+
+def test_admin_reload_installs_canary_and_promotes(monkeypatch):
+    monkeypatch.setenv("ML_ADMIN_TOKEN", "secret")
+    registry = _stub_service.registry
+    monkeypatch.setattr(registry, "model_factory", lambda model_path: StubCanaryModel())
+    headers = {"X-Admin-Token": "secret"}
+
+    try:
+        assert client.get("/admin/models").status_code == 401
+
+        response = client.post("/admin/models/reload", data={"canaryWeight": "1"}, headers=headers)
+        assert response.status_code == 202
+        assert registry.wait_for_reload(timeout=5)["state"] == "ready"
+
+        files = [("images", ("leaf.jpg", _make_image_bytes((30, 140, 30)), "image/jpeg"))]
+        payload = client.post("/predict", files=files).json()
+        assert payload[0]["modelVersion"] == "stub-v2"
+
+        status = client.post("/admin/models/promote", headers=headers).json()
+        assert status["primary"]["modelVersion"] == "stub-v2"
+        assert status["canary"] is None
+    finally:
+        registry.install(StubDiseaseModel())
+
+
+def test_model_watch_skips_a_failed_checkpoint_until_it_changes(tmp_path):
+    import time
+
+    from app.registry import ModelRegistry
+
+    attempts = []
+
+    def factory(model_path):
+        attempts.append(model_path)
+        if len(attempts) == 1:
+            raise RuntimeError("weights still being written")
+        return StubCanaryModel()
+
+    registry = ModelRegistry(factory)
+    registry.install(StubDiseaseModel())
+    registry.watch(str(tmp_path), interval=0.02)
+    try:
+        time.sleep(0.1)  # let the watcher record the empty directory as served
+        (tmp_path / "model.pth").write_bytes(b"weights")
+        deadline = time.monotonic() + 5
+        while registry.status()["watchFailure"] is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert registry.status()["watchFailure"]["error"] == "weights still being written"
+        # The same files are not reloaded on every poll.
+        time.sleep(0.2)
+        assert len(attempts) == 1
+
+        (tmp_path / "model.pth").write_bytes(b"fixed weights")
+        deadline = time.monotonic() + 5
+        while registry.status()["watchFailure"] is not None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert registry.primary.version == "stub-v2"
+        assert len(attempts) == 2
+        assert registry.status()["watchFailure"] is None
+    finally:
+        registry.stop_watching()
+
+
+def test_bulk_job_runs_in_background_and_resumes_from_sqlite(monkeypatch, tmp_path):
+    import time
+    import zipfile
+
+    from app import api
+    from app.jobs import BulkJobRunner, create_job_store
+
+    monkeypatch.setenv("BULK_JOB_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(api, "job_runner", None)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as bundle:
+        for idx in range(3):
+            bundle.writestr(f"field/leaf-{idx}.jpg", _make_image_bytes((30, 100 + idx, 30)))
+        bundle.writestr("field/notes.txt", "not an image")
+    files = [
+        ("images", ("single.jpg", _make_image_bytes((30, 140, 30)), "image/jpeg")),
+        ("archive", ("survey.zip", archive.getvalue(), "application/zip")),
+    ]
+
+    try:
+        response = client.post("/jobs", files=files, data={"cropHint": "maize"})
+        assert response.status_code == 202
+        job = response.json()
+        assert job["total"] == 4 and job["status"] == "queued"
+
+        deadline = time.time() + 10
+        while client.get(f"/jobs/{job['jobId']}").json()["status"] != "completed" and time.time() < deadline:
+            time.sleep(0.05)
+        status = client.get(f"/jobs/{job['jobId']}").json()
+        assert status["status"] == "completed" and status["processed"] == 4 and status["failed"] == 0
+
+        page = client.get(f"/jobs/{job['jobId']}/results", params={"offset": 1, "limit": 2}).json()
+        assert [item["fileName"] for item in page["items"]] == ["leaf-0.jpg", "leaf-1.jpg"]
+        assert page["items"][0]["result"]["disease"] == "healthy" and page["nextOffset"] == 3
+        assert client.get("/jobs/missing").status_code == 404
+    finally:
+        api.job_runner.stop()
+
+    # A job interrupted after one batch continues from its pending items in a new process.
+    store = create_job_store()
+    job = store.create_job("predict", [(f"leaf-{idx}.jpg", _make_image_bytes((20, 90, 20))) for idx in range(3)])
+    calls = []
+
+    def predict(files, *, crop_hint="auto"):
+        calls.append([name for name, _ in files])
+        return _stub_service.predict_many(files, crop_hint=crop_hint)
+
+    assert BulkJobRunner(store, {"predict": predict}, batch_size=2).run_once()
+    store.close()
+    resumed = BulkJobRunner(create_job_store(), {"predict": predict}, batch_size=2)
+    while resumed.run_once():
+        pass
+    assert calls == [["leaf-0.jpg", "leaf-1.jpg"], ["leaf-2.jpg"]]
+    assert resumed.store.get_job(job["jobId"])["status"] == "completed"
+
+
+def test_predict_raw_accepts_uint8_tensor_body():
+    pixels = np.zeros((2, 224, 224, 3), dtype=np.uint8)
+    headers = {"X-Tensor-Dtype": "uint8", "X-Tensor-Shape": "2,224,224,3", "Content-Type": "application/octet-stream"}
+
+    response = client.post("/predict/raw?mode=edge", content=pixels.tobytes(), headers=headers)
+    assert response.status_code == 200
+    payload = response.json()
+    assert [item["cropType"] for item in payload] == ["maize", "maize"]
+    assert payload[0]["mode"] == "edge"
+    assert any("too dark" in warning for warning in payload[0]["warnings"])
+
+    response = client.post("/predict/raw?quality=false", content=pixels.tobytes(), headers=headers)
+    assert response.status_code == 200
+    assert response.json()[1]["warnings"] == []
+
+    response = client.post("/predict/raw", content=pixels[:1].tobytes(), headers=headers)
+    assert response.status_code == 400
+
+    response = client.post("/predict/raw", content=b"", headers={**headers, "X-Tensor-Shape": "65,224,224,3"})
+    assert response.status_code == 400
+    response = client.post("/predict/raw", content=b"", headers={**headers, "X-Tensor-Shape": "1,4000,4000,3"})
+    assert response.status_code == 413
+
+    # Frames the model cannot use are refused from the headers alone.
+    response = client.post("/predict/raw", content=b"", headers={**headers, "X-Tensor-Shape": "1,100,100,3"})
+    assert response.status_code == 400 and "224,224,3" in response.json()["detail"]
+    # Other errors inside inference are server errors, not bad requests.
+    with patch.object(_stub_service, "predict_pixels", side_effect=ValueError("model bug")):
+        response = client.post("/predict/raw", content=pixels.tobytes(), headers=headers)
+    assert response.status_code == 500
+
+
+def test_large_raw_batches_run_as_bulk_even_when_marked_interactive():
+    from app.api import schedulers
+
+    lanes = schedulers["predict"].lanes
+    before = {name: lane.submitted for name, lane in lanes.items()}
+    headers = {"X-Tensor-Dtype": "uint8", "Content-Type": "application/octet-stream", "X-User-Id": "coop-7"}
+
+    pixels = np.zeros((6, 224, 224, 3), dtype=np.uint8)
+    response = client.post(
+        "/predict/raw",
+        content=pixels.tobytes(),
+        headers={**headers, "X-Tensor-Shape": "6,224,224,3", "X-Request-Priority": "interactive"},
+    )
+    assert response.status_code == 200
+    response = client.post("/predict/raw", content=pixels[0].tobytes(), headers={**headers, "X-Tensor-Shape": "224,224,3"})
+    assert response.status_code == 200
+
+    assert lanes["bulk"].submitted == before["bulk"] + 1
+    assert lanes["interactive"].submitted == before["interactive"] + 1
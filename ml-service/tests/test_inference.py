@@ -0,0 +1,317 @@
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+from app.inference import PaliGemmaGenerationService, TorchDiseaseModel  # noqa: E402
+from app.model_pool import ModelPool  # noqa: E402
+from app.similarity_cache import EmbeddingIndex, GenerationSimilarityCache  # noqa: E402
+from model.dataset import get_transforms  # noqa: E402
+from model.model import get_model  # noqa: E402
+
+LABELS = ["bean:healthy", "bean:bean_rust", "bean:angular_leaf_spot"]
+
+
+@pytest.fixture(scope="module")
+def state_dict_model(tmp_path_factory):
+    model_dir = tmp_path_factory.mktemp("model")
+    model_path = model_dir / "best_model.pth"
+    torch.manual_seed(0)
+    torch.save(get_model(num_classes=len(LABELS), pretrained=False).state_dict(), model_path)
+    (model_dir / "best_model.labels.json").write_text(json.dumps({"labels": LABELS}), encoding="utf-8")
+
+    model = TorchDiseaseModel(model_path=str(model_path))
+    model.load_model()
+    return model
+
+
+def _random_image(seed: int, size=(96, 80)) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8))
+
+
+def test_preprocess_matches_eval_transforms(state_dict_model):
+    image = _random_image(1)
+    expected = get_transforms(is_train=False)(image).unsqueeze(0)
+    actual = state_dict_model.preprocess(image)
+    assert actual.shape == expected.shape
+    assert torch.allclose(actual, expected, atol=1e-5)
+
+
+def test_predict_images_matches_single_predictions_and_reuses_buffers(state_dict_model, monkeypatch):
+    images = [_random_image(seed) for seed in range(7)]
+    monkeypatch.setattr(state_dict_model._buffer_pool, "max_batch", 3)
+
+    batched = state_dict_model.predict_images(images, crop_hint="beans")
+    single = [state_dict_model.predict(state_dict_model.preprocess(image), crop_hint="beans") for image in images]
+    allocations = state_dict_model._buffer_pool.allocations
+    state_dict_model.predict_images(images, crop_hint="beans")
+
+    assert len(batched) == len(images)
+    for batch_result, single_result in zip(batched, single):
+        assert batch_result["candidateDisease"] == single_result["candidateDisease"]
+        assert batch_result["confidence"] == pytest.approx(single_result["confidence"], abs=1e-5)
+    assert state_dict_model._buffer_pool.allocations == allocations
+
+
+class _FakeSpecialist:
+    def __init__(self, model_path):
+        self.model_version = os.path.basename(model_path)
+        self.loaded = False
+
+    def load_model(self):
+        self.loaded = True
+
+
+def _write_specialist(directory, name, labels, size, accuracy=0.9):
+    (directory / f"{name}.pth").write_bytes(b"\0" * size)
+    (directory / f"{name}.labels.json").write_text(
+        json.dumps({"labels": labels, "best_val_accuracy": accuracy}), encoding="utf-8")
+
+
+def test_model_pool_routes_by_crop_and_evicts_least_recently_used(tmp_path):
+    _write_specialist(tmp_path, "bean_small", ["bean:healthy", "bean:bean_rust"], 600, accuracy=0.8)
+    _write_specialist(tmp_path, "bean_large", ["bean:healthy", "bean:bean_rust"], 600, accuracy=0.95)
+    _write_specialist(tmp_path, "maize", ["maize:healthy", "maize:common_rust"], 600)
+    _write_specialist(tmp_path, "combined", ["bean:healthy", "maize:healthy"], 600)
+    pool = ModelPool.from_directory(str(tmp_path), _FakeSpecialist, memory_budget_bytes=1000)
+
+    with pool.lease("auto") as model:
+        assert model is None
+    with pool.lease("beans") as model:
+        assert model.model_version == "bean_large.pth"
+    with pool.lease("maize") as model:
+        assert model.model_version == "maize.pth"
+    with pool.lease("beans") as model:
+        assert model.model_version == "bean_large.pth"
+
+    status = pool.status()
+    assert [entry["name"] for entry in status["resident"]] == ["bean_large"]
+    assert status["counters"]["loads"] == 3
+    assert status["counters"]["evictions"] == 2
+    assert status["counters"]["hits"] == 0
+
+    # A model comes back from loading already leased, so a concurrent load cannot evict it before use.
+    loaded = pool._load(pool.specs["maize"])
+    assert loaded.in_use == 1
+    pool._load(pool.specs["bean_small"])
+    assert "maize" in pool._resident
+
+
+def test_broken_specialist_falls_back_to_primary_and_backs_off(state_dict_model, tmp_path):
+    from app.inference import DiseaseInferenceService
+
+    _write_specialist(tmp_path, "bean_broken", ["bean:healthy", "bean:bean_rust"], 64)
+    attempts = []
+
+    def factory(model_path):
+        attempts.append(model_path)
+        return TorchDiseaseModel(model_path=model_path, use_env_overrides=False)
+
+    pool = ModelPool.from_directory(str(tmp_path), factory, memory_budget_bytes=10**9)
+    service = DiseaseInferenceService(model=state_dict_model, model_pool=pool)
+    upload = io.BytesIO()
+    _random_image(0).save(upload, format="PNG")
+
+    for _ in range(2):
+        [result] = service.predict_many([("leaf.png", upload.getvalue())], crop_hint="beans")
+        assert result["modelVersion"] == state_dict_model.model_version
+    # The failed specialist is not reloaded on every request while it backs off.
+    assert len(attempts) == 1
+    [specialist] = pool.status()["specialists"]
+    assert specialist["loadError"]
+
+
+class _CountingGenerator:
+    model_version = "paligemma-test"
+
+    def __init__(self):
+        self.calls = 0
+
+    def load_model(self):
+        return None
+
+    def generate(self, image, *, crop_hint="auto"):
+        self.calls += 1
+        return {"cropType": "bean", "disease": "bean_rust", "diagnosis": "Bean Rust", "recommendation": "Spray."}
+
+
+class _FixedEmbedder:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def embed_images(self, images, *, crop_hint="auto"):
+        return [
+            {"embedding": self.embeddings[i], "cropType": "bean", "label": "bean_rust",
+             "isUncertain": False, "modelVersion": "clf-v1"}
+            for i in range(len(images))
+        ]
+
+
+def _jpeg_bytes(seed: int) -> bytes:
+    buffer = io.BytesIO()
+    _random_image(seed).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def test_generate_many_serves_near_duplicates_from_similarity_cache():
+    rng = np.random.default_rng(3)
+    base = rng.normal(size=1280).astype(np.float32)
+    near = base + rng.normal(scale=0.01, size=1280).astype(np.float32)
+    generator = _CountingGenerator()
+    service = PaliGemmaGenerationService(
+        model=generator,
+        embedder=_FixedEmbedder([base]),
+        similarity_cache=GenerationSimilarityCache(threshold=0.99),
+    )
+
+    first = service.generate_many([("a.jpg", _jpeg_bytes(1))], crop_hint="beans")
+    service.embedder = _FixedEmbedder([near])
+    second = service.generate_many([("b.jpg", _jpeg_bytes(2))], crop_hint="beans")
+
+    assert generator.calls == 1
+    assert first[0]["servedBy"] == "model"
+    assert second[0]["servedBy"] == "similarity"
+    assert second[0]["diagnosis"] == "Bean Rust"
+    assert second[0]["similarity"] >= 0.99
+
+
+def test_embedding_index_round_trips_through_mmap(tmp_path):
+    index = EmbeddingIndex(dim=4)
+    index.add(np.eye(4, dtype=np.float32)[:3], ["a", "a", "b"], [{"id": 0}, {"id": 1}, {"id": 2}])
+    index.save(str(tmp_path / "index"))
+
+    loaded = EmbeddingIndex.load(str(tmp_path / "index"), dim=4)
+    assert isinstance(loaded._base, np.memmap)
+    scores, indices = loaded.search(np.array([[0, 1, 0, 0], [0, 0, 1, 0]], dtype=np.float32), ["a", "a"], k=2)
+    assert indices[0].tolist() == [1, 0]
+    assert scores[0, 0] == pytest.approx(1.0)
+    assert indices[1, 0] in {0, 1} and scores[1, 0] == pytest.approx(0.0)
+
+    # Unsaved rows are ranked together with the mmap'd base.
+    loaded.add(np.array([[0, 0.9, 0.1, 0]], dtype=np.float32), ["a"], [{"id": 3}])
+    scores, indices = loaded.search(np.array([[0, 1, 0, 0]], dtype=np.float32), ["a"], k=4)
+    assert indices[0].tolist() == [1, 3, 0, -1]
+    assert scores[0, 1] == pytest.approx(0.9 / np.hypot(0.9, 0.1))
+
+
+def test_embedding_index_saves_by_appending_and_compacts_on_load(tmp_path):
+    path = str(tmp_path / "index")
+    index = EmbeddingIndex(dim=4)
+    index.add(np.eye(4, dtype=np.float32)[:2], ["a", "a"], [{"id": 0}, {"id": 1}])
+    index.save(path)
+    index = EmbeddingIndex.load(path, dim=4)
+    base_mtime = os.stat(f"{path}.npy").st_mtime_ns
+
+    index.add(np.eye(4, dtype=np.float32)[2:3], ["b"], [{"id": 2}])
+    index.save(path)
+    index.add(np.eye(4, dtype=np.float32)[3:], ["b"], [{"id": 3}])
+    index.save(path)
+    # Saves only append the new rows; the .npy with the earlier rows is left alone.
+    assert os.stat(f"{path}.npy").st_mtime_ns == base_mtime
+    assert os.path.getsize(f"{path}.rows") == 2 * 4 * 4
+    scores, indices = index.search(np.eye(4, dtype=np.float32)[3:], ["b"], k=2)
+    assert indices[0].tolist() == [3, 2]
+
+    # A crash after the rows but before their records: the unrecorded row is dropped on load.
+    with open(f"{path}.rows", "ab") as handle:
+        handle.write(np.ones(4, dtype=np.float32).tobytes())
+    loaded = EmbeddingIndex.load(path, dim=4)
+    assert not os.path.exists(f"{path}.rows")
+    assert len(loaded) == 4 and [record["id"] for record in loaded.records] == [0, 1, 2, 3]
+    scores, indices = loaded.search(np.eye(4, dtype=np.float32)[2:3], ["b"], k=1)
+    assert indices[0, 0] == 2 and scores[0, 0] == pytest.approx(1.0)
+
+
+def test_bulk_inference_matches_predict_images_and_resumes(state_dict_model, tmp_path, monkeypatch):
+    from app import bulk_inference
+    from app.bulk_inference import ImageSource, run_bulk_inference
+
+    images = [_random_image(seed) for seed in range(7)]
+    input_dir = tmp_path / "scans"
+    (input_dir / "b").mkdir(parents=True)
+    for idx, image in enumerate(images):
+        image.save(input_dir / ("b" if idx >= 4 else "") / f"scan_{idx}.png")
+    (input_dir / "b" / "scan_9.jpg").write_bytes(b"not a jpeg")
+
+    expected = state_dict_model.predict_images(images, crop_hint="beans")
+    output = tmp_path / "out" / "scores.jsonl"
+    summary = run_bulk_inference(state_dict_model, ImageSource(input_dir=str(input_dir)), str(output),
+                                 batch_size=3, num_workers=2, crop_hint="beans", top_k=2)
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert summary["written"] == 8 and summary["failed"] == 1
+    assert [record["path"].rsplit("/", 1)[-1] for record in records] == [
+        "scan_0.png", "scan_1.png", "scan_2.png", "scan_3.png", "scan_4.png", "scan_5.png", "scan_6.png", "scan_9.jpg"]
+    for record, prediction in zip(records, expected):
+        assert record["candidateDisease"] == prediction["candidateDisease"]
+        assert record["confidence"] == pytest.approx(prediction["confidence"], abs=1e-5)
+        assert len(record["topPredictions"]) == 2
+    assert records[-1]["error"] and records[-1]["label"] is None
+
+    lines = output.read_text().splitlines(keepends=True)
+    output.write_text("".join(lines[:5]) + lines[5][:10])
+    # Small chunks make the resume scan cross chunk boundaries, as it would on a large file.
+    monkeypatch.setattr(bulk_inference, "_RESUME_CHUNK_BYTES", 7)
+    resumed = run_bulk_inference(state_dict_model, ImageSource(input_dir=str(input_dir)), str(output),
+                                 batch_size=3, crop_hint="beans", top_k=2)
+    assert resumed["resumed_from"] == 5 and resumed["written"] == 3
+    assert [json.loads(line)["path"] for line in output.read_text().splitlines()] == [record["path"] for record in records]
+
+    csv_output = tmp_path / "scores.csv"
+    run_bulk_inference(state_dict_model, ImageSource(pattern=str(input_dir / "*.png")), str(csv_output),
+                       output_format="csv", batch_size=16)
+    assert len(csv_output.read_text().splitlines()) == 5
+
+
+def test_scheduler_prioritises_interactive_and_shares_lanes_fairly():
+    import threading
+    import time
+
+    from app.scheduler import InferenceScheduler, QueueFull
+
+    def wait_running(future):
+        deadline = time.monotonic() + 5
+        while not future.running() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert future.running()
+
+    release = threading.Event()
+    scheduler = InferenceScheduler(
+        "test", workers=1, reserved_interactive=1, bulk_workers=1, max_depth={"bulk": 1}, bulk_niceness=5)
+    try:
+        running_bulk = scheduler.submit(release.wait, lane="bulk", client="coop")
+        wait_running(running_bulk)
+        # Only the bulk-only worker is lowered; the interactive worker keeps the process priority.
+        interactive_thread, bulk_thread = scheduler._threads
+        base = os.getpriority(os.PRIO_PROCESS, 0)
+        assert os.getpriority(os.PRIO_PROCESS, interactive_thread.native_id) == base
+        assert os.getpriority(os.PRIO_PROCESS, bulk_thread.native_id) == min(base + 5, 19)
+        queued_bulk = scheduler.submit(release.wait, lane="bulk", client="coop")
+        with pytest.raises(QueueFull):
+            scheduler.submit(release.wait, lane="bulk", client="coop")
+        # The reserved worker serves interactive requests while bulk work holds the other one.
+        assert scheduler.submit(lambda: "scan", client="farmer").result(timeout=5) == "scan"
+        assert not running_bulk.done()
+
+        order = []
+        blocker = scheduler.submit(release.wait, client="other")
+        wait_running(blocker)
+        jobs = [scheduler.submit(lambda n=f"a{i}": order.append(n), client="a") for i in range(4)]
+        jobs += [scheduler.submit(lambda n=f"b{i}": order.append(n), client="b") for i in range(2)]
+        release.set()
+        for future in [running_bulk, queued_bulk, blocker, *jobs]:
+            future.result(timeout=5)
+        assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+        status = scheduler.status()["lanes"]
+        assert status["bulk"]["rejected"] == 1
+        assert status["interactive"]["completed"] == 8
+    finally:
+        release.set()
+        scheduler.stop()
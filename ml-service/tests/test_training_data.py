@@ -0,0 +1,549 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+from model.batch_augment import BatchAugmenter  # noqa: E402
+from model.dataset import LeafDiseaseDataset, get_transforms, get_uint8_transforms  # noqa: E402
+from model.dataset_index import load_dataset_index  # noqa: E402
+from model.finetune_dataset import (  # noqa: E402
+    ManifestLeafDiseaseDataset,
+    compute_metadata_sample_weights,
+    load_sampling_profile,
+)
+from model.manifest_compiler import ManifestError  # noqa: E402
+from model.metadata_store import ColumnarMetadata, group_accuracy  # noqa: E402
+from model.image_cache import compile_image_cache  # noqa: E402
+
+BEAN_CLASSES = ["healthy", "bean_rust", "angular_leaf_spot"]
+
+
+@pytest.fixture(autouse=True)
+def dataset_index_dir(tmp_path, monkeypatch):
+    index_dir = tmp_path / "dataset-index"
+    monkeypatch.setenv("DATASET_INDEX_DIR", str(index_dir))
+    monkeypatch.setenv("MANIFEST_CACHE_DIR", str(tmp_path / "manifest-cache"))
+    return index_dir
+
+
+@pytest.fixture()
+def bean_root(tmp_path):
+    rng = np.random.default_rng(0)
+    root = tmp_path / "bean-dataset"
+    for class_name in BEAN_CLASSES:
+        class_dir = root / class_name
+        class_dir.mkdir(parents=True)
+        for idx in range(4):
+            pixels = rng.integers(0, 256, size=(40, 50, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(class_dir / f"{class_name}_{idx:02d}.png")
+    return root
+
+
+@pytest.fixture()
+def small_train_model(monkeypatch):
+    """Make `train.get_model` build the same untrained network on every call."""
+    import torch
+
+    from model import train
+    from model.model import get_model
+
+    def small_model(num_classes, pretrained=False):
+        torch.manual_seed(0)
+        return get_model(num_classes=num_classes, pretrained=False)
+
+    monkeypatch.setattr(train, "get_model", small_model)
+
+
+def test_image_cache_serves_valid_rows_and_skips_changed_files(bean_root, tmp_path):
+    dataset = LeafDiseaseDataset(str(bean_root))
+    cache_path = str(tmp_path / "cache" / "bean")
+    compile_image_cache([path for path, _ in dataset.samples], cache_path, size=32)
+
+    changed_path = dataset.samples[0][0]
+    Image.new("RGB", (10, 10), (255, 0, 0)).save(changed_path)
+    cached = LeafDiseaseDataset(str(bean_root), image_cache=cache_path)
+
+    assert cached._cache_rows[0] == -1
+    assert (cached._cache_rows[1:] >= 0).all()
+    assert cached[0][0].size == (10, 10)
+    expected = Image.open(dataset.samples[1][0]).convert("RGB").resize((32, 32), Image.BILINEAR)
+    assert np.array_equal(np.asarray(cached[1][0]), np.asarray(expected))
+
+
+def test_dataset_index_keeps_legacy_order_and_rescans_only_changed_dirs(bean_root):
+    Image.new("RGB", (8, 8)).save(bean_root / "healthy" / "a_extra.JPG")
+    (bean_root / "healthy" / "notes.txt").write_text("skip", encoding="utf-8")
+    first = load_dataset_index(str(bean_root))
+    assert sorted(first.rescanned_dirs) == sorted(BEAN_CLASSES)
+    names = [path.rsplit("/", 1)[-1] for path in first.image_paths("healthy")]
+    assert names == [f"healthy_{idx:02d}.png" for idx in range(4)] + ["a_extra.JPG"]
+
+    assert load_dataset_index(str(bean_root)).rescanned_dirs == []
+
+    Image.new("RGB", (8, 8)).save(bean_root / "bean_rust" / "bean_rust_99.png")
+    refreshed = load_dataset_index(str(bean_root))
+    assert refreshed.rescanned_dirs == ["bean_rust"]
+    dataset = LeafDiseaseDataset(str(bean_root))
+    assert len(dataset) == 14
+    assert all(path.startswith(str(bean_root)) for path, _ in dataset.samples)
+
+
+def _write_manifest(path, rows):
+    lines = ["image_path,crop_type,disease,province,season"]
+    lines.extend(",".join(row) for row in rows)
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _fail_if_called(*args, **kwargs):
+    raise AssertionError("manifest was recompiled")
+
+
+def test_manifest_reports_all_bad_rows_and_reuses_compiled_form(bean_root, tmp_path, monkeypatch):
+    manifest = tmp_path / "manifest.csv"
+    _write_manifest(manifest, [
+        ("bean_rust/bean_rust_01.png", "beans", "Bean Rust", "East", "A"),
+        ("missing.png", "bean", "healthy", "west", "b"),
+        ("healthy/healthy_00.png", "", "", "west", "b"),
+        ("healthy/healthy_02.png", "bean", "healthy", "West", "season-b"),
+        ("bean_rust/bean_rust_00.png", "bean", "bean_rust", "east", "a"),
+    ])
+
+    with pytest.raises(ManifestError) as excinfo:
+        ManifestLeafDiseaseDataset(str(manifest), images_root=str(bean_root))
+    assert [row for row, _ in excinfo.value.errors] == [3, 4]
+
+    dataset = ManifestLeafDiseaseDataset(str(manifest), images_root=str(bean_root), skip_invalid_rows=True)
+    assert dataset.class_names == ["bean:healthy", "bean:bean_rust"]
+    assert [path.rsplit("/", 1)[-1] for path, _ in dataset.samples] == [
+        "healthy_02.png", "bean_rust_00.png", "bean_rust_01.png"]
+    assert dataset.sample_metadata[0]["province"] == "west"
+    assert dataset.sample_metadata[0]["season"] == "season_b"
+
+    # The compile is cached with its errors, so the next run skips the CSV parse and existence checks...
+    with monkeypatch.context() as patched:
+        patched.setattr("model.manifest_compiler.compile_manifest", _fail_if_called)
+        assert len(ManifestLeafDiseaseDataset(str(manifest), images_root=str(bean_root), skip_invalid_rows=True)) == 3
+    # ...until an image reported missing shows up at the reported path.
+    (tmp_path / "missing.png").write_bytes((bean_root / "healthy" / "healthy_00.png").read_bytes())
+    with pytest.raises(ManifestError) as excinfo:
+        ManifestLeafDiseaseDataset(str(manifest), images_root=str(bean_root))
+    assert [row for row, _ in excinfo.value.errors] == [4]
+
+    _write_manifest(manifest, [
+        ("bean_rust/bean_rust_01.png", "beans", "Bean Rust", "East", "A"),
+        ("healthy/healthy_02.png", "bean", "healthy", "West", "season-b"),
+    ])
+    ManifestLeafDiseaseDataset(str(manifest), images_root=str(bean_root))
+    cached = list((tmp_path / "manifest-cache").glob("manifest-*.npz"))
+    assert len(cached) == 2
+    reloaded = ManifestLeafDiseaseDataset(str(manifest), images_root=str(bean_root))
+    assert len(reloaded) == 2
+
+
+def test_columnar_metadata_weights_and_group_accuracy():
+    records = [
+        {"province": "East", "district": "kayonza", "season": "season_a", "rainfall_band": "high", "crop_type": "bean"},
+        {"province": "west", "district": None, "season": "season_b", "rainfall_band": None, "crop_type": ""},
+        {"province": "east", "district": "kayonza", "season": None, "rainfall_band": "low", "crop_type": "maize"},
+    ] * 2
+    metadata = ColumnarMetadata.from_records(records)
+    assert metadata[1]["province"] == "west" and metadata[1]["district"] is None
+    assert len(metadata.subset([0, 2])) == 2
+
+    profile = load_sampling_profile()
+    profile["disease_weights"] = {"bean:bean_rust": 2.0}
+    weights = compute_metadata_sample_weights(metadata, ["bean_rust", "bean:healthy", "maize:healthy"] * 2, profile)
+    assert weights[0] == pytest.approx(2.0 * 1.15 * 1.0 * 1.2)
+    assert weights[1] == pytest.approx(1.2 * 1.2)
+    assert weights[2] == pytest.approx(1.15 * 1.1)
+
+    stats = group_accuracy([True, False, True, True, True, False], metadata, min_samples=2)
+    assert list(stats)[:2] == ["province:east", "district:kayonza"]
+    assert stats["province:east"] == {"samples": 4, "accuracy": 0.75}
+    assert stats["province:west"] == {"samples": 2, "accuracy": 0.5}
+
+
+def test_batch_augmenter_is_seeded_and_normalizes_like_eval_transforms(bean_root):
+    import torch
+
+    dataset = LeafDiseaseDataset(str(bean_root))
+    images = [dataset[idx][0] for idx in range(4)]
+    batch = torch.stack([get_uint8_transforms()(image) for image in images])
+    expected = torch.stack([get_transforms(is_train=False)(image) for image in images])
+
+    augmenter = BatchAugmenter(seed=7)
+    assert torch.allclose(augmenter.normalize(batch), expected, atol=1e-5)
+
+    first = augmenter(batch)
+    second = augmenter(batch)
+    replay = BatchAugmenter(seed=7)
+    assert first.shape == expected.shape and first.dtype == torch.float32
+    assert torch.equal(replay(batch), first)
+    assert not torch.equal(first, second)
+
+    identity = BatchAugmenter(degrees=0, brightness=0, contrast=0, flip_p=0.0)
+    assert torch.allclose(identity(batch), expected, atol=1e-5)
+
+
+def test_bf16_channels_last_checkpoint_state_is_fp32_and_contiguous():
+    import torch
+
+    from model.model import get_model
+    from model.train import _autocast_context, _checkpoint_state
+
+    model = get_model(num_classes=3, pretrained=False).to(memory_format=torch.channels_last).eval()
+    inputs = torch.rand(2, 3, 64, 64).contiguous(memory_format=torch.channels_last)
+    with torch.no_grad(), _autocast_context(torch.device("cpu"), "bf16"):
+        assert model(inputs).dtype == torch.bfloat16
+
+    state = _checkpoint_state(model)
+    assert all(value.is_contiguous() for value in state.values())
+    assert {value.dtype for value in state.values() if value.is_floating_point()} == {torch.float32}
+    get_model(num_classes=3, pretrained=False).load_state_dict(state)
+
+
+def test_frozen_backbone_features_are_cached_per_backbone(bean_root, tmp_path):
+    import torch
+    from torch.utils.data import Subset
+
+    from model.feature_cache import cached_split_features, pooled_features
+    from model.model import get_model
+
+    torch.manual_seed(0)
+    model = get_model(num_classes=3, pretrained=False)
+    subset = Subset(LeafDiseaseDataset(str(bean_root)), [0, 5, 9])
+    options = {"split_name": "val", "device": torch.device("cpu"), "cache_dir": str(tmp_path / "features")}
+
+    rng_state = torch.get_rng_state()
+    features, labels = cached_split_features(model, subset, views=2, **options)
+    assert torch.equal(torch.get_rng_state(), rng_state)
+    assert features.shape == (6, 1280)
+    assert labels.tolist() == [subset[i][1] for i in range(3)] * 2
+    with torch.no_grad():
+        expected = pooled_features(model.eval(), get_transforms(is_train=False)(subset[1][0]).unsqueeze(0))
+    assert np.allclose(features[1], expected.numpy()[0], atol=1e-5)
+
+    again, _ = cached_split_features(model, subset, views=2, **options)
+    assert isinstance(again, np.memmap) and np.array_equal(again, features)
+    assert len(list((tmp_path / "features").glob("*.npy"))) == 2
+
+    with torch.no_grad():
+        model.features[0][0].weight.add_(1.0)
+    cached_split_features(model, subset, views=2, **options)
+    assert len(list((tmp_path / "features").glob("val-*.labels.npy"))) == 2
+
+    empty, empty_labels = cached_split_features(model, Subset(subset.dataset, []), views=2, **options)
+    assert empty.shape == (0, 1280) and len(empty_labels) == 0
+
+
+def test_distributed_samplers_split_one_global_draw_across_ranks():
+    from model.distributed import DistributedContext, DistributedWeightedSampler, ShardSampler
+
+    ranks = [DistributedContext(rank=rank, world_size=3) for rank in range(3)]
+    shards = [list(DistributedWeightedSampler(10, context, seed=5)) for context in ranks]
+    assert all(len(shard) == 4 for shard in shards)
+    assert set().union(*shards) == set(range(10))
+
+    weights = [0.0] * 8 + [1.0, 1.0]
+    weighted = [DistributedWeightedSampler(10, context, weights=weights, seed=5) for context in ranks]
+    assert {index for sampler in weighted for index in sampler} <= {8, 9}
+    first_epoch = list(weighted[0])
+    weighted[0].set_epoch(1)
+    assert len(list(weighted[0])) == len(first_epoch)
+
+    assert sorted(index for context in ranks for index in ShardSampler(7, context)) == list(range(7))
+
+
+def test_resume_continues_exactly_where_training_stopped(bean_root, tmp_path, small_train_model):
+    import torch
+
+    from model import train
+
+    options = {"num_epochs": 2, "batch_size": 4, "augment": "batch"}
+
+    torch.manual_seed(1)
+    train.train_model(str(bean_root), output_dir=str(tmp_path / "straight"), **options)
+
+    torch.manual_seed(1)
+    train.train_model(str(bean_root), output_dir=str(tmp_path / "resumed"), **{**options, "num_epochs": 1})
+    torch.manual_seed(123)
+    train.train_model(str(bean_root), output_dir=str(tmp_path / "resumed"), resume="auto", **options)
+
+    straight = torch.load(tmp_path / "straight" / "last_checkpoint.pt", weights_only=False)
+    resumed = torch.load(tmp_path / "resumed" / "last_checkpoint.pt", weights_only=False)
+    assert resumed["epoch"] == straight["epoch"] == 2
+    for key, value in straight["model"].items():
+        assert torch.equal(value, resumed["model"][key]), key
+    assert (tmp_path / "resumed" / "best_model.pth").exists()
+
+
+def test_training_writes_phase_telemetry_and_profiler_trace(bean_root, tmp_path, small_train_model):
+    from model import train
+
+    train.train_model(
+        str(bean_root), num_epochs=2, batch_size=4, augment="batch", output_dir=str(tmp_path / "out"),
+        profile_steps="0:1")
+
+    telemetry = [json.loads(line) for line in (tmp_path / "out" / "telemetry.jsonl").read_text().splitlines()]
+    assert [(row["epoch"], row["phase"]) for row in telemetry] == [(1, "train"), (1, "val"), (2, "train"), (2, "val")]
+    assert telemetry[0]["samples"] == 3 and telemetry[0]["backward_s"] > 0 and telemetry[1]["backward_s"] == 0
+    assert (tmp_path / "out" / "profile_trace_rank0.json").exists()
+
+
+def test_vectorized_calibration_matches_per_label_sorted_quantiles(tmp_path):
+    import torch
+
+    from model.calibration import compute_calibration, logits_from_features, validation_arrays
+
+    def reference_quantile(values, q):
+        ordered = sorted(values)
+        position = q * (len(ordered) - 1)
+        low = int(position)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] if low == high else ordered[low] * (1 - (position - low)) + ordered[high] * (position - low)
+
+    class_names = ["bean:healthy", "bean:bean_rust", "maize:healthy", "other"]
+    generator = torch.Generator().manual_seed(0)
+    logits = torch.randn(500, len(class_names), generator=generator) * 3
+    labels = torch.randint(0, len(class_names), (500,), generator=generator)
+    arrays = validation_arrays(logits, labels)
+    calibration = compute_calibration(arrays, class_names, None, min_threshold=0.0, max_threshold=1.0)
+
+    probabilities = torch.softmax(logits, dim=1)
+    top = torch.topk(probabilities, k=2, dim=1).values
+    by_label = {name: [] for name in class_names}
+    by_crop = {"bean": [], "maize": []}
+    margins = []
+    for row in range(len(labels)):
+        if int(probabilities[row].argmax()) != int(labels[row]):
+            continue
+        name = class_names[int(labels[row])]
+        by_label[name].append(float(top[row, 0]))
+        if name.split(":")[0] in by_crop:
+            by_crop[name.split(":")[0]].append(float(top[row, 0]))
+        margins.append(float(top[row, 0]) - float(top[row, 1]))
+
+    assert calibration["confidence_threshold_by_label"] == {
+        name: round(reference_quantile(values, 0.2), 4) for name, values in by_label.items()}
+    assert calibration["confidence_threshold_by_crop"] == {
+        crop: round(reference_quantile(values, 0.2), 4) for crop, values in by_crop.items()}
+    assert calibration["margin_threshold"] == round(min(max(reference_quantile(margins, 0.1), 0.08), 0.6), 4)
+
+    weight, bias = torch.randn(3, 8, generator=generator), torch.randn(3, generator=generator)
+    torch.save({"classifier.1.weight": weight, "classifier.1.bias": bias}, tmp_path / "head.pth")
+    features = torch.randn(10, 8, generator=generator)
+    assert np.allclose(logits_from_features(str(tmp_path / "head.pth"), features.numpy()), features @ weight.T + bias, atol=1e-5)
+
+
+def test_evaluate_streams_test_split_into_reusable_logit_artifact(bean_root, tmp_path, monkeypatch):
+    import torch
+
+    from model import evaluate
+    from model.model import get_model
+
+    manifest = tmp_path / "manifest.csv"
+    _write_manifest(manifest, [
+        (f"{name}/{name}_{idx:02d}.png", "bean", name, ("east", "west")[idx % 2], ("a", "b")[idx // 2])
+        for name in BEAN_CLASSES for idx in range(4)
+    ])
+    model_path = tmp_path / "model.pth"
+    torch.manual_seed(0)
+    torch.save(get_model(num_classes=3, pretrained=False).state_dict(), model_path)
+    options = {
+        "manifest_path": str(manifest),
+        "manifest_images_root": str(bean_root),
+        "eval_cache_dir": str(tmp_path / "eval"),
+        "output_dir": str(tmp_path / "report"),
+        "plot": False,
+    }
+
+    report = evaluate.evaluate_model(str(model_path), **options)
+    assert report["samples"] == 6 and sum(map(sum, report["confusion_matrix"])) == 6
+    coverage = [row["coverage"] for row in report["threshold_sweep"]]
+    assert coverage == sorted(coverage, reverse=True)
+    assert json.loads((tmp_path / "report" / "evaluation_report.json").read_text())["samples"] == 6
+
+    def no_inference(**_):
+        raise AssertionError("cached logits should be reused")
+
+    monkeypatch.setattr(evaluate, "get_model", no_inference)
+    assert evaluate.evaluate_model(str(model_path), **options)["accuracy"] == report["accuracy"]
+
+    (artifact_path,) = (tmp_path / "eval").glob("test-*.npz")
+    artifact = evaluate.load_eval_artifact(str(artifact_path))
+    assert len(artifact["sample_indices"]) == 6 and artifact["info"]["split_seed"] == 42
+    by_season = evaluate.build_evaluation_report(artifact, group_keys=("season",), min_group_samples=1)
+    assert by_season["group_accuracy"] and all(key.startswith("season:") for key in by_season["group_accuracy"])
+
+
+def test_split_file_is_reused_and_survives_listing_order_changes(tmp_path):
+    from model.splits import build_stratified_splits, load_or_create_split
+
+    samples = [(f"/data/class{label}/img{idx:03d}.png", label) for label in range(3) for idx in range(20)]
+    first = load_or_create_split(samples, split_dir=str(tmp_path), seed=7)
+    assert (first.train, first.val, first.test) == tuple(build_stratified_splits(samples, seed=7))
+    assert len(list(tmp_path.glob("split-*.npz"))) == 1
+
+    reordered = samples[::-1]
+    second = load_or_create_split(reordered, split_dir=str(tmp_path), seed=7)
+    assert second.split_hash == first.split_hash and second.path == first.path
+    for name in ("train", "val", "test"):
+        assert [reordered[i] for i in getattr(second, name)] == [samples[i] for i in getattr(first, name)]
+
+    assert load_or_create_split(samples, split_dir=str(tmp_path), seed=8).split_hash != first.split_hash
+
+
+def test_split_extends_when_samples_change_without_moving_existing_ones(tmp_path):
+    from model.splits import SPLIT_NAMES, load_or_create_split
+
+    def assignment(samples, split):
+        return {samples[index]: name for name in SPLIT_NAMES for index in getattr(split, name)}
+
+    samples = [(f"/data/class{label}/img{idx:03d}.png", label) for label in range(3) for idx in range(20)]
+    first = assignment(samples, load_or_create_split(samples, split_dir=str(tmp_path), seed=7))
+
+    # One image removed, ten added to one class: every surviving image keeps its split.
+    grown = samples[1:] + [(f"/data/class0/new{idx:03d}.png", 0) for idx in range(10)]
+    split = load_or_create_split(grown, split_dir=str(tmp_path), seed=7)
+    second = assignment(grown, split)
+    assert len(list(tmp_path.glob("split-*.npz"))) == 2
+    assert all(second[sample] == first[sample] for sample in samples[1:])
+    new_class0 = [name for sample, name in second.items() if sample[0].startswith("/data/class0/new")]
+    assert new_class0.count("test") + new_class0.count("val") >= 3
+
+
+def test_training_records_its_split_file_in_the_sidecar(bean_root, tmp_path, small_train_model):
+    from model import train
+    from model.dataset_index import default_index_dir
+    from model.splits import load_or_create_split
+
+    train.train_model(str(bean_root), num_epochs=1, batch_size=4, output_dir=str(tmp_path / "out"))
+    split = load_or_create_split(LeafDiseaseDataset(str(bean_root)).samples, split_dir=default_index_dir())
+    sidecar = json.loads((tmp_path / "out" / "best_model.labels.json").read_text())
+    assert sidecar["split_hash"] == split.split_hash and sidecar["split_path"] == split.path
+
+
+def test_shards_pack_splits_and_stream_into_train_and_evaluate(bean_root, tmp_path, small_train_model):
+    import torch
+
+    from model import evaluate, train
+    from model.dataset_index import default_index_dir
+    from model.distributed import DistributedContext
+    from model.shards import ShardedImageDataset, pack_dataset_splits, read_shard_records
+    from model.splits import load_or_create_split
+
+    dataset = LeafDiseaseDataset(str(bean_root))
+    split = load_or_create_split(dataset.samples, split_dir=default_index_dir())
+    shards_dir = tmp_path / "shards"
+    packed = pack_dataset_splits(dataset, split, str(shards_dir), samples_per_shard=2)
+    assert packed["test"]["samples"] == len(split.test) and len(packed["test"]["shards"]) == 3
+    assert [record["index"] for record in read_shard_records(str(shards_dir / "test"))] == split.test
+
+    streamed = ShardedImageDataset(str(shards_dir / "test"), with_keys=True)
+    assert [(label, row) for _, label, row in streamed] == [(dataset.samples[i][1], row) for row, i in enumerate(split.test)]
+    shuffled = ShardedImageDataset(str(shards_dir / "test"), shuffle=True, shuffle_buffer=3, seed=1)
+    first = [label for _, label in shuffled]
+    assert first == [label for _, label in shuffled] and sorted(first) == sorted(label for _, label, _ in streamed)
+
+    ranks = [ShardedImageDataset(str(shards_dir / "test"), context=DistributedContext(rank, 2, 2), even_ranks=True)
+             for rank in range(2)]
+    assert [len(list(rank)) for rank in ranks] == [len(rank) for rank in ranks] == [2, 2]
+
+    train.train_model(None, num_epochs=1, batch_size=2, output_dir=str(tmp_path / "out"), shards_dir=str(shards_dir))
+    sidecar = json.loads((tmp_path / "out" / "best_model.labels.json").read_text())
+    assert sidecar["split_hash"] == split.split_hash and sidecar["shards_dir"] == str(shards_dir)
+
+    report = evaluate.evaluate_model(
+        str(tmp_path / "out" / "best_model.pth"), shards_dir=str(shards_dir), eval_cache_dir=str(tmp_path / "eval"),
+        output_dir=str(tmp_path / "report"), plot=False)
+    assert report["samples"] == len(split.test)
+
+
+def test_integrity_scan_drops_corrupt_and_duplicate_images(bean_root, tmp_path):
+    from model.integrity_scan import build_clean_index
+
+    (bean_root / "healthy" / "healthy_90.png").write_bytes(b"\x89PNG\r\n\x1a\nbroken")
+    original = bean_root / "healthy" / "healthy_00.png"
+    (bean_root / "bean_rust" / "bean_rust_90.png").write_bytes(original.read_bytes())
+    image = Image.open(bean_root / "healthy" / "healthy_01.png")
+    image.resize((100, 80), Image.BILINEAR).save(bean_root / "angular_leaf_spot" / "angular_leaf_spot_90.png")
+
+    index_path = tmp_path / "clean.json"
+    result = build_clean_index(LeafDiseaseDataset(str(bean_root)), str(index_path), num_workers=2, max_distance=4)
+    dropped = {entry["path"].rsplit("/", 1)[-1]: entry for entry in result["dropped"]}
+    assert set(dropped) == {"healthy_90.png", "bean_rust_90.png", "angular_leaf_spot_90.png"}
+    assert dropped["healthy_90.png"]["reason"] == "corrupt"
+    assert dropped["bean_rust_90.png"]["reason"] == "duplicate" and dropped["bean_rust_90.png"]["label_conflict"]
+    assert dropped["angular_leaf_spot_90.png"]["reason"] == "near_duplicate"
+
+    assert build_clean_index(LeafDiseaseDataset(str(bean_root)), str(index_path), max_distance=4)["scanned"] == 0
+    clean = LeafDiseaseDataset(str(bean_root), clean_index=str(index_path))
+    assert len(clean) == 12 and not any("_90" in path for path, _ in clean.samples)
+
+
+def test_integrity_scan_keeps_repeated_manifest_paths(bean_root, tmp_path):
+    from types import SimpleNamespace
+
+    from model.integrity_scan import build_clean_index, filter_samples
+
+    first, second = str(bean_root / "healthy" / "healthy_00.png"), str(bean_root / "healthy" / "healthy_01.png")
+    copy = bean_root / "bean_rust" / "copy.png"
+    copy.write_bytes((bean_root / "healthy" / "healthy_00.png").read_bytes())
+    samples = [(first, 0), (second, 0), (first, 0), (str(copy), 1), (str(copy), 1)]
+    index_path = tmp_path / "clean.json"
+    dataset = SimpleNamespace(samples=samples, class_names=["bean:healthy", "bean:bean_rust"])
+
+    result = build_clean_index(dataset, str(index_path))
+    assert [(entry["path"], entry["occurrence"]) for entry in result["dropped"]] == [(str(copy), 0), (str(copy), 1)]
+    kept, positions = filter_samples(samples, str(index_path))
+    assert positions == [0, 1, 2] and kept == samples[:3]
+
+
+def test_streaming_manifest_splits_rows_and_reweights_by_rejection(tmp_path, small_train_model):
+    import torch
+
+    from model import train
+    from model.distributed import DistributedContext
+    from model.streaming_manifest import StreamingManifestDataset
+
+    rows = []
+    for idx in range(60):
+        class_name = BEAN_CLASSES[idx % 3]
+        (tmp_path / "images").mkdir(exist_ok=True)
+        Image.new("RGB", (8, 8), (idx, 0, 0)).save(tmp_path / "images" / f"leaf_{idx:02d}.png")
+        rows.append((f"images/leaf_{idx:02d}.png", "bean", class_name, "east" if idx % 4 < 2 else "west", "a"))
+    manifest = tmp_path / "stream.csv"
+    _write_manifest(manifest, rows)
+
+    keys = {}
+    for split in ("train", "val", "test"):
+        dataset = StreamingManifestDataset(str(manifest), split=split, with_keys=True)
+        keys[split] = [row for _, _, row in dataset]
+        assert len(keys[split]) == len(dataset) == dataset.total_samples
+    assert sorted(keys["train"] + keys["val"] + keys["test"]) == list(range(60))
+
+    profile = {"min_weight": 0.2, "max_weight": 2.0, "province_weights": {"east": 2.0, "west": 0.2}}
+    ranks = [
+        StreamingManifestDataset(str(manifest), split="train", sampling_profile=profile, shuffle=True,
+                                 reservoir_size=2, seed=3, context=DistributedContext(rank, 2, 2), with_keys=True)
+        for rank in range(2)
+    ]
+    drawn = [[row for _, _, row in rank] for rank in ranks]
+    assert [len(rows) for rows in drawn] == [len(rank) for rank in ranks] and len(drawn[0]) == len(drawn[1]) > 0
+    assert drawn[0] == [row for _, _, row in ranks[0]]
+    assert all(row % 2 == rank and row in keys["train"] for rank, rows in enumerate(drawn) for row in rows)
+    east = sum(row % 4 < 2 for rows in drawn for row in rows)
+    assert east > 0.75 * sum(len(rows) for rows in drawn)
+
+    train.train_model(None, num_epochs=1, batch_size=4, output_dir=str(tmp_path / "out"),
+                      manifest_path=str(manifest), stream_manifest=True)
+    sidecar = json.loads((tmp_path / "out" / "best_model.labels.json").read_text())
+    assert sidecar["split_hash"] == ranks[0].split.split_hash
+
+    (tmp_path / "images" / f"leaf_{keys['test'][0]:02d}.png").unlink()
+    missing = {row: image for image, _, row in StreamingManifestDataset(str(manifest), split="test", with_keys=True)}
+    assert list(missing) == keys["test"] and missing[keys["test"][0]].size == (224, 224)